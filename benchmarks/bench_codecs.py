@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks Environment round trips through the dicts used
+for JSON serialization, ie. toDict followed by construction from the
+dict, which is the work done on every feed encoded or decoded.
+
+It compares the toDict and fromDict methods compiled from the data
+structure schemas with the getattr and setattr loops they replaced,
+which are reproduced here as subclasses of the data structures.
+
+The feed used has the specified number of datastreams each holding the
+specified number of datapoints.
+
+$ bench_codecs.py --datastreams=10 --datapoints=100
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+from optparse import OptionParser
+from benchutil import best
+import txcosm
+from txcosm import DataFields
+
+
+parser = OptionParser("")
+parser.add_option("-s", "--datastreams", dest="datastreams", type="int", default=10, help="The number of datastreams in the feed")
+parser.add_option("-d", "--datapoints", dest="datapoints", type="int", default=100, help="The number of datapoints per datastream")
+parser.add_option("-i", "--iterations", dest="iterations", type="int", default=100, help="The number of round trips per run")
+parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="The number of times to repeat each benchmark")
+
+
+class LegacyUnit(txcosm.Unit):
+    """ A Unit using the loop based codec """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        self.label = None
+        self.type = None
+        self.symbol = None
+        self.fromDict(kwargs)
+
+    def toDict(self):
+        unitDict = dict()
+        for attribute in self._attributes:
+            attribute_value = getattr(self, attribute, None)
+            if attribute_value:
+                unitDict[attribute] = unicode(attribute_value)
+        return unitDict
+
+    def fromDict(self, inDict):
+        for attribute in self._attributes:
+            attribute_value = inDict.get(attribute, None)
+            if attribute_value:
+                if attribute == DataFields.Type:
+                    if attribute_value not in txcosm.Unit.Valid_Unit_Types:
+                        raise Exception("Invalid unit type \'%s\' not in %s" % (attribute_value,
+                                                                                txcosm.Unit.Valid_Unit_Types))
+                setattr(self, attribute, attribute_value)
+
+
+class LegacyDatapoint(txcosm.Datapoint):
+    """ A Datapoint using the loop based codec """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        self.at = None
+        self.value = None
+        self.fromDict(kwargs)
+
+    def toDict(self):
+        datapointDict = dict()
+        for attribute in self._attributes:
+            attribute_value = getattr(self, attribute, None)
+            if attribute_value:
+                datapointDict[attribute] = unicode(attribute_value)
+        return datapointDict
+
+    def fromDict(self, inDict):
+        for attribute in self._attributes:
+            attribute_value = inDict.get(attribute, None)
+            if attribute_value:
+                setattr(self, attribute, attribute_value)
+
+
+class LegacyLocation(txcosm.Location):
+    """ A Location using the loop based codec """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        self.disposition = None
+        self.domain = None
+        self.ele = None
+        self.exposure = None
+        self.lat = None
+        self.lon = None
+        self.name = None
+        self.waypoints = []
+        self.fromDict(kwargs)
+
+    def toDict(self):
+        locationDict = dict()
+        for attribute in self._attributes:
+            attribute_value = getattr(self, attribute, None)
+            if attribute_value:
+                if attribute == DataFields.Waypoints:
+                    locationDict[attribute] = list()
+                    for waypoint in attribute_value:
+                        locationDict[attribute].append(waypoint.toDict())
+                else:
+                    locationDict[attribute] = attribute_value
+        return locationDict
+
+    def fromDict(self, inDict):
+        for attribute in self._attributes:
+            attribute_value = inDict.get(attribute, None)
+            if attribute_value:
+                if attribute == DataFields.Disposition:
+                    if attribute_value not in txcosm.Location.Valid_Disposition_Kinds:
+                        raise Exception("Invalid disposition")
+                if attribute == DataFields.Domain:
+                    if attribute_value not in txcosm.Location.Valid_Domain_Kinds:
+                        raise Exception("Invalid domain")
+                if attribute == DataFields.Exposure:
+                    if attribute_value not in txcosm.Location.Valid_Exposure_Kinds:
+                        raise Exception("Invalid exposure")
+                if attribute == DataFields.Waypoints:
+                    waypoints = []
+                    for waypointKwargs in attribute_value:
+                        waypoints.append(txcosm.Waypoint(**waypointKwargs))
+                    setattr(self, attribute, waypoints)
+                else:
+                    setattr(self, attribute, attribute_value)
+
+
+class LegacyDatastream(txcosm.Datastream):
+    """ A Datastream using the loop based codec """
+
+    __slots__ = ()
+
+    def toDict(self):
+        datastreamDict = dict()
+        for attribute in self._attributes:
+            attribute_value = getattr(self, attribute, None)
+            if (attribute_value is not None) and (attribute_value != []):
+                if attribute == DataFields.Datapoints:
+                    datastreamDict[attribute] = list()
+                    for datapoint in attribute_value:
+                        datastreamDict[attribute].append(datapoint.toDict())
+                elif attribute == DataFields.Unit:
+                    datastreamDict[attribute] = attribute_value.toDict()
+                else:
+                    datastreamDict[attribute] = unicode(attribute_value)
+        return datastreamDict
+
+    def fromDict(self, inDict):
+        for attribute in self._attributes:
+            attribute_value = inDict.get(attribute, None)
+            if (attribute_value is not None) and (attribute_value != []):
+                if attribute == DataFields.Datapoints:
+                    if not hasattr(self, DataFields.Datapoints):
+                        setattr(self, attribute, list())
+                    datapoints = getattr(self, DataFields.Datapoints)
+                    for datapointsKwargs in attribute_value:
+                        datapoints.append(LegacyDatapoint(**datapointsKwargs))
+                    setattr(self, attribute, datapoints)
+                elif attribute == DataFields.Unit:
+                    setattr(self, attribute, LegacyUnit(**attribute_value))
+                else:
+                    setattr(self, attribute, attribute_value)
+
+
+class LegacyEnvironment(txcosm.Environment):
+    """ An Environment using the loop based codec """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        self.creator = None
+        self.datastreams = {}
+        self.description = None
+        self.feed = None
+        self.icon = None
+        self.id = None
+        self.location = None
+        self.private = None
+        self.status = None
+        self.tags = None
+        self.title = None
+        self.updated = None
+        self.version = txcosm.version
+        self.website = None
+        self.fromDict(kwargs)
+
+    def toDict(self):
+        environmentDict = dict()
+        for attribute in self._attributes:
+            attribute_value = getattr(self, attribute, None)
+            if attribute_value:
+                if attribute == DataFields.Id:
+                    environmentDict[attribute] = attribute_value
+                elif attribute == DataFields.Location:
+                    environmentDict[attribute] = self.location.toDict()
+                elif attribute == DataFields.Datastreams:
+                    datastreams = []
+                    for datastream_id, datastream in self.datastreams.items():
+                        datastreams.append(datastream.toDict())
+                        environmentDict[DataFields.Datastreams] = datastreams
+                else:
+                    environmentDict[attribute] = attribute_value
+        return environmentDict
+
+    def fromDict(self, inDict):
+        for attribute in self._attributes:
+            attribute_value = inDict.get(attribute, None)
+            if attribute_value:
+                if attribute == DataFields.Location:
+                    setattr(self, attribute, LegacyLocation(**attribute_value))
+                elif attribute == DataFields.Datastreams:
+                    if not hasattr(self, DataFields.Datastreams):
+                        setattr(self, attribute, dict())
+                    datastreams = getattr(self, DataFields.Datastreams)
+                    for datastreamKwargs in attribute_value:
+                        datastream = LegacyDatastream(**datastreamKwargs)
+                        datastreams[datastream.id] = datastream
+                else:
+                    setattr(self, attribute, attribute_value)
+
+
+def makeFeed(datastreams, datapoints):
+    """ Return the dict of a feed with the specified number of datastreams and datapoints """
+    return {"id": 1234,
+            "title": "Benchmark",
+            "status": "live",
+            "updated": "2010-07-02T10:21:57.101496Z",
+            "version": "1.0.0",
+            "location": {"name": "Office", "lat": 51.5, "lon": -0.1,
+                         "exposure": "indoor", "domain": "physical", "disposition": "fixed"},
+            "datastreams": [{"id": str(i),
+                             "current_value": "23.5",
+                             "at": "2010-07-02T10:21:57.101496Z",
+                             "max_value": "40.0",
+                             "min_value": "10.0",
+                             "unit": {"label": "Celsius", "symbol": "C", "type": "derivedSI"},
+                             "datapoints": [{"at": "2010-07-02T10:21:%02d.%06dZ" % (j % 60, j),
+                                             "value": "%d.5" % j} for j in xrange(datapoints)]}
+                            for i in xrange(datastreams)]}
+
+
+def roundTrips(environment, iterations):
+    """ Convert an environment to a dict and back a number of times """
+    structure = environment.__class__
+    for j in xrange(iterations):
+        environment = structure(**environment.toDict())
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    feed = makeFeed(options.datastreams, options.datapoints)
+    if LegacyEnvironment(**feed).toDict() != txcosm.Environment(**feed).toDict():
+        raise Exception("Codec outputs differ")
+
+    print "%d datastreams, %d datapoints each, %d round trips, best of %d runs" % (options.datastreams,
+                                                                                  options.datapoints,
+                                                                                  options.iterations,
+                                                                                  options.repeat)
+    legacy_time = best(lambda environment: roundTrips(environment, options.iterations), options.repeat,
+                       setup=lambda: LegacyEnvironment(**feed))
+    schema_time = best(lambda environment: roundTrips(environment, options.iterations), options.repeat,
+                       setup=lambda: txcosm.Environment(**feed))
+    print "%-10s %14s %14s %10s" % ("structure", "loops (ms)", "schema (ms)", "speedup")
+    print "%-10s %14.1f %14.1f %9.1fx" % ("feed", legacy_time * 1000, schema_time * 1000,
+                                          legacy_time / schema_time)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the encoding and decoding of datastream
+histories using the JSON and CSV formats.
+
+JSON histories are converted through a dict per datapoint whereas CSV
+histories are converted directly between rows and datapoints. The size
+of each encoded history is also reported.
+
+The history used has the specified number of datapoints.
+
+$ bench_csv.py --datapoints=10000
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+from optparse import OptionParser
+from benchutil import best
+import txcosm
+from txcosm import DataFormats
+
+
+parser = OptionParser("")
+parser.add_option("-d", "--datapoints", dest="datapoints", type="int", default=10000, help="The number of datapoints in the history")
+parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="The number of times to repeat each benchmark")
+
+
+def makeDatastream(datapoints):
+    """ Return a datastream holding a history with the specified number of datapoints """
+    return txcosm.Datastream(id="temperature",
+                             datapoints=[{"at": "2010-07-02T10:%02d:%02d.%06dZ" % (j // 3600 % 60, j // 60 % 60, j),
+                                          "value": "%d.5" % j} for j in xrange(datapoints)])
+
+
+def decode(data, format):
+    """ Decode a history into a new datastream """
+    datastream = txcosm.Datastream()
+    datastream.decode(data, format=format)
+    return datastream
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    datastream = makeDatastream(options.datapoints)
+    encoded = dict()
+    for format in [DataFormats.JSON, DataFormats.CSV]:
+        encoded[format] = datastream.encode(format=format)
+        if decode(encoded[format], format).toDict()['datapoints'] != datastream.toDict()['datapoints']:
+            raise Exception("%s round trip mismatch" % format)
+
+    print "%d datapoints, best of %d runs" % (options.datapoints, options.repeat)
+    print "%-10s %12s %12s %12s %12s" % ("format", "size (KB)", "encode (ms)", "decode (ms)", "total (ms)")
+    for format in [DataFormats.JSON, DataFormats.CSV]:
+        encode_time = best(lambda: datastream.encode(format=format), options.repeat)
+        decode_time = best(lambda: decode(encoded[format], format), options.repeat)
+        print "%-10s %12.1f %12.1f %12.1f %12.1f" % (format, len(encoded[format]) / 1024.0,
+                                                     encode_time * 1000, decode_time * 1000,
+                                                     (encode_time + decode_time) * 1000)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the framing of messages received from the PAWS
+service when they arrive split into many segments.
+
+It compares the PAWSProtocol, which holds the parts of a message in a
+list and only scans newly received data for the delimiter, with the
+previous implementation, reproduced here, which appended each segment
+to a string buffer and split the whole buffer. The previous
+implementation takes time quadratic in the number of segments a message
+is split into, so it is skipped when the number of segments exceeds the
+specified limit.
+
+$ bench_framing.py --sizes=10240,102400,1048576,10485760 --chunks=1,1024,65536
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+from optparse import OptionParser
+from benchutil import best
+from txcosm.PAWSClient import PAWSProtocol
+
+
+parser = OptionParser("")
+parser.add_option("-s", "--sizes", dest="sizes", default="10240,102400,1048576,10485760", help="Comma separated message sizes in bytes")
+parser.add_option("-c", "--chunks", dest="chunks", default="1,1024,65536", help="Comma separated segment sizes in bytes")
+parser.add_option("-l", "--legacy-limit", dest="legacy_limit", type="int", default=100000, help="The maximum number of segments fed to the previous implementation")
+parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="The number of times to repeat each benchmark")
+
+
+class LegacyPAWSProtocol(PAWSProtocol):
+    """ A PAWSProtocol using the string buffer based framing """
+
+    def __init__(self):
+        self.buffer = ""
+
+    def dataReceived(self, data):
+        self.buffer += data
+        if PAWSProtocol.delimiter in self.buffer:
+            msgs = self.buffer.split(PAWSProtocol.delimiter)
+            for msg in msgs[:-1]:
+                self.factory.messageReceived(msg)
+            self.buffer = msgs[-1]
+
+
+class Factory(object):
+    """ Counts the messages passed on by a protocol """
+
+    def __init__(self):
+        self.messages = 0
+
+    def messageReceived(self, msg):
+        self.messages += 1
+
+
+def makeProtocol(protocolClass):
+    """ Return a protocol connected to a factory counting its messages """
+    protocol = protocolClass()
+    protocol.factory = Factory()
+    return protocol
+
+
+def frame(protocol, segments):
+    """ Frame the segments of a message """
+    dataReceived = protocol.dataReceived
+    for segment in segments:
+        dataReceived(segment)
+    if protocol.factory.messages != 1:
+        raise Exception("Message not framed")
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    print "best of %d runs" % options.repeat
+    print "%12s %10s %10s %14s %14s %10s" % ("message (B)", "chunk (B)", "segments",
+                                             "previous (ms)", "linear (ms)", "speedup")
+    for size in [int(s) for s in options.sizes.split(',')]:
+        message = "x" * size + PAWSProtocol.delimiter
+        for chunk in [int(c) for c in options.chunks.split(',')]:
+            segments = [message[i:i + chunk] for i in xrange(0, len(message), chunk)]
+            linear_time = best(lambda protocol: frame(protocol, segments), options.repeat,
+                               setup=lambda: makeProtocol(PAWSProtocol))
+            if len(segments) <= options.legacy_limit:
+                legacy_time = best(lambda protocol: frame(protocol, segments), options.repeat,
+                                   setup=lambda: makeProtocol(LegacyPAWSProtocol))
+                print "%12d %10d %10d %14.1f %14.1f %9.1fx" % (size, chunk, len(segments),
+                                                               legacy_time * 1000, linear_time * 1000,
+                                                               legacy_time / linear_time)
+            else:
+                print "%12d %10d %10d %14s %14.1f %10s" % (size, chunk, len(segments),
+                                                           "-", linear_time * 1000, "-")
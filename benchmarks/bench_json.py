@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the JSON backends that txcosm can use.
+
+Each backend that is installed, and produces the same output as the json
+module, is timed encoding and decoding two typical payloads: a feed with
+the specified number of datastreams each holding the specified number of
+datapoints, and the small message delivered by the PAWS service for each
+subscription update.
+
+$ bench_json.py --datastreams=10 --datapoints=100
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+from optparse import OptionParser
+from benchutil import best, iterate
+import txcosm
+from txcosm import JSONBackend
+
+
+parser = OptionParser("")
+parser.add_option("-s", "--datastreams", dest="datastreams", type="int", default=10, help="The number of datastreams in the feed")
+parser.add_option("-d", "--datapoints", dest="datapoints", type="int", default=100, help="The number of datapoints per datastream")
+parser.add_option("-i", "--iterations", dest="iterations", type="int", default=1000, help="The number of encodes and decodes per run")
+parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="The number of times to repeat each benchmark")
+
+
+def makeFeed(datastreams, datapoints):
+    """ Return the dict of a feed with the specified number of datastreams and datapoints """
+    return txcosm.Environment(id=1234,
+                              title="Benchmark",
+                              status="live",
+                              updated="2010-07-02T10:21:57.101496Z",
+                              location={"name": "Office", "lat": 51.5, "lon": -0.1},
+                              datastreams=[{"id": str(i),
+                                            "current_value": "23.5",
+                                            "at": "2010-07-02T10:21:57.101496Z",
+                                            "unit": {"label": "Celsius", "symbol": "C"},
+                                            "datapoints": [{"at": "2010-07-02T10:21:%02d.%06dZ" % (j % 60, j),
+                                                            "value": "%d.5" % j} for j in xrange(datapoints)]}
+                                           for i in xrange(datastreams)]).toDict()
+
+
+def makeSubscriptionMessage():
+    """ Return the dict of a PAWS subscription update message """
+    return {"token": "2c9e8a72-c4a9-11e1-9b21-0800200c9a66",
+            "resource": "/feeds/1234/datastreams/temperature",
+            "body": {"id": "temperature",
+                     "current_value": "23.5",
+                     "at": "2010-07-02T10:21:57.101496Z",
+                     "max_value": "40.0",
+                     "min_value": "10.0",
+                     "version": "1.0.0"}}
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    payloads = [("feed", makeFeed(options.datastreams, options.datapoints), max(1, options.iterations // 100)),
+                ("message", makeSubscriptionMessage(), options.iterations)]
+
+    print "%d datastreams, %d datapoints each, best of %d runs" % (options.datastreams,
+                                                                   options.datapoints,
+                                                                   options.repeat)
+    print "%-12s %-10s %12s %14s %14s" % ("backend", "payload", "iterations", "encode (us)", "decode (us)")
+    for backend in JSONBackend.availableBackends():
+        JSONBackend.setBackend(backend)
+        for name, payload, iterations in payloads:
+            document = JSONBackend.dumps(payload)
+            encode_time = best(lambda: iterate(JSONBackend.dumps, payload, iterations), options.repeat)
+            decode_time = best(lambda: iterate(JSONBackend.loads, document, iterations), options.repeat)
+            print "%-12s %-10s %12d %14.1f %14.1f" % (backend, name, iterations,
+                                                      encode_time / iterations * 1000000,
+                                                      decode_time / iterations * 1000000)
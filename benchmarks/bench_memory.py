@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the memory used by the data structures that are
+created in large numbers when decoding feed lists and datastream history.
+
+It compares the previous layout, where every instance carried a dict and
+built its own list of attribute names, with the __slots__ based layout
+now used. The previous layout is reproduced by the LegacyDatapoint class
+below.
+
+Sizes are measured with sys.getsizeof and include the instance, its dict
+and its attribute list but not the attribute values, which are the same
+in both layouts.
+
+$ bench_memory.py --datapoints=100000
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+from optparse import OptionParser
+import sys
+import time
+import txcosm
+
+
+parser = OptionParser("")
+parser.add_option("-n", "--datapoints", dest="datapoints", type="int", default=100000, help="The number of datapoints to create")
+
+
+class LegacyDatapoint(object):
+    """ A Datapoint with the previous per instance dict layout """
+
+    def __init__(self, **kwargs):
+        self._attributes = [txcosm.DataFields.At,
+                            txcosm.DataFields.Value]
+        self.at = None
+        self.value = None
+        for attribute in self._attributes:
+            attribute_value = kwargs.get(attribute, None)
+            if attribute_value:
+                setattr(self, attribute, attribute_value)
+
+
+def instance_size(obj):
+    """ Return the bytes used by an instance excluding its attribute values """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+        if '_attributes' in obj.__dict__:
+            size += sys.getsizeof(obj.__dict__['_attributes'])
+    return size
+
+
+def bench(datapointClass, count):
+    """ Create datapoints and return the creation time and bytes per datapoint """
+    start = time.time()
+    datapoints = [datapointClass(at="2012-01-01T00:00:00Z", value="1") for i in xrange(count)]
+    elapsed = time.time() - start
+    size = sum([instance_size(datapoint) for datapoint in datapoints]) / float(count)
+    return elapsed, size
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    print "%d datapoints" % options.datapoints
+    print "%-10s %16s %14s" % ("layout", "bytes/datapoint", "create (ms)")
+    for name, datapointClass in [("dict", LegacyDatapoint), ("slots", txcosm.Datapoint)]:
+        elapsed, size = bench(datapointClass, options.datapoints)
+        print "%-10s %16.1f %14.1f" % (name, size, elapsed * 1000)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the request timeout bookkeeping used by the
+HTTP client.
+
+It compares the previous approach, where every request generated a
+uuid4 identifier, scheduled its own reactor.callLater and was recorded
+in three dicts, with the timer wheel and integer request identifiers
+now used.
+
+Each run starts a timeout for the specified number of concurrent
+requests and then cancels them all, as happens when the responses
+arrive in time. The reactor is never run.
+
+$ bench_timeouts.py --requests=50000
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+import itertools
+from optparse import OptionParser
+import time
+import uuid
+from twisted.internet import reactor
+from txcosm.TimerWheel import TimerWheel
+
+
+parser = OptionParser("")
+parser.add_option("-n", "--requests", dest="requests", type="int", default=50000, help="The number of concurrent requests")
+parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="The number of times to repeat each benchmark")
+
+
+def timeout_handler(request_id):
+    pass
+
+
+def bench_callLater(count, timeout=10.0):
+    """ Per request uuid4, reactor.callLater and three dicts """
+    pendingRequests = {}
+    pendingResponses = {}
+    pendingTimeouts = {}
+
+    start = time.time()
+    for i in xrange(count):
+        request_id = uuid.uuid4().hex
+        pendingRequests[request_id] = None
+        pendingTimeouts[request_id] = reactor.callLater(timeout, timeout_handler, request_id)
+        pendingResponses[request_id] = None
+    scheduled = time.time()
+    delayed_calls = len(reactor.getDelayedCalls())
+
+    for request_id in pendingRequests.keys():
+        del pendingRequests[request_id]
+        pendingTimeouts.pop(request_id).cancel()
+        del pendingResponses[request_id]
+    finished = time.time()
+    return (scheduled - start, finished - scheduled, delayed_calls)
+
+
+def bench_timerWheel(count, timeout=10.0):
+    """ Integer request ids, a timer wheel and a single dict """
+    wheel = TimerWheel()
+    request_ids = itertools.count(1)
+    pendingRequests = {}
+
+    start = time.time()
+    for i in xrange(count):
+        request_id = next(request_ids)
+        pendingRequests[request_id] = [None, None, wheel.schedule(timeout, timeout_handler, request_id)]
+    scheduled = time.time()
+    delayed_calls = len(reactor.getDelayedCalls())
+
+    for request_id in pendingRequests.keys():
+        wheel.cancel(pendingRequests.pop(request_id)[2])
+    finished = time.time()
+    return (scheduled - start, finished - scheduled, delayed_calls)
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    print "%d concurrent requests, best of %d runs" % (options.requests, options.repeat)
+    print "%-12s %12s %12s %14s" % ("approach", "start (ms)", "cancel (ms)", "delayed calls")
+    for name, bench in [("callLater", bench_callLater), ("timer wheel", bench_timerWheel)]:
+        results = [bench(options.requests) for i in range(options.repeat)]
+        start_time = min([r[0] for r in results])
+        cancel_time = min([r[1] for r in results])
+        delayed_calls = max([r[2] for r in results])
+        print "%-12s %12.1f %12.1f %14d" % (name, start_time * 1000, cancel_time * 1000, delayed_calls)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the conversion of datapoint timestamps between
+ISO8601 strings and seconds since the epoch.
+
+It compares the strptime and strftime based conversions that were
+previously needed for any time arithmetic with the txcosm ISO8601 codec,
+which caches the conversion of the whole second prefix of a timestamp.
+
+The timestamps used are those of a datastream history with the specified
+number of datapoints per second.
+
+$ bench_timestamps.py --timestamps=100000 --per-second=10
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+import calendar
+from optparse import OptionParser
+import time
+from benchutil import best, each
+from txcosm import ISO8601
+
+
+parser = OptionParser("")
+parser.add_option("-n", "--timestamps", dest="timestamps", type="int", default=100000, help="The number of timestamps to convert")
+parser.add_option("-p", "--per-second", dest="per_second", type="int", default=10, help="The number of datapoints per second")
+parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="The number of times to repeat each benchmark")
+
+
+def strptime_parse(timestamp):
+    """ Parse a timestamp using strptime """
+    prefix, fraction = timestamp.rstrip('Z').split('.')
+    return calendar.timegm(time.strptime(prefix, "%Y-%m-%dT%H:%M:%S")) + float('0.' + fraction)
+
+
+def strftime_format(seconds):
+    """ Format a timestamp using strftime """
+    whole = int(seconds)
+    return "%s.%06dZ" % (time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(whole)),
+                         int(round((seconds - whole) * 1000000)))
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    start = 1278066117.0
+    seconds = [start + float(i) / options.per_second for i in xrange(options.timestamps)]
+    timestamps = ISO8601.formatTimestamps(seconds)
+
+    print "%d timestamps, %d per second, best of %d runs" % (options.timestamps,
+                                                             options.per_second,
+                                                             options.repeat)
+    print "%-10s %14s %14s %10s" % ("operation", "strptime (ms)", "ISO8601 (ms)", "speedup")
+    for name, baseline, codec, data in [("parse", strptime_parse, ISO8601.parseTimestamp, timestamps),
+                                        ("format", strftime_format, ISO8601.formatTimestamp, seconds)]:
+        baseline_time = best(lambda: each(baseline, data), options.repeat)
+        codec_time = best(lambda: each(codec, data), options.repeat)
+        print "%-10s %14.1f %14.1f %9.1fx" % (name, baseline_time * 1000, codec_time * 1000,
+                                              baseline_time / codec_time)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+This script benchmarks the preparation of the request body for a batch
+of datapoints uploaded with create_datapoints.
+
+It compares the previous path, which built a dict for every datapoint,
+encoded the dicts with the JSON library and copied the document through
+a file object for a FileBodyProducer, with the direct path that formats
+the JSON (or CSV) body straight from the datapoints, or from the arrays
+of a columnar datastream, for a StringBodyProducer.
+
+$ bench_upload.py --datapoints=500
+
+txcosm must be installed or visible on the PYTHONPATH.
+"""
+
+from optparse import OptionParser
+from StringIO import StringIO
+from benchutil import best, iterate
+import txcosm
+from txcosm import DataFields, JSONBackend
+from txcosm.HTTPClient import StringBodyProducer
+
+
+parser = OptionParser("")
+parser.add_option("-d", "--datapoints", dest="datapoints", type="int", default=500, help="The number of datapoints in a batch")
+parser.add_option("-i", "--iterations", dest="iterations", type="int", default=200, help="The number of bodies prepared per run")
+parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3, help="The number of times to repeat each benchmark")
+
+
+class Consumer(object):
+    """ A consumer that discards the data written to it """
+
+    def write(self, data):
+        pass
+
+
+def dictBody(datapoints):
+    """ Prepare a body using the dict based path """
+    data = JSONBackend.dumps({DataFields.Datapoints: [datapoint.toDict() for datapoint in datapoints]})
+    inputFile = StringIO(data)
+    consumer = Consumer()
+    chunk = inputFile.read(2 ** 16)
+    while chunk:
+        consumer.write(chunk)
+        chunk = inputFile.read(2 ** 16)
+
+
+def jsonBody(datapoints):
+    """ Prepare a body using the direct JSON path """
+    StringBodyProducer(txcosm.datapointsToJson(datapoints)).startProducing(Consumer())
+
+
+def csvBody(datapoints):
+    """ Prepare a body using the direct CSV path """
+    StringBodyProducer(txcosm.datapointsToCsv(datapoints)).startProducing(Consumer())
+
+
+if __name__ == "__main__":
+
+    (options, args) = parser.parse_args()
+
+    datastream = txcosm.Datastream(datapoints=[{"at": "2012-01-01T00:%02d:%02d.%06dZ" % (j // 60 % 60, j % 60, j),
+                                                "value": "%d.5" % j} for j in xrange(options.datapoints)])
+    columnar = txcosm.Datastream(columnar=True)
+    columnar.datapoints.extend(datastream.datapoints)
+
+    print "%d datapoints per batch, %d batches, best of %d runs" % (options.datapoints,
+                                                                   options.iterations,
+                                                                   options.repeat)
+    print "%-10s %-8s %16s %10s" % ("store", "path", "per batch (us)", "speedup")
+    for store, datapoints in [("list", datastream.datapoints), ("columnar", columnar.datapoints)]:
+        dict_time = None
+        for path, function in [("dict", dictBody), ("json", jsonBody), ("csv", csvBody)]:
+            path_time = best(lambda: iterate(function, datapoints, options.iterations), options.repeat)
+            dict_time = dict_time or path_time
+            print "%-10s %-8s %16.1f %9.1fx" % (store, path, path_time / options.iterations * 1000000,
+                                                dict_time / path_time)
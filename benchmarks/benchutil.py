@@ -0,0 +1,52 @@
+
+"""
+This module holds the timing helpers shared by the benchmark scripts.
+
+The scripts import it from the benchmarks directory, which Python places
+on the path when a script is run.
+"""
+
+import time
+
+
+def best(function, repeat, setup=None):
+    """
+    Return the best time, in seconds, taken by a function over a number
+    of runs.
+
+    @param function: The function to time. It is passed the result of
+      setup when setup is given.
+    @type function: callable
+    @param repeat: The number of runs
+    @type repeat: int
+    @param setup: A function called, untimed, before each run to create
+      the state the run uses.
+    @type setup: callable
+    """
+    times = []
+    for i in range(repeat):
+        if setup is None:
+            start = time.time()
+            function()
+        else:
+            state = setup()
+            start = time.time()
+            function(state)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def iterate(function, argument, iterations):
+    """
+    Call a function with the same argument a number of times
+    """
+    for i in xrange(iterations):
+        function(argument)
+
+
+def each(function, items):
+    """
+    Call a function with each of the items
+    """
+    for item in items:
+        function(item)
@@ -0,0 +1,821 @@
+#!/usr/bin/env python
+
+'''
+This simple script provides test cases that exercise the HTTP client
+machinery without communicating with Cosm.
+
+txcosm must be installed or visible on the PYTHONPATH.
+'''
+
+import datetime
+import json
+import unittest
+import zlib
+from StringIO import StringIO
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+from urlparse import urlparse, parse_qs
+from twisted.internet.error import ConnectionRefusedError
+from twisted.web.client import ContentDecoderAgent, ResponseDone, ResponseFailed
+from twisted.web.http_headers import Headers
+from txcosm.HTTPClient import HTTPClient, ConnectionPool, getSharedPool
+import txcosm
+from txcosm.CoalescingWriter import CoalescingWriter
+from txcosm.RequestScheduler import Priority, RequestScheduler
+from txcosm.ResponseCache import ResponseCache
+from txcosm import StreamingDecoder
+from txcosm.StreamingDecoder import JSONArrayDecoder, XMLElementDecoder
+from txcosm.TimerWheel import TimerWheel
+
+
+class FakeResponse(object):
+    """ A canned response delivered by the FakeAgent """
+
+    def __init__(self, code=200, body="", headers=None, chunk_size=None, reason=None):
+        self.code = code
+        self.reason = reason or ResponseDone()
+        self.phrase = "OK"
+        self.headers = Headers(headers or {})
+        self.body = body
+        self.chunk_size = chunk_size or max(1, len(body))
+
+    def deliverBody(self, protocol):
+        for i in range(0, len(self.body), self.chunk_size):
+            protocol.dataReceived(self.body[i:i + self.chunk_size])
+        protocol.connectionLost(Failure(self.reason))
+
+
+class FakeConsumer(object):
+    """ Records the data written by a body producer """
+
+    def __init__(self, written):
+        self.written = written
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class FakeAgent(object):
+    """ Records requests and returns deferreds that are fired by the test """
+
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        d = defer.Deferred()
+        self.requests.append((method, uri, headers, bodyProducer, d))
+        return d
+
+
+def makeClient(clock):
+    """ Return a HTTPClient that uses a fake agent and the supplied clock """
+    client = HTTPClient(api_key="key", feed_id="1234",
+                        scheduler=RequestScheduler())
+    client.agent = FakeAgent()
+    client.timers = TimerWheel()
+    client.timers.clock = clock
+    client.scheduler.clock = clock
+    return client
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def test_SharedPool(self):
+        """ Check clients share a connection pool by default """
+        client_1 = HTTPClient()
+        client_2 = HTTPClient()
+        self.assertTrue(client_1.pool is client_2.pool, "Clients do not share a pool")
+        self.assertTrue(client_1.pool is getSharedPool(), "Client pool is not the shared pool")
+
+        pool = ConnectionPool(max_persistent_per_host=3, idle_timeout=30)
+        client_3 = HTTPClient(pool=pool)
+        self.assertTrue(client_3.pool is pool, "Client pool argument ignored")
+        self.assertEqual(pool.maxPersistentPerHost, 3, "Pool max persistent mismatch")
+        self.assertEqual(pool.cachedConnectionTimeout, 30, "Pool idle timeout mismatch")
+
+    def test_PoolStats(self):
+        """ Check connection pool statistics """
+        pool = ConnectionPool()
+        client = HTTPClient(pool=pool)
+        stats = client.pool_stats
+        self.assertEqual(stats['requests'], 0, "Unexpected request count")
+        self.assertEqual(stats['connections_created'], 0, "Unexpected connections count")
+        self.assertEqual(stats['idle_connections'], {}, "Unexpected idle connections")
+
+
+class RequestSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = RequestScheduler(max_per_host=2, max_per_key=2)
+        self.clock = task.Clock()
+        self.scheduler.clock = self.clock
+        self.sent = []
+
+    def _submit(self, name, priority, host="api.cosm.com", api_key="key"):
+        """ Submit a request that completes when its deferred is fired """
+        request_d = defer.Deferred()
+
+        def requestFactory():
+            self.sent.append(name)
+            return request_d
+
+        d = self.scheduler.submit(host, api_key, priority, requestFactory)
+        return request_d, d
+
+    def test_InFlightLimit(self):
+        """ Check requests beyond the in-flight limits are queued """
+        requests = [self._submit(i, Priority.Normal) for i in range(5)]
+        self.assertEqual(self.sent, [0, 1], "In-flight limit not applied")
+        self.assertEqual(self.scheduler.stats()['queued'], 3, "Queue depth mismatch")
+
+        # a different host and key is not held up by the busy host
+        self._submit('other', Priority.Normal, host="other.cosm.com", api_key="other")
+        self.assertEqual(self.sent, [0, 1, 'other'], "Unrelated request was queued")
+
+        results = []
+        requests[0][1].addCallback(results.append)
+        self.clock.advance(1.5)
+        requests[0][0].callback('done')
+        self.assertEqual(results, ['done'], "Request result not returned")
+        self.assertEqual(self.sent, [0, 1, 'other', 2], "Queued request not sent")
+        self.assertEqual(self.scheduler.stats()['max_wait'], 1.5, "Wait time mismatch")
+
+    def test_Priority(self):
+        """ Check higher priority requests jump the queue """
+        first = self._submit('bulk-0', Priority.Bulk)
+        self._submit('bulk-1', Priority.Bulk)
+        self._submit('bulk-2', Priority.Bulk)
+        self._submit('interactive', Priority.Interactive)
+        self.assertEqual(self.scheduler.stats()['queued_by_priority'][Priority.Interactive], 1,
+                         "Queue depth by priority mismatch")
+        first[0].callback(None)
+        self.assertEqual(self.sent, ['bulk-0', 'bulk-1', 'interactive'], "Priority not honoured")
+
+
+class TimerWheelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(tick=0.1, size=8)
+        self.wheel.clock = self.clock
+        self.fired = []
+
+    def test_Expiry(self):
+        """ Check timers fire once they are due, including after a revolution """
+        self.wheel.schedule(0.25, self.fired.append, 'short')
+        self.wheel.schedule(1.0, self.fired.append, 'long')
+        self.clock.pump([0.1] * 3)
+        self.assertEqual(self.fired, ['short'], "Short timer did not fire")
+        self.clock.pump([0.1] * 6)
+        self.assertEqual(self.fired, ['short'], "Long timer fired early")
+        self.clock.pump([0.1] * 2)
+        self.assertEqual(self.fired, ['short', 'long'], "Long timer did not fire")
+        self.assertEqual(self.wheel.pending, 0, "Unexpected pending timers")
+        self.assertEqual(self.clock.getDelayedCalls(), [], "Wheel still ticking")
+
+    def test_NotEarly(self):
+        """ Check timers scheduled part way through a tick do not fire early """
+        self.wheel.schedule(1.0, self.fired.append, 'running')
+        self.clock.advance(0.05)
+        self.wheel.schedule(0.1, self.fired.append, 'late')
+        self.clock.advance(0.05)
+        self.assertEqual(self.fired, [], "Timer fired early")
+        self.clock.advance(0.1)
+        self.assertEqual(self.fired, ['late'], "Timer fired more than one tick late")
+
+    def test_ScheduleFromCallback(self):
+        """ Check timers scheduled by an expiring timer fire on time from a single tick """
+        def expired():
+            self.fired.append(('first', self.clock.seconds()))
+            self.wheel.schedule(1.0, lambda: self.fired.append(('second', self.clock.seconds())))
+            self.assertEqual(len(self.clock.getDelayedCalls()), 0, "Wheel restarted while advancing")
+
+        self.wheel.schedule(0.1, expired)
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1, "Wheel not ticking once")
+        for i in range(40):
+            self.clock.advance(0.05)
+            self.assertTrue(len(self.clock.getDelayedCalls()) <= 1, "More than one tick scheduled")
+        name, fired_at = self.fired[-1]
+        self.assertEqual(name, 'second', "Timer scheduled from a callback did not fire")
+        self.assertTrue(1.1 - 1e-6 <= fired_at <= 1.2 + 1e-6, "Timer fired at %s" % fired_at)
+        self.assertEqual(self.clock.getDelayedCalls(), [], "Wheel still ticking")
+
+    def test_Cancel(self):
+        """ Check cancelled timers do not fire """
+        handle = self.wheel.schedule(0.2, self.fired.append, 'cancelled')
+        self.wheel.schedule(0.3, self.fired.append, 'kept')
+        self.wheel.cancel(handle)
+        self.wheel.cancel(handle)
+        self.clock.advance(1.0)
+        self.assertEqual(self.fired, ['kept'], "Cancelled timer fired")
+
+    def test_RequestTimeout(self):
+        """ Check client requests are timed out and responses delivered """
+        client = makeClient(self.clock)
+        client.request_timeout = 1.0
+        results = []
+        client.read_feed().addCallback(results.append)
+        client.read_feed().addCallback(results.append)
+        self.assertEqual(len(client.pendingRequests), 2, "Pending request count mismatch")
+
+        # first request is answered, second times out
+        client.agent.requests[0][-1].callback(FakeResponse(body='{"id": 1234}'))
+        self.assertEqual(results[0].id, 1234, "Response not delivered")
+        self.clock.pump([0.1] * 11)
+        self.assertEqual(results[1], None, "Timeout not reported")
+        self.assertEqual(client.pendingRequests, {}, "Pending requests not cleaned up")
+
+    def test_RequestFailure(self):
+        """ Check failed requests and response bodies are reported and release their slot """
+        client = makeClient(self.clock)
+        results = []
+        client.read_feed().addCallback(results.append)
+        client.read_feed().addCallback(results.append)
+        client.agent.requests[0][-1].callback(FakeResponse(body='{"id": 1234}',
+                                                           reason=ResponseFailed([Failure(Exception("lost"))])))
+        client.agent.requests[1][-1].errback(ConnectionRefusedError())
+        self.assertEqual(results, [None, None], "Failures not reported")
+        self.assertEqual(client.pendingRequests, {}, "Pending requests not cleaned up")
+        self.assertEqual(client.timers.pending, 0, "Timeouts not cancelled")
+        self.assertEqual(client.scheduler.stats()['in_flight'], 0, "Scheduler slots not released")
+
+        def refuse(**kwargs):
+            raise ConnectionRefusedError()
+        client.agent.request = refuse
+        client.read_feed().addCallback(results.append)
+        self.assertEqual(results[-1], None, "Agent error not reported")
+        self.assertEqual((client.pendingRequests, client.timers.pending), ({}, 0), "Failed request not cleaned up")
+        self.clock.pump([0.1] * 200)
+
+
+class CompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+
+    def test_CompressedResponse(self):
+        """ Check gzip and deflate responses are decoded and counted """
+        fakeAgent = self.client.agent
+        self.client.agent = ContentDecoderAgent(fakeAgent,
+                                                [('gzip', self.client._gzipDecoder),
+                                                 ('deflate', self.client._deflateDecoder)])
+        body = '{"id": 1234, "title": "%s"}' % ("x" * 1000)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        gzipped = compressor.compress(body) + compressor.flush()
+
+        results = []
+        self.client.read_feed().addCallback(results.append)
+        headers = fakeAgent.requests[0][2]
+        self.assertEqual(headers.getRawHeaders('Accept-Encoding'), ['gzip,deflate'],
+                         "Accept-Encoding header missing")
+        fakeAgent.requests[0][-1].callback(FakeResponse(body=gzipped,
+                                                        headers={'Content-Encoding': ['gzip']}))
+        self.client.read_feed().addCallback(results.append)
+        fakeAgent.requests[1][-1].callback(FakeResponse(body=zlib.compress(body),
+                                                        headers={'Content-Encoding': ['deflate']}))
+
+        self.assertEqual([r.id for r in results], [1234, 1234], "Compressed response not decoded")
+        stats = self.client.transfer_stats
+        self.assertEqual(stats['response_bytes_decoded'], 2 * len(body), "Decoded byte count mismatch")
+        self.assertEqual(stats['response_bytes_received'], len(gzipped) + len(zlib.compress(body)),
+                         "Received byte count mismatch")
+
+    def test_CompressedRequest(self):
+        """ Check large request bodies are gzipped when requested """
+        data = "1" * 2048
+        self.client._post("http://api.cosm.com/v2/feeds", {}, data, compress=True)
+        self.client._post("http://api.cosm.com/v2/feeds", {}, "small", compress=True)
+        method, uri, headers, bodyProducer, d = self.client.agent.requests[0]
+        self.assertEqual(headers.getRawHeaders('Content-Encoding'), ['gzip'],
+                         "Content-Encoding header missing")
+        sent = bodyProducer.body
+        self.assertEqual(zlib.decompress(sent, 16 + zlib.MAX_WBITS), data, "Body mismatch")
+        headers = self.client.agent.requests[1][2]
+        self.assertFalse(headers.hasHeader('Content-Encoding'), "Small body compressed")
+
+        stats = self.client.transfer_stats
+        self.assertEqual(stats['request_bytes'], len(data) + len("small"), "Request byte count mismatch")
+        self.assertEqual(stats['request_bytes_sent'], len(sent) + len("small"), "Sent byte count mismatch")
+
+
+class StreamingDecodeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+        self.datastream = {"id": "temperature",
+                           "current_value": "23.5",
+                           "tags": ["a \\\"quoted\\\" [tag]", "b"],
+                           "datapoints": [{"at": "2012-01-01T00:00:%02dZ" % i,
+                                           "value": "%s" % i} for i in range(20)]}
+
+    def test_JSONArrayDecoder(self):
+        """ Check array items are decoded however the document is split """
+        body = json.dumps(self.datastream)
+        expected = dict(self.datastream, datapoints=[])
+        for chunk_size in [1, 2, 3, 7, 64, len(body)]:
+            items = []
+            decoder = JSONArrayDecoder("datapoints", items.append)
+            for i in range(0, len(body), chunk_size):
+                decoder.feed(body[i:i + chunk_size])
+            remainder = decoder.close()
+            self.assertEqual(items, self.datastream["datapoints"],
+                             "Items mismatch with chunk size %s" % chunk_size)
+            self.assertEqual(remainder, expected,
+                             "Remainder mismatch with chunk size %s" % chunk_size)
+
+    def test_XMLElementDecoder(self):
+        """ Check elements are decoded with namespaces stripped """
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<eeml xmlns="http://www.eeml.org/xsd/0.5.1" version="0.5.1">'
+                '<environment id="1234"><data id="temperature">'
+                '<current_value at="2012-01-01T00:00:19Z">23.5</current_value>'
+                '<datapoints><value at="2012-01-01T00:00:00Z">0</value>'
+                '<value at="2012-01-01T00:00:01Z">1</value></datapoints>'
+                '</data></environment></eeml>')
+        for chunk_size in [1, 5, len(body)]:
+            items = []
+            decoder = XMLElementDecoder("value", items.append)
+            for i in range(0, len(body), chunk_size):
+                decoder.feed(body[i:i + chunk_size])
+            fields = decoder.close()
+            self.assertEqual([(e.tag, e.get("at"), e.text) for e in items],
+                             [("value", "2012-01-01T00:00:00Z", "0"),
+                              ("value", "2012-01-01T00:00:01Z", "1")],
+                             "Elements mismatch with chunk size %s" % chunk_size)
+            self.assertEqual(fields["current_value"], "23.5", "Current value not recorded")
+
+    def test_Iterparse(self):
+        """ Check XML documents are decoded item by item with iterparse """
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<eeml xmlns="http://www.eeml.org/xsd/0.5.1" version="0.5.1">'
+                '<environment id="1234"><data id="temperature">'
+                '<current_value at="2012-01-01T00:00:19Z">23.5</current_value>'
+                '<datapoints><value at="2012-01-01T00:00:00Z">0</value>'
+                '<value at="2012-01-01T00:00:01Z">1</value></datapoints>'
+                '</data></environment></eeml>')
+        elements = []
+        for element in StreamingDecoder.iterparse(StringIO(body), "value"):
+            self.assertEqual(element.tag, "value", "Namespace not stripped")
+            elements.append(element)
+        self.assertEqual(len(elements), 2, "Element count mismatch")
+        self.assertEqual([len(e.attrib) for e in elements], [0, 0], "Consumed elements not cleared")
+
+        datapoints = []
+        datastream = StreamingDecoder.decodeDatastream(StringIO(body), datapoints.append)
+        self.assertEqual([(dp.at, dp.value) for dp in datapoints],
+                         [("2012-01-01T00:00:00Z", "0"), ("2012-01-01T00:00:01Z", "1")],
+                         "Datapoints mismatch")
+        self.assertEqual((datastream.id, datastream.current_value), ("temperature", "23.5"),
+                         "Datastream fields mismatch")
+        self.assertEqual(len(datastream.datapoints), 0, "Handled datapoints kept")
+
+        body = ('<eeml xmlns="http://www.eeml.org/xsd/0.5.1" '
+                'xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" version="0.5.1">'
+                '<opensearch:totalResults>2</opensearch:totalResults>'
+                '<environment id="1"><title>first</title></environment>'
+                '<environment id="2"><title>second</title></environment></eeml>')
+        environmentList = StreamingDecoder.decodeEnvironmentList(StringIO(body))
+        self.assertEqual(environmentList.total_results, "2", "Total results mismatch")
+        self.assertEqual([(e.id, e.title) for e in environmentList.feeds],
+                         [("1", "first"), ("2", "second")], "Feeds mismatch")
+
+    def test_StreamingReadDatastream(self):
+        """ Check read_datastream passes datapoints to a handler as they arrive """
+        datapoints = []
+        results = []
+        self.client.read_datastream(datastream_id="temperature",
+                                    datapointHandler=datapoints.append).addCallback(results.append)
+        body = json.dumps(self.datastream)
+        self.client.agent.requests[0][-1].callback(FakeResponse(body=body, chunk_size=16))
+
+        self.assertEqual(len(datapoints), 20, "Datapoints not delivered")
+        self.assertTrue(isinstance(datapoints[0], txcosm.Datapoint), "Datapoint type mismatch")
+        self.assertEqual(datapoints[-1].value, "19", "Datapoint value mismatch")
+        datastream = results[0]
+        self.assertEqual(datastream.id, "temperature", "Datastream id mismatch")
+        self.assertEqual(datastream.current_value, "23.5", "Current value mismatch")
+        self.assertEqual(datastream.datapoints, [], "Datapoints should not be kept")
+        self.assertEqual(self.client.transfer_stats["response_bytes_received"], len(body),
+                         "Received byte count mismatch")
+
+    def test_StreamingCsvDatastream(self):
+        """ Check CSV datapoint histories are streamed row by row """
+        body = "".join(["2012-01-01T00:00:%02dZ,%s\n" % (i, i) for i in range(20)])
+        for chunk_size in [1, 7, len(body)]:
+            datapoints = []
+            decoder = StreamingDecoder.DatastreamDecoder(datapoints.append, txcosm.DataFormats.CSV)
+            for i in range(0, len(body), chunk_size):
+                decoder.feed(body[i:i + chunk_size])
+            datastream = decoder.close()
+            self.assertEqual([(dp.at, dp.value) for dp in datapoints],
+                             [("2012-01-01T00:00:%02dZ" % i, "%s" % i) for i in range(20)],
+                             "Datapoints mismatch with chunk size %s" % chunk_size)
+            self.assertEqual((datastream.at, datastream.current_value), ("2012-01-01T00:00:19Z", "19"),
+                             "Current value mismatch with chunk size %s" % chunk_size)
+
+    def test_StreamingListFeeds(self):
+        """ Check list_feeds passes feeds to a handler as they arrive """
+        feeds = []
+        results = []
+        self.client.list_feeds(feedHandler=feeds.append).addCallback(results.append)
+        body = json.dumps({"totalResults": 2,
+                           "results": [{"id": 1, "title": "One"},
+                                       {"id": 2, "title": "Two"}]})
+        self.client.agent.requests[0][-1].callback(FakeResponse(body=body, chunk_size=5))
+
+        self.assertEqual([feed.title for feed in feeds], ["One", "Two"], "Feeds not delivered")
+        self.assertEqual(results[0].total_results, 2, "Total results mismatch")
+        self.assertEqual(results[0].feeds, [], "Feeds should not be kept")
+
+
+class BulkUploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+
+    def test_UploadDatapoints(self):
+        """ Check datapoints are uploaded in bounded parallel batches """
+        datapoints = [("2012-01-01T00:%02d:%02dZ" % divmod(i, 60), str(i)) for i in range(1201)]
+        results = []
+        self.client.upload_datapoints(datastream_id="temperature",
+                                      datapoints=datapoints,
+                                      max_parallel=2).addCallback(results.append)
+        requests = self.client.agent.requests
+        self.assertEqual(len(requests), 2, "Parallel limit not applied")
+
+        batch = json.loads(requests[0][3].body)
+        self.assertEqual(len(batch["datapoints"]), 500, "Batch size mismatch")
+        self.assertEqual(batch["datapoints"][0], {"at": "2012-01-01T00:00:00Z", "value": "0"},
+                         "Datapoint mismatch")
+
+        # the second batch fails and is retried after the third
+        requests[0][-1].callback(FakeResponse())
+        requests[1][-1].callback(FakeResponse(code=500))
+        self.assertEqual(len(requests), 3, "Next batch not sent")
+        requests[2][-1].callback(FakeResponse())
+        self.assertEqual(len(requests), 4, "Failed batch not retried")
+        retried = json.loads(requests[3][3].body)
+        self.assertEqual(retried["datapoints"][0]["value"], "500", "Wrong batch retried")
+        requests[3][-1].callback(FakeResponse())
+
+        summary = results[0]
+        self.assertEqual([s["datapoints"] for s in summary], [500, 500, 201], "Summary size mismatch")
+        self.assertEqual([s["attempts"] for s in summary], [1, 2, 1], "Summary attempts mismatch")
+        self.assertTrue(all([s["success"] for s in summary]), "Summary success mismatch")
+        self.assertEqual(summary[2]["last"], "2012-01-01T00:20:00Z", "Summary timestamp mismatch")
+
+    def test_LazyBatches(self):
+        """ Check batches are only taken from the datapoints as upload slots become free """
+        taken = []
+
+        def datapoints():
+            for i in range(100):
+                taken.append(i)
+                yield ("2012-01-01T00:00:%02dZ" % (i % 60), str(i))
+
+        self.client.upload_datapoints(datastream_id="temperature", datapoints=datapoints(),
+                                      batch_size=10, max_parallel=2)
+        self.assertEqual(len(taken), 20, "Batches taken before they were uploaded")
+        self.client.agent.requests[0][-1].callback(FakeResponse())
+        self.assertEqual(len(taken), 30, "Next batch not taken when a slot became free")
+        self.assertEqual(len(self.client.agent.requests), 3, "Next batch not sent")
+
+    def test_StringBodyProducer(self):
+        """ Check request bodies are written to the connection in one write """
+        self.client.upload_datapoints(datastream_id="temperature",
+                                      datapoints=[("2012-01-01T00:00:00Z", "0")])
+        bodyProducer = self.client.agent.requests[0][3]
+        written = []
+        bodyProducer.startProducing(FakeConsumer(written))
+        self.assertEqual(written, ['{"datapoints":[{"at":"2012-01-01T00:00:00Z","value":"0"}]}'],
+                         "Body not written in one piece")
+        self.assertEqual(bodyProducer.length, len(written[0]), "Body length mismatch")
+
+    def test_UploadDatapointsCsv(self):
+        """ Check datapoints can be uploaded as CSV """
+        self.client.upload_datapoints(datastream_id="temperature",
+                                      datapoints=[("2012-01-01T00:00:00Z", "0"),
+                                                  ("2012-01-01T00:00:01Z", "1")],
+                                      format=txcosm.DataFormats.CSV)
+        method, uri, headers, bodyProducer, d = self.client.agent.requests[0]
+        self.assertTrue(uri.endswith("/datapoints.csv"), "CSV resource not used")
+        self.assertEqual(bodyProducer.body,
+                         "2012-01-01T00:00:00Z,0\n2012-01-01T00:00:01Z,1", "CSV body mismatch")
+        failures = []
+        self.client.upload_datapoints(datastream_id="temperature", datapoints=[],
+                                      format=txcosm.DataFormats.XML).addErrback(failures.append)
+        self.assertEqual(len(failures), 1, "Unsupported upload format accepted")
+
+    def test_UploadRetriesExhausted(self):
+        """ Check a batch that keeps failing is reported as failed """
+        results = []
+        self.client.upload_datapoints(datastream_id="temperature",
+                                      datapoints=[("2012-01-01T00:00:00Z", "1")],
+                                      retries=1).addCallback(results.append)
+        for i in range(2):
+            self.client.agent.requests[i][-1].callback(FakeResponse(code=503))
+        self.assertEqual(len(self.client.agent.requests), 2, "Unexpected number of attempts")
+        self.assertEqual(results[0][0]["success"], False, "Failed batch reported as success")
+
+
+class DeltaUpdateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+
+    def test_UpdateFeedChanges(self):
+        """ Check only changes are sent and they are committed on success """
+        environment = txcosm.Environment(datastreams=[{"id": str(i), "current_value": "0"} for i in range(50)])
+        environment.commit()
+        results = []
+        self.client.update_feed_changes(environment).addCallback(results.append)
+        self.assertEqual((results, self.client.agent.requests), ([True], []), "Unchanged feed sent")
+
+        environment.setCurrentValue("7", "1")
+        self.client.update_feed_changes(environment).addCallback(results.append)
+        environment.setCurrentValue("8", "1")
+        method, uri, headers, bodyProducer, d = self.client.agent.requests[0]
+        self.assertEqual(json.loads(bodyProducer.body)["datastreams"], [{"id": "7", "current_value": "1"}],
+                         "Delta body mismatch")
+        d.callback(FakeResponse())
+        self.assertEqual(results[-1], True, "Update failed")
+        self.assertEqual(environment.changesToDict()["datastreams"], [{"id": "8", "current_value": "1"}],
+                         "Change made during update committed")
+
+        self.client.update_feed_changes(environment).addCallback(results.append)
+        self.client.agent.requests[1][-1].callback(FakeResponse(code=500))
+        self.assertTrue(environment.changed, "Failed update committed")
+
+
+class CoalescingWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+        self.writer = CoalescingWriter(self.client, flush_interval=1.0, max_changes=10)
+        self.writer.clock = self.clock
+
+    def _sentFeed(self, index):
+        method, uri, headers, bodyProducer, d = self.client.agent.requests[index]
+        return uri, json.loads(bodyProducer.body)
+
+    def test_Coalesce(self):
+        """ Check changes are merged into one update per feed """
+        results = []
+        for value in ["1", "2", "3"]:
+            self.writer.setCurrentValue("1234", "temperature", value).addCallback(results.append)
+        self.writer.addDatapoint("1234", "humidity", "2012-01-01T00:00:00Z", "40")
+        self.writer.setCurrentValue("5678", "temperature", "9")
+        self.assertEqual(self.client.agent.requests, [], "Update sent before flush interval")
+
+        self.clock.advance(1.0)
+        self.assertEqual(len(self.client.agent.requests), 2, "Expected one update per feed")
+        uri, feed = self._sentFeed(0)
+        self.assertTrue(uri.endswith("/feeds/1234.json"), "Update sent to wrong feed")
+        datastreams = dict([(ds["id"], ds) for ds in feed["datastreams"]])
+        self.assertEqual(datastreams["temperature"]["current_value"], "3", "Last write did not win")
+        self.assertEqual(len(datastreams["humidity"]["datapoints"]), 1, "Datapoint not sent")
+
+        self.client.agent.requests[0][-1].callback(FakeResponse())
+        self.assertEqual(results, [True, True, True], "Writers not notified")
+        self.assertEqual(self.writer.stats()["writes"], 5, "Write count mismatch")
+        self.assertEqual(self.writer.stats()["updates"], 2, "Update count mismatch")
+
+    def test_SizeThreshold(self):
+        """ Check a feed is flushed when enough changes are collected """
+        for i in range(10):
+            self.writer.addDatapoint("1234", "temperature", "2012-01-01T00:00:%02dZ" % i, str(i))
+        self.assertEqual(len(self.client.agent.requests), 1, "Size threshold did not flush")
+
+    def test_InFlightOrdering(self):
+        """ Check changes made while an update is in flight are sent after it """
+        self.writer.setCurrentValue("1234", "temperature", "1")
+        self.writer.flush()
+        self.writer.setCurrentValue("1234", "temperature", "2")
+        self.clock.advance(1.0)
+        self.assertEqual(len(self.client.agent.requests), 1, "Second update sent while first in flight")
+        self.client.agent.requests[0][-1].callback(FakeResponse())
+        self.assertEqual(len(self.client.agent.requests), 2, "Second update not sent")
+        uri, feed = self._sentFeed(1)
+        self.assertEqual(feed["datastreams"][0]["current_value"], "2", "Second update value mismatch")
+
+
+class HistoryFetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+        self.client.max_history_per_page = 2
+
+    def _respond(self, index, timestamps):
+        body = json.dumps({"id": "temperature",
+                           "datapoints": [{"at": at, "value": "1"} for at in timestamps]})
+        self.client.agent.requests[index][-1].callback(FakeResponse(body=body))
+
+    def test_WindowSplitting(self):
+        """ Check history is read in windows and pages and merged in order """
+        results = []
+        start = datetime.datetime(2012, 1, 1, 0, 0, 0)
+        end = datetime.datetime(2012, 1, 1, 13, 0, 0)
+        self.client.read_datastream_history(datastream_id="temperature",
+                                            start=start, end=end,
+                                            max_parallel=2).addCallback(results.append)
+        requests = self.client.agent.requests
+        self.assertEqual(len(requests), 2, "Parallel limit not applied")
+        query = parse_qs(urlparse(requests[0][1]).query)
+        self.assertEqual(query["start"], ["2012-01-01T00:00:00Z"], "Window start mismatch")
+        self.assertEqual(query["end"], ["2012-01-01T06:00:00Z"], "Raw window exceeds 6 hours")
+        self.assertEqual(query["page"], ["1"], "Page mismatch")
+
+        # the second window returns a full page so its next page is read
+        self._respond(1, ["2012-01-01T07:00:00Z", "2012-01-01T06:00:00Z"])
+        self.assertEqual(len(requests), 3, "Third window not requested")
+        query = parse_qs(urlparse(requests[2][1]).query)
+        self.assertEqual(query["start"], ["2012-01-01T12:00:00Z"], "Third window start mismatch")
+        self._respond(2, [])
+        query = parse_qs(urlparse(requests[3][1]).query)
+        self.assertEqual(query["page"], ["2"], "Next page not requested")
+        self._respond(3, ["2012-01-01T08:00:00Z"])
+        query = parse_qs(urlparse(requests[4][1]).query)
+        self.assertEqual(query["page"], ["3"], "Following page not read ahead")
+        self._respond(4, [])
+        self._respond(0, ["2012-01-01T00:00:00Z"])
+
+        self.assertEqual([dp.at for dp in results[0].datapoints],
+                         ["2012-01-01T00:00:00Z", "2012-01-01T06:00:00Z",
+                          "2012-01-01T07:00:00Z", "2012-01-01T08:00:00Z"],
+                         "Datapoints not merged in time order")
+
+    def test_MergeFields(self):
+        """ Check the merged history keeps list fields and orders datapoints by time """
+        results = []
+        start = datetime.datetime(2012, 1, 1, 0, 0, 0)
+        end = datetime.datetime(2012, 1, 1, 1, 0, 0)
+        self.client.read_datastream_history(datastream_id="temperature", start=start, end=end,
+                                            max_parallel=1).addCallback(results.append)
+        body = json.dumps({"id": "temperature", "tags": ["indoor", "lounge"],
+                           "datapoints": [{"at": "2012-01-01T10:00:00+10:00", "value": "1"},
+                                          {"at": "2012-01-01T00:00:01.5Z", "value": "2"}]})
+        self.client.agent.requests[0][-1].callback(FakeResponse(body=body))
+        self.client.agent.requests[1][-1].callback(FakeResponse(body='{"id": "temperature", "datapoints": '
+                                                                     '[{"at": "2012-01-01T00:00:00.000000Z", "value": "1"},'
+                                                                     ' {"at": "2012-01-01T00:00:01Z", "value": "3"}]}'))
+        self.client.agent.requests[2][-1].callback(FakeResponse(body='{"id": "temperature", "datapoints": []}'))
+        history = results[0]
+        self.assertEqual(history.tags, ["indoor", "lounge"], "List field not kept")
+        self.assertEqual([dp.value for dp in history.datapoints], ["1", "3", "2"],
+                         "Datapoints not merged by time")
+
+    def test_CachedPages(self):
+        """ Check merging the history leaves the cached pages unchanged """
+        results = []
+        self.client.cache = ResponseCache()
+        start = datetime.datetime(2012, 1, 1, 0, 0, 0)
+        end = datetime.datetime(2012, 1, 1, 1, 0, 0)
+        self.client.read_datastream_history(datastream_id="temperature", start=start, end=end).addCallback(results.append)
+        body = json.dumps({"id": "temperature", "unit": {"label": "Celsius"},
+                           "datapoints": [{"at": "2012-01-01T00:00:0%sZ" % i, "value": "1"} for i in range(2)]})
+        self.client.agent.requests[0][-1].callback(FakeResponse(body=body, headers={"ETag": ['"1"']}))
+        self.client.agent.requests[1][-1].callback(FakeResponse(body='{"id": "temperature", "datapoints": '
+                                                                     '[{"at": "2012-01-01T00:00:02Z", "value": "1"}]}',
+                                                                headers={"ETag": ['"2"']}))
+        for request in self.client.agent.requests[2:]:
+            request[-1].callback(FakeResponse(body='{"id": "temperature", "datapoints": []}'))
+        history = results[0]
+        self.assertEqual(len(history.datapoints), 3, "History not merged")
+        self.assertEqual(history.unit.label, "Celsius", "Fields of the first page not kept")
+        cached = [entry[2] for entry in self.client.cache.entries.values()]
+        self.assertFalse(history in cached, "Cached page returned as the history")
+        self.assertEqual(sorted([len(page.datapoints) for page in cached]), [1, 2], "Cached page modified")
+
+    def test_Interval(self):
+        """ Check intervals are rounded up and set the window size """
+        start = datetime.datetime(2012, 1, 1)
+        end = datetime.datetime(2012, 1, 3)
+        self.client.read_datastream_history(datastream_id="temperature",
+                                            start=start, end=end, interval=45)
+        query = parse_qs(urlparse(self.client.agent.requests[0][1]).query)
+        self.assertEqual(query["interval"], ["60"], "Interval not rounded up")
+        self.assertEqual(query["end"], ["2012-01-02T00:00:00Z"], "Window exceeds 24 hours")
+        self.assertEqual(len(self.client.agent.requests), 2, "Unexpected number of windows")
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+        self.client.cache = ResponseCache(max_entries=2)
+
+    def test_ConditionalGet(self):
+        """ Check validators are sent and a 304 returns the cached object """
+        results = []
+        self.client.read_feed().addCallback(results.append)
+        self.client.agent.requests[0][-1].callback(FakeResponse(body='{"id": 1234}',
+                                                                headers={'ETag': ['"abc"']}))
+        self.client.read_feed().addCallback(results.append)
+        headers = self.client.agent.requests[1][2]
+        self.assertEqual(headers.getRawHeaders('If-None-Match'), ['"abc"'], "ETag not sent")
+        self.client.agent.requests[1][-1].callback(FakeResponse(code=304))
+
+        self.assertTrue(results[1] is results[0], "Cached object not returned")
+        self.assertEqual(self.client.cache_stats['hits'], 1, "Cache hit not counted")
+
+    def test_EvictedBeforeResponse(self):
+        """ Check a 304 returns the cached object evicted while the request was in flight """
+        results = []
+        self.client.read_feed().addCallback(results.append)
+        self.client.agent.requests[0][-1].callback(FakeResponse(body='{"id": 1234}',
+                                                                headers={'ETag': ['"abc"']}))
+        self.client.read_feed().addCallback(results.append)
+        self.client.cache.store('a', '"1"', None, 'A')
+        self.client.cache.store('b', '"2"', None, 'B')
+        self.assertEqual(self.client.cache_stats['entries'], 2, "Entry not evicted")
+        self.client.agent.requests[1][-1].callback(FakeResponse(code=304))
+        self.assertTrue(results[1] is results[0], "Evicted object not returned")
+
+    def test_Eviction(self):
+        """ Check the least recently used entry is evicted """
+        cache = self.client.cache
+        cache.store('a', '"1"', None, 'A')
+        cache.store('b', None, 'Mon, 01 Jan 2012 00:00:00 GMT', 'B')
+        cache.store('c', None, None, 'C')
+        self.assertEqual(cache.validators('c'), {}, "Response without validators stored")
+        self.assertEqual(cache.validators('b'), {'If-Modified-Since': 'Mon, 01 Jan 2012 00:00:00 GMT'},
+                         "Last-Modified validator mismatch")
+        cache.revalidated('a')
+        cache.store('d', '"4"', None, 'D')
+        self.assertEqual(cache.entries.keys(), ['a', 'd'], "Least recently used entry not evicted")
+        self.assertEqual(cache.stats()['evictions'], 1, "Eviction not counted")
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+        self.client.single_flight = True
+
+    def test_Coalesce(self):
+        """ Check concurrent identical requests share one request and result """
+        results = []
+        for i in range(3):
+            self.client.read_feed().addCallback(results.append)
+        self.client.read_feed(copy=True).addCallback(results.append)
+        self.client.read_feed(feed_id="5678").addCallback(results.append)
+        self.assertEqual(len(self.client.agent.requests), 2, "Identical requests not coalesced")
+        self.assertEqual(self.client.single_flight_stats['coalesced_requests'], 3,
+                         "Coalesced request count mismatch")
+
+        self.client.agent.requests[0][-1].callback(FakeResponse(body='{"id": 1234}'))
+        self.assertEqual(len(results), 4, "Waiting callers not answered")
+        self.assertTrue(results[0] is results[1] is results[2], "Result not shared")
+        self.assertFalse(results[3] is results[0], "Copy not made")
+        self.assertEqual(results[3].id, 1234, "Copy mismatch")
+        self.assertEqual(self.client.single_flight_stats['in_flight'], 1, "In flight count mismatch")
+
+        # once complete a new request is made
+        self.client.read_feed()
+        self.assertEqual(len(self.client.agent.requests), 3, "Completed request reused")
+
+    def test_Timeout(self):
+        """ Check a request that times out fails every waiting caller """
+        results = []
+        self.client.request_timeout = 1.0
+        self.client.read_feed().addCallback(results.append)
+        self.client.read_feed().addCallback(results.append)
+        self.clock.pump([0.1] * 11)
+        self.assertEqual(results, [None, None], "Timeout not passed to every caller")
+        self.assertEqual(self.client.inFlightGets, {}, "In flight request not cleaned up")
+
+    def test_ImmediateResponse(self):
+        """ Check the caller is answered when the request completes immediately """
+        results = []
+        self.client.agent.request = lambda **kwargs: defer.succeed(FakeResponse(body='{"id": 1234}'))
+        self.client.read_feed().addCallback(results.append)
+        self.assertEqual(results[0].id, 1234, "Immediate response not delivered")
+        self.assertEqual(self.client.inFlightGets, {}, "In flight request not cleaned up")
+
+
+suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(TimerWheelTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(ConnectionPoolTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(RequestSchedulerTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(CompressionTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(StreamingDecodeTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(BulkUploadTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(DeltaUpdateTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(CoalescingWriterTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(HistoryFetchTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(ResponseCacheTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(SingleFlightTestCase)])
+
+
+if __name__ == "__main__":
+
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
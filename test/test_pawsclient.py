@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+
+'''
+This simple script provides test cases that exercise the PAWS client
+machinery without communicating with Cosm.
+
+txcosm must be installed or visible on the PYTHONPATH.
+'''
+
+import json
+import unittest
+from twisted.internet import defer, task
+from twisted.internet.error import ConnectionLost
+from txcosm.HashRing import HashRing
+from txcosm.PAWSClient import PAWSClient, PAWSProtocol, ShardedPAWSClient
+from txcosm.TimerWheel import TimerWheel
+
+
+class FakeFactory(object):
+    """ Records the messages passed on by a protocol """
+
+    def __init__(self):
+        self.messages = []
+
+    def messageReceived(self, msg):
+        self.messages.append(msg)
+
+
+class FakeConnection(object):
+    """ Records the messages sent through a connection """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+def makeClient(clock, **kwargs):
+    """ Return a connected PAWSClient that uses a fake connection and the supplied clock """
+    client = PAWSClient(api_key="key", feed_id="1234", **kwargs)
+    client.timers = TimerWheel()
+    client.timers.clock = clock
+    client.factory.connection = FakeConnection()
+    client.factory.connected = True
+    return client
+
+
+def makeShardedClient(clock, shards=3, **kwargs):
+    """ Return a ShardedPAWSClient whose shards use fake connections and the supplied clock """
+    client = ShardedPAWSClient(api_key="key", feed_id="1234", shards=shards, **kwargs)
+    client.timers = TimerWheel()
+    client.timers.clock = clock
+    client.resetShardStats()
+    for factory in client.factories:
+        connect(factory)
+    return client
+
+
+def connect(factory):
+    """ Connect a factory to a fake connection """
+    factory.connection = FakeConnection()
+    factory._connectionStateHandler(True)
+
+
+def respond(client, request, status=200, body=None):
+    """ Deliver the response to a request sent by a client """
+    client._messageHandler(json.dumps({"token": request["token"],
+                                       "status": status,
+                                       "body": body or {}}))
+
+
+class FramingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = FakeFactory()
+        self.protocol = PAWSProtocol(max_message_size=1024)
+        self.protocol.factory = self.factory
+
+    def test_Framing(self):
+        """ Check messages are framed however the data is split """
+        messages = ['{"token": "%s", "body": "%s"}' % (i, "x" * (i * 50)) for i in range(20)]
+        data = "".join([msg + "\n" for msg in messages])
+        for chunk_size in [1, 3, 64, 1000, len(data)]:
+            del self.factory.messages[:]
+            for i in range(0, len(data), chunk_size):
+                self.protocol.dataReceived(data[i:i + chunk_size])
+            self.assertEqual(self.factory.messages, messages,
+                             "Messages mismatch with chunk size %s" % chunk_size)
+            self.assertEqual(self.protocol.buffer, [], "Data left in buffer")
+
+    def test_MaxMessageSize(self):
+        """ Check oversized messages are discarded without losing later messages """
+        for chunk_size in [1, 100, 5000]:
+            del self.factory.messages[:]
+            data = "a\n" + "x" * 3000 + "\nb\n" + "y" * 1025 + "\nc"
+            for i in range(0, len(data), chunk_size):
+                self.protocol.dataReceived(data[i:i + chunk_size])
+            self.assertEqual(self.factory.messages, ["a", "b"],
+                             "Messages mismatch with chunk size %s" % chunk_size)
+            self.assertTrue(self.protocol.buffered <= 1024, "Buffer exceeds maximum")
+            self.protocol.dataReceived("\n")
+            self.assertEqual(self.factory.messages[-1], "c", "Message after oversized message lost")
+
+
+class RequestTimeoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+
+    def test_Response(self):
+        """ Check a response cancels the request timeout """
+        results = []
+        self.client._get("/feeds/1234").addCallback(results.append)
+        self.assertEqual(self.client.timers.pending, 1, "Timeout not scheduled")
+        respond(self.client, self.client.factory.connection.sent[0])
+        self.assertEqual(results[0]["status"], 200, "Response not delivered")
+        self.assertEqual((self.client.pendingResponses, self.client.timers.pending), ({}, 0),
+                         "Request not cleaned up")
+
+    def test_Timeout(self):
+        """ Check requests without a response fail at their deadline """
+        failures = []
+        self.client._get("/feeds/1234").addErrback(failures.append)
+        self.client._sendRequest("get", "/feeds/5678", timeout=30.0).addErrback(failures.append)
+        self.clock.advance(5)
+        self.assertEqual(self.client.pending_stats,
+                         {"pending_requests": 2, "oldest_age": 5.0, "average_age": 5.0},
+                         "Pending gauge mismatch")
+        for i in range(60):
+            self.clock.advance(0.1)
+        self.assertEqual(len(failures), 1, "Request not timed out")
+        self.assertTrue(failures[0].check(defer.TimeoutError), "Timeout failure type mismatch")
+        self.assertEqual(len(self.client.pendingResponses), 1, "Timed out request not removed")
+        self.clock.pump([0.1] * 200)
+        self.assertEqual(len(failures), 2, "Per request timeout not applied")
+        self.assertEqual(self.client.pendingResponses, {}, "Timed out request not removed")
+
+    def test_ConnectionLost(self):
+        """ Check pending requests fail when the connection is lost """
+        failures = []
+        for i in range(3):
+            self.client._get("/feeds/%s" % i).addErrback(failures.append)
+        self.client.factory._connectionStateHandler(False)
+        self.assertEqual(len(failures), 3, "Pending requests not failed")
+        self.assertTrue(all([f.check(ConnectionLost) for f in failures]), "Failure type mismatch")
+        self.assertEqual(self.client.pending_stats["pending_requests"], 0, "Pending requests leaked")
+        self.assertEqual(self.client.timers.pending, 0, "Timeouts not cancelled")
+
+        self.client._get("/feeds/1234").addErrback(failures.append)
+        self.assertTrue(failures[-1].check(ConnectionLost), "Request sent without a connection")
+
+
+class FanOutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeClient(self.clock)
+        self.sent = self.client.factory.connection.sent
+        self.updates = []
+
+    def test_SharedSubscription(self):
+        """ Check subscribers to a resource share one subscription and one decode of each update """
+        results = []
+        handlers = [self.updates.append, self.fail, self.updates.append]
+        for handler in handlers:
+            self.client.subscribe("/feeds/1234", handler).addCallback(results.append)
+        self.assertEqual([r["method"] for r in self.sent], ["subscribe"], "Subscription not shared")
+        self.assertEqual(results, [], "Subscribed before the response arrived")
+        respond(self.client, self.sent[0])
+        self.assertEqual([status for token, status in results], [True] * 3, "Subscribers not notified")
+        self.assertEqual(len(set([token for token, status in results])), 3, "Subscriber tokens not unique")
+
+        respond(self.client, self.sent[0], body={"id": 1234, "title": "update"})
+        subscription = self.client.subscriptions["/feeds/1234"]
+        self.assertEqual(subscription.updates, 1, "Update not decoded once")
+        self.assertEqual(len(self.updates), 2, "Update not passed to every handler")
+        self.assertTrue(self.updates[0] is self.updates[1], "Handlers not passed the same update")
+        self.assertEqual(self.updates[0].title, "update", "Update not decoded")
+
+    def test_ReferenceCount(self):
+        """ Check the subscription is only removed when the last subscriber leaves """
+        results = []
+        for i in range(3):
+            self.client.subscribe("/feeds/1234", self.updates.append).addCallback(results.append)
+        respond(self.client, self.sent[0])
+        upstream = self.sent[0]["token"]
+
+        statuses = []
+        for token, status in results[:2]:
+            self.client.unsubscribe("/feeds/1234", token).addCallback(statuses.append)
+        self.assertEqual(len(self.sent), 1, "Unsubscribed while subscribers remain")
+        self.assertEqual(statuses, [True, True], "Unsubscribe status mismatch")
+
+        self.client.unsubscribe("/feeds/1234", results[2][0]).addCallback(statuses.append)
+        self.assertEqual((self.sent[1]["method"], self.sent[1]["token"]), ("unsubscribe", upstream),
+                         "Last subscriber did not unsubscribe")
+        respond(self.client, self.sent[1])
+        self.assertEqual(statuses[-1], True, "Unsubscribe status mismatch")
+        self.assertEqual((self.client.subscriptions, self.client.subscriptionHandlers), ({}, {}),
+                         "Subscription not removed")
+
+        self.client.unsubscribe("/feeds/1234", results[2][0]).addCallback(statuses.append)
+        self.assertEqual(statuses[-1], None, "Unknown token accepted")
+        self.client.subscribe("/feeds/1234", self.updates.append)
+        self.assertEqual(self.sent[2]["method"], "subscribe", "Resource not subscribed again")
+        self.assertNotEqual(self.sent[2]["token"], upstream, "Subscription token reused")
+
+    def test_UnsubscribeBeforeSubscribed(self):
+        """ Check the unsubscribe request waits for the subscribe response """
+        results = []
+        self.client.subscribe("/feeds/1234", self.updates.append).addCallback(results.append)
+        token = self.client.subscriptions["/feeds/1234"].handlers.keys()[0]
+        self.client.unsubscribe("/feeds/1234", token)
+        self.assertEqual(len(self.sent), 1, "Unsubscribe sent before the subscribe response")
+        respond(self.client, self.sent[0])
+        self.assertEqual(self.sent[1]["method"], "unsubscribe", "Unsubscribe not sent")
+
+    def test_SubscribeFailure(self):
+        """ Check every subscriber fails when the subscribe request fails """
+        failures = []
+        for i in range(2):
+            self.client.subscribe("/feeds/1234", self.updates.append).addErrback(failures.append)
+        self.client.factory._connectionStateHandler(False)
+        self.assertEqual(len(failures), 2, "Subscribers not failed")
+        self.assertTrue(all([f.check(ConnectionLost) for f in failures]), "Failure type mismatch")
+        self.assertEqual(self.client.subscriptions, {}, "Failed subscription not removed")
+
+
+class ReconnectTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.updates = []
+
+    def subscribe(self, client, feeds):
+        """ Subscribe to a number of feeds and return the tokens of the upstream subscriptions """
+        for feed in range(feeds):
+            client.subscribe("/feeds/%s" % feed, self.updates.append)
+        for request in list(client.factory.connection.sent):
+            respond(client, request)
+        return [client.subscriptions["/feeds/%s" % feed].token for feed in range(feeds)]
+
+    def reconnect(self, client, gap):
+        """ Lose the connection of a client and re-establish it after a gap """
+        client.factory._connectionStateHandler(False)
+        self.clock.advance(gap)
+        connect(client.factory)
+        return client.factory.connection.sent
+
+    def test_Resubscribe(self):
+        """ Check subscriptions are replayed in one burst when the connection is re-established """
+        client = makeClient(self.clock)
+        tokens = self.subscribe(client, 3)
+        sent = self.reconnect(client, 12)
+        self.assertEqual(sorted([(r["method"], r["token"]) for r in sent]),
+                         sorted([("subscribe", token) for token in tokens]), "Subscriptions not replayed")
+        self.assertEqual(len(client.pendingResponses), 3, "Subscriptions not pipelined")
+        self.assertEqual(client.reconnect_stats["last_gap"], 12.0, "Reconnect gap not reported")
+
+        results = []
+        client.subscribe("/feeds/0", self.updates.append).addCallback(results.append)
+        self.assertEqual(results, [], "Subscribed before the replay was answered")
+        for request in list(sent):
+            respond(client, request)
+        self.assertEqual(results[0][1], True, "Subscriber not notified of the replay")
+        self.assertEqual(client.reconnect_stats,
+                         {"reconnects": 1, "last_gap": 12.0, "longest_gap": 12.0, "resubscribed": 3},
+                         "Reconnect stats mismatch")
+
+        respond(client, sent[0], body={"id": 1, "title": "after"})
+        self.assertEqual(self.updates[-1].title, "after", "Update not delivered after the reconnect")
+
+    def test_CatchUp(self):
+        """ Check each resubscribed resource is read and its state passed to the handlers """
+        client = makeClient(self.clock, catch_up=True)
+        self.subscribe(client, 2)
+        sent = self.reconnect(client, 3)
+        methods = [(r["method"], r["resource"]) for r in sent]
+        self.assertEqual(len(methods), 4, "Subscriptions not replayed and read")
+        for resource in ["/feeds/0", "/feeds/1"]:
+            self.assertTrue(methods.index(("subscribe", resource)) < methods.index(("get", resource)),
+                            "Resource not read after it was resubscribed")
+        for request in sent:
+            respond(client, request, body={"id": 1, "title": "latest"} if request["method"] == "get" else None)
+        self.assertEqual([update.title for update in self.updates], ["latest", "latest"], "State not caught up")
+
+    def test_RefusedNotReplayed(self):
+        """ Check a subscription refused by the service is dropped and not replayed """
+        client = makeClient(self.clock)
+        results = []
+        client.subscribe("/feeds/0", self.updates.append).addCallback(results.append)
+        respond(client, client.factory.connection.sent[0], status=403)
+        self.assertEqual(results[0][1], False, "Refusal not returned")
+        self.assertEqual(client.subscriptions, {}, "Refused subscription kept")
+        self.assertEqual(client.subscriptionHandlers, {}, "Refused subscription handler kept")
+        self.assertEqual(self.reconnect(client, 1), [], "Refused subscription replayed")
+
+    def test_NoResubscribe(self):
+        """ Check subscriptions are not replayed when resubscribe is disabled """
+        client = makeClient(self.clock, resubscribe=False)
+        self.subscribe(client, 2)
+        self.assertEqual(self.reconnect(client, 1), [], "Subscriptions replayed")
+        self.assertEqual(client.reconnect_stats["reconnects"], 1, "Reconnect not reported")
+
+
+class ShardingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = makeShardedClient(self.clock)
+        self.updates = []
+
+    def deliver(self, shard, message):
+        """ Deliver a message through the connection of a shard """
+        self.client.factories[shard].messageReceived(json.dumps(message))
+
+    def acknowledge(self):
+        """ Respond to every request waiting for a response """
+        for shard, factory in enumerate(self.client.factories):
+            if factory.connection is not None:
+                for request in factory.connection.sent:
+                    if request["token"] in self.client.pendingResponses:
+                        self.deliver(shard, {"token": request["token"], "status": 200, "body": {}})
+
+    def subscribe(self, feeds):
+        """ Subscribe to a number of feeds and return the tokens of the upstream subscriptions """
+        results = []
+        for feed in range(feeds):
+            d = self.client.subscribe("/feeds/%s" % feed, self.updates.append)
+            d.addCallback(results.append)
+        self.acknowledge()
+        self.assertEqual(len(results), feeds, "Subscriptions not made")
+        return [self.client.subscriptions["/feeds/%s" % feed].token for feed in range(feeds)]
+
+    def test_HashRing(self):
+        """ Check the ring spreads keys evenly and only moves the keys of a removed node """
+        ring = HashRing(range(4))
+        keys = [str(i) for i in range(4000)]
+        before = dict([(key, ring.get(key)) for key in keys])
+        for node in range(4):
+            share = before.values().count(node) / 4000.0
+            self.assertTrue(0.15 < share < 0.35, "Keys not spread evenly: %s" % share)
+
+        ring.remove(3)
+        for key in keys:
+            if before[key] != 3:
+                self.assertEqual(ring.get(key), before[key], "Key moved from a remaining node")
+        ring.add(3)
+        self.assertEqual(dict([(key, ring.get(key)) for key in keys]), before, "Keys not restored")
+        self.assertEqual(HashRing().get("1"), None, "Empty ring returned a node")
+
+    def test_Routing(self):
+        """ Check every resource of a feed uses one shard and feeds are spread over the shards """
+        for resource in ["/feeds/7", "/feeds/7.json", "/feeds/7/datastreams/1", "/feeds/7/datastreams/2/datapoints"]:
+            self.assertEqual(self.client.shardFor(resource), self.client.shardFor("/feeds/7"),
+                             "Resources of a feed on different shards")
+        for feed in range(30):
+            self.client._get("/feeds/%s" % feed)
+        sent = [factory.connection.sent for factory in self.client.factories]
+        self.assertTrue(all(sent), "Requests not spread over the shards")
+        for shard, requests in enumerate(sent):
+            for request in requests:
+                self.assertEqual(self.client.shardFor(request["resource"]), shard, "Request sent on the wrong shard")
+
+        self.clock.advance(2)
+        stats = self.client.shard_stats
+        self.assertEqual(sum([s["messages_sent"] for s in stats]), 30, "Sent messages not counted")
+        self.assertEqual(sum([s["pending_requests"] for s in stats]), 30, "Pending requests not counted")
+        self.acknowledge()
+        stats = self.client.shard_stats
+        self.assertEqual([s["messages_received"] for s in stats], [len(r) for r in sent], "Received messages not counted")
+        self.assertEqual(stats[0]["messages_per_second"], len(sent[0]) / 2.0, "Message rate mismatch")
+
+    def test_ConnectionLost(self):
+        """ Check losing a shard only fails the requests sent through it """
+        failures = []
+        for feed in range(30):
+            self.client._get("/feeds/%s" % feed).addErrback(failures.append)
+        lost = len(self.client.factories[1].connection.sent)
+        self.client.factories[1]._connectionStateHandler(False)
+        self.assertEqual(len(failures), lost, "Requests on other shards failed")
+        self.assertEqual(len(self.client.pendingResponses), 30 - lost, "Pending requests mismatch")
+        self.assertTrue(all([self.client.shardFor("/feeds/%s" % feed) != 1 for feed in range(30)]),
+                        "Resources assigned to a disconnected shard")
+
+    def test_Rebalance(self):
+        """ Check subscriptions move off a lost shard and back when it reconnects """
+        tokens = self.subscribe(30)
+        placement = dict([(token, self.client.subscriptionShards[token][1]) for token in tokens])
+        moved = [token for token in tokens if placement[token] == 0]
+        self.assertTrue(moved, "No subscriptions on the shard")
+
+        for factory in self.client.factories:
+            del factory.connection.sent[:]
+        self.client.factories[0]._connectionStateHandler(False)
+        resubscribed = [r["token"] for f in self.client.factories[1:] for r in f.connection.sent]
+        self.assertEqual(sorted(resubscribed), sorted(moved), "Only the lost shard's subscriptions should move")
+        self.acknowledge()
+        self.assertEqual(sum([s["subscriptions"] for s in self.client.shard_stats]), 30, "Subscriptions lost")
+
+        # updates keep arriving through the new shard
+        token = moved[0]
+        shard = self.client.subscriptionShards[token][1]
+        self.deliver(shard, {"token": token, "resource": "/feeds/1", "body": {"id": 1, "title": "moved"}})
+        self.assertEqual(self.updates[-1].title, "moved", "Update not delivered after the move")
+
+        for factory in self.client.factories[1:]:
+            del factory.connection.sent[:]
+        connect(self.client.factories[0])
+        unsubscribed = [r for f in self.client.factories[1:] for r in f.connection.sent]
+        self.assertEqual(sorted([r["token"] for r in unsubscribed]), sorted(moved), "Subscriptions not moved back")
+        self.assertTrue(all([r["method"] == "unsubscribe" for r in unsubscribed]), "Subscription not removed first")
+        self.assertEqual(self.client.factories[0].connection.sent, [], "Subscribed before unsubscribing")
+        self.acknowledge()
+        self.acknowledge()
+        self.assertEqual(sorted([r["token"] for r in self.client.factories[0].connection.sent]), sorted(moved),
+                         "Subscriptions not made on the reconnected shard")
+        self.assertEqual(dict([(token, self.client.subscriptionShards[token][1]) for token in tokens]), placement,
+                         "Subscriptions not restored to their shards")
+        self.assertEqual(self.client.pendingResponses, {}, "Move requests left pending")
+
+    def test_PendingMove(self):
+        """ Check a subscription waiting for a response is moved once the response arrives """
+        tokens = self.subscribe(30)
+        placement = dict([(token, self.client.subscriptionShards[token][1]) for token in tokens])
+        moved = [token for token in tokens if placement[token] == 0]
+        self.client.factories[0]._connectionStateHandler(False)
+        connect(self.client.factories[0])
+        self.assertEqual(self.client.factories[0].connection.sent, [], "Moved while a response was pending")
+
+        for _ in range(3):
+            self.acknowledge()
+        self.assertEqual(sorted([r["token"] for r in self.client.factories[0].connection.sent]), sorted(moved),
+                         "Waiting subscriptions not moved back")
+        self.assertEqual(dict([(token, self.client.subscriptionShards[token][1]) for token in tokens]), placement,
+                         "Subscriptions not restored to their shards")
+        self.assertEqual(self.client.pendingResponses, {}, "Move requests left pending")
+
+    def test_MoveFailure(self):
+        """ Check a subscription that fails to move is retried """
+        tokens = self.subscribe(30)
+        moved = [token for token in tokens if self.client.subscriptionShards[token][1] == 0]
+        self.client.factories[0]._connectionStateHandler(False)
+        self.clock.pump([0.1] * 110)
+        self.assertTrue(all([self.client.subscriptionShards[token][1] is None for token in moved]),
+                        "Failed move recorded as complete")
+        subscription = self.client.subscriptions.values()[0]
+        for factory in self.client.factories[1:]:
+            del factory.connection.sent[:]
+
+        self.clock.pump([0.1] * 110)
+        resubscribed = [r["token"] for f in self.client.factories[1:] for r in f.connection.sent]
+        self.assertEqual(sorted(resubscribed), sorted(moved), "Failed moves not retried")
+        self.acknowledge()
+        self.assertTrue(all([self.client.subscriptionShards[token][1] is not None for token in moved]),
+                        "Retried move not recorded")
+        self.assertTrue(all([s.status for s in self.client.subscriptions.values()]), "Subscription status not restored")
+
+    def test_CatchUp(self):
+        """ Check moved resources are read and the reconnect gap reported """
+        self.client = makeShardedClient(self.clock, catch_up=True)
+        tokens = self.subscribe(30)
+        moved = [token for token in tokens if self.client.subscriptionShards[token][1] == 0]
+        for factory in self.client.factories[1:]:
+            del factory.connection.sent[:]
+        self.client.factories[0]._connectionStateHandler(False)
+        self.acknowledge()
+        reads = [r for f in self.client.factories[1:] for r in f.connection.sent if r["method"] == "get"]
+        self.assertEqual(len(reads), len(moved), "Moved resources not read")
+
+        self.clock.advance(7)
+        connect(self.client.factories[0])
+        self.assertEqual(self.client.reconnect_stats["last_gap"], 7.0, "Reconnect gap not reported")
+        self.assertEqual(self.client.reconnect_stats["reconnects"], 1, "Reconnect not counted")
+
+
+suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(FramingTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(RequestTimeoutTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(FanOutTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(ReconnectTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(ShardingTestCase)])
+
+
+if __name__ == "__main__":
+
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
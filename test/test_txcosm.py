@@ -14,9 +14,12 @@ except ImportError:
         from xml.etree import cElementTree as etree
     except ImportError:
         import xml.etree.ElementTree as etree
+import calendar
 import json
+import time
 import unittest
 import txcosm
+from txcosm import ISO8601, JSONBackend
 
 
 # Test data obtained from the Cosm API documentation page.
@@ -855,11 +858,319 @@ class DataStructureTestCase(unittest.TestCase):
         user_list_xml = user_list.encode(txcosm.DataFormats.XML)
         valid_xml = etree.fromstring(user_list_xml)
 
+    def test_CompactStructures(self):
+        """ Check high volume structures carry no per instance dict """
+        for structure in [txcosm.Unit(), txcosm.Location(), txcosm.Datapoint(),
+                          txcosm.Datastream(), txcosm.Environment()]:
+            self.assertFalse(hasattr(structure, '__dict__'),
+                             "%s has a per instance dict" % structure.__class__.__name__)
+            self.assertTrue(structure._attributes is structure.__class__._attributes,
+                            "%s attributes not shared" % structure.__class__.__name__)
+
+        environment = txcosm.Environment()
+        environment.decode(TEST_FEED_JSON, format=txcosm.DataFormats.JSON)
+        self.assertEqual(json.loads(environment.encode()), environment.toDict(),
+                         "Environment round trip mismatch")
+        self.assertRaises(AttributeError, setattr, txcosm.Datapoint(), 'colour', 'red')
+
+    def test_ColumnarDatapoints(self):
+        """ Check columnar datapoint storage """
+        datastream = txcosm.Datastream(columnar=True, id="temperature")
+        self.assertTrue(isinstance(datastream.datapoints, txcosm.DatapointColumns),
+                        "Columnar store not used")
+        datastream.addDatapoint("2010-07-02T10:21:57.101496Z", "23.5")
+        datastream.addDatapoint("2010-07-02T10:22:00Z", "24")
+        datastream.datapoints.appendArrays([1278066180.25], [25.125])
+        self.assertEqual(len(datastream.datapoints), 3, "Datapoint count mismatch")
+        self.assertEqual([(dp.at, dp.value) for dp in datastream.datapoints],
+                         [("2010-07-02T10:21:57.101496Z", "23.5"),
+                          ("2010-07-02T10:22:00.000000Z", "24"),
+                          ("2010-07-02T10:23:00.250000Z", "25.125")],
+                         "Datapoint views mismatch")
+
+        datastreamDict = datastream.toDict()
+        self.assertEqual(datastreamDict[txcosm.DataFields.Datapoints][0],
+                         {"at": "2010-07-02T10:21:57.101496Z", "value": "23.5"},
+                         "Datapoint dict mismatch")
+        data = datastream.toXml()
+        self.assertEqual(len(data.find(txcosm.DataFields.Datapoints)), 3, "Datapoint XML mismatch")
+
+        decoded = txcosm.Datastream(columnar=True)
+        decoded.fromDict(datastreamDict)
+        self.assertEqual(decoded.datapoints, datastream.datapoints, "Columnar round trip mismatch")
+
+        datastream.clear()
+        self.assertEqual(len(datastream.datapoints), 0, "Datapoints not cleared")
+        self.assertFalse(txcosm.DataFields.Datapoints in datastream.toDict(),
+                         "Empty datapoints encoded")
+
+    def test_SchemaCodecs(self):
+        """ Check the codecs compiled from the data structure schemas """
+        self.assertEqual(txcosm.Unit._attributes,
+                         [txcosm.DataFields.Label, txcosm.DataFields.Type, txcosm.DataFields.Symbol],
+                         "Unit attributes not taken from schema")
+        self.assertEqual(txcosm.Datapoint.toDict.__doc__, txcosm.DataStructure.toDict.__doc__,
+                         "Compiled method docstring missing")
+
+        datastream = txcosm.Datastream(id="temperature", current_value=0, tags=[],
+                                       unit={"label": "Celsius", "type": "derivedSI"},
+                                       datapoints=[{"at": "2010-07-02T10:21:57Z", "value": "23"}])
+        self.assertEqual(datastream.toDict(),
+                         {"id": u"temperature", "current_value": u"0",
+                          "unit": {"label": u"Celsius", "type": u"derivedSI"},
+                          "datapoints": [{"at": u"2010-07-02T10:21:57Z", "value": u"23"}]},
+                         "Datastream dict mismatch")
+
+        environment = txcosm.Environment(id=1234, title="", location={"name": "Office"},
+                                         datastreams=[{"id": "1"}, {"id": "2"}])
+        self.assertEqual(sorted(environment.datastreams.keys()), ["1", "2"], "Datastreams not keyed by id")
+        environmentDict = environment.toDict()
+        self.assertFalse(txcosm.DataFields.Title in environmentDict, "Empty title encoded")
+        self.assertEqual(txcosm.Environment(**environmentDict).toDict(), environmentDict,
+                         "Environment round trip mismatch")
+
+        self.assertRaises(Exception, txcosm.Unit, type="furlongs")
+        self.assertRaises(Exception, txcosm.Location, exposure="sideways")
+        self.assertRaises(Exception, txcosm.Schema.Field, "id", kind="unknown")
+
+        # decoding into an existing structure replaces waypoints but adds datapoints
+        location = txcosm.Location(waypoints=[{"at": "2010-07-02T10:21:57Z", "lat": 51.5}])
+        location.fromDict({"waypoints": [{"at": "2010-07-02T10:22:57Z", "lat": 51.6}]})
+        self.assertEqual([waypoint.lat for waypoint in location.waypoints], [51.6], "Waypoints not replaced")
+        datastream.fromDict({"datapoints": [{"at": "2010-07-02T10:22:57Z", "value": "24"}]})
+        self.assertEqual([datapoint.value for datapoint in datastream.datapoints], ["23", "24"],
+                         "Datapoints not added")
+
+    def test_LazyDecode(self):
+        """ Check nested structures are decoded on first access """
+        environment = txcosm.Environment()
+        environment.decode(TEST_FEED_JSON, format=txcosm.DataFormats.JSON, lazy=True)
+        self.assertEqual(environment.title, "Cosm Office environment", "Title mismatch")
+        self.assertEqual(sorted(environment._lazy.keys()),
+                         [txcosm.DataFields.Datastreams, txcosm.DataFields.Location],
+                         "Nested structures decoded eagerly")
+        self.assertEqual(len(environment.datastreams), 2, "Datastreams not decoded on access")
+        self.assertEqual(environment._lazy.keys(), [txcosm.DataFields.Location],
+                         "Datastreams still held raw")
+        eager = txcosm.Environment()
+        eager.decode(TEST_FEED_JSON, format=txcosm.DataFormats.JSON)
+        self.assertEqual(environment.toDict(), eager.toDict(), "Lazy decode mismatch")
+        self.assertRaises(AttributeError, getattr, environment, 'colour')
+
+        invalid = txcosm.Environment()
+        invalid.fromDictLazy({"title": "invalid", "location": {"exposure": "sideways"}})
+        for attempt in range(2):
+            try:
+                invalid.location
+            except AttributeError:
+                self.fail("Decode error replaced by AttributeError")
+            except Exception, ex:
+                self.assertTrue("sideways" in str(ex), "Decode error not raised")
+
+        environmentList = txcosm.EnvironmentList()
+        environmentList.decode(TEST_FEEDS_LIST_JSON, format=txcosm.DataFormats.JSON, lazy=True)
+        self.assertEqual(environmentList.total_results, 4299, "Total results mismatch")
+        self.assertEqual(environmentList.feeds.decoded(), 0, "Feeds decoded eagerly")
+        feed = environmentList.feeds[0]
+        self.assertEqual(feed.title, "bridge19", "Feed title mismatch")
+        self.assertEqual(environmentList.feeds.decoded(), 1, "Feed not decoded on access")
+        self.assertTrue(environmentList.feeds[0] is feed, "Feed decoded twice")
+        eager = txcosm.EnvironmentList()
+        eager.decode(TEST_FEEDS_LIST_JSON, format=txcosm.DataFormats.JSON)
+        self.assertEqual(environmentList.toDict(), eager.toDict(), "Lazy list decode mismatch")
+
+    def test_DirectJson(self):
+        """ Check structures are formatted as JSON without building dicts """
+        datastream = txcosm.Datastream(id="temperature", current_value=23.5,
+                                       unit={"label": "Celsius"},
+                                       datapoints=[{"at": "2010-07-02T10:21:57Z", "value": "23"},
+                                                   {"at": "2010-07-02T10:21:58Z", "value": 24},
+                                                   {"at": "2010-07-02T10:21:59Z", "value": ""}])
+        self.assertEqual(json.loads(datastream.toJson()), datastream.toDict(), "Datastream JSON mismatch")
+        self.assertFalse(" " in datastream.toJson(), "Datastream JSON not compact")
+
+        columnar = txcosm.Datastream(columnar=True)
+        columnar.addDatapoint("2010-07-02T10:21:57Z", "23.5")
+        self.assertEqual(json.loads(columnar.encode()), columnar.toDict(), "Columnar JSON mismatch")
+
+        environment = txcosm.Environment()
+        environment.decode(TEST_FEED_JSON, format=txcosm.DataFormats.JSON)
+        self.assertEqual(json.loads(environment.toJson()), json.loads(JSONBackend.dumps(environment.toDict())),
+                         "Environment JSON mismatch")
+
+        datapoints = [txcosm.Datapoint(at="2010-07-02T10:21:57Z", value=u"caf\xe9")]
+        self.assertEqual(txcosm.datapointsToJson(datapoints),
+                         '{"datapoints":[{"at":"2010-07-02T10:21:57Z","value":"caf\\u00e9"}]}',
+                         "Datapoints JSON mismatch")
+
+    def test_ChangeTracking(self):
+        """ Check only changes made since the last commit are encoded """
+        environment = txcosm.Environment(id=1234, title="Office",
+                                         datastreams=[{"id": str(i), "current_value": "0"} for i in range(50)])
+        self.assertEqual(len(environment.changesToDict()[txcosm.DataFields.Datastreams]), 50,
+                         "Uncommitted datastreams not all changed")
+        environment.commit()
+        self.assertFalse(environment.changed, "Committed environment changed")
+        self.assertEqual(environment.changesToDict(), {"version": txcosm.version}, "Unchanged delta mismatch")
+
+        environment.setCurrentValue("7", "1")
+        snapshot = environment.snapshot()
+        environment.title = "Lab"
+        environment.addDatapoint("3", "2010-07-02T10:21:57Z", "5")
+        delta = json.loads(environment.encode(delta=True))
+        delta["datastreams"].sort(key=lambda datastream: datastream["id"])
+        self.assertEqual(delta,
+                         {"version": list(txcosm.version), "title": "Lab",
+                          "datastreams": [{"id": "3", "datapoints": [{"at": "2010-07-02T10:21:57Z", "value": "5"}]},
+                                          {"id": "7", "current_value": "1"}]},
+                         "Delta mismatch")
+        environment.commit(snapshot)
+        changes = environment.changesToDict()
+        self.assertEqual(changes[txcosm.DataFields.Title], "Lab", "Change made after snapshot committed")
+        self.assertEqual(changes[txcosm.DataFields.Datastreams],
+                         [{"id": "3", "datapoints": [{"at": "2010-07-02T10:21:57Z", "value": "5"}]}],
+                         "Datastream changes mismatch")
+
+        environment.commit()
+        datastream = environment.datastreams["3"]
+        datastream.clear()
+        datastream.addDatapoint("2010-07-02T10:21:58Z", "6")
+        self.assertEqual(len(datastream.changesToDict()[txcosm.DataFields.Datapoints]), 1,
+                         "Datapoints added after clear not tracked")
+        environment.reset()
+        self.assertEqual(environment.changesToDict(), environment.toDict(), "Reset environment not changed")
+
+    def test_CsvCodec(self):
+        """ Check datapoint histories and current values are encoded as CSV """
+        datapoint = txcosm.Datapoint()
+        datapoint.decode("2010-07-02T10:21:57Z,23.5\n", format=txcosm.DataFormats.CSV)
+        self.assertEqual((datapoint.at, datapoint.value), ("2010-07-02T10:21:57Z", "23.5"),
+                         "Datapoint decode mismatch")
+        self.assertEqual(datapoint.encode(format=txcosm.DataFormats.CSV),
+                         "2010-07-02T10:21:57Z,23.5", "Datapoint encode mismatch")
+
+        history = "2010-07-02T10:21:57.000000Z,23.5\n2010-07-02T10:22:00.000000Z,24\n"
+        for columnar in [False, True]:
+            datastream = txcosm.Datastream(columnar=columnar, id="temperature")
+            datastream.decode(history, format=txcosm.DataFormats.CSV)
+            self.assertEqual([(dp.at, dp.value) for dp in datastream.datapoints],
+                             [("2010-07-02T10:21:57.000000Z", "23.5"),
+                              ("2010-07-02T10:22:00.000000Z", "24")],
+                             "Datapoints mismatch (columnar=%s)" % columnar)
+            self.assertEqual(datastream.current_value, "24", "Current value not set from last row")
+            self.assertEqual(datastream.encode(format=txcosm.DataFormats.CSV), history.strip(),
+                             "Datastream round trip mismatch (columnar=%s)" % columnar)
+
+        datastream = txcosm.Datastream()
+        datastream.decode("42", format=txcosm.DataFormats.CSV)
+        self.assertEqual(datastream.current_value, "42", "Bare current value mismatch")
+        self.assertEqual(datastream.toCsv(), "42", "Bare current value encode mismatch")
+
+        environment = txcosm.Environment(datastreams=[{"id": "temperature", "current_value": "1"}])
+        environment.decode("temperature,2010-07-02T10:21:57Z,23.5\nhumidity,40",
+                           format=txcosm.DataFormats.CSV)
+        self.assertEqual(environment.datastreams["temperature"].at, "2010-07-02T10:21:57Z",
+                         "Datastream timestamp not set")
+        self.assertEqual(sorted(environment.toCsv().splitlines()),
+                         ["humidity,40", "temperature,23.5"], "Environment CSV mismatch")
+        self.assertRaises(Exception, txcosm.Unit().encode, format=txcosm.DataFormats.CSV)
+
     def tearDown(self):
         pass
 
 
-suite = unittest.TestLoader().loadTestsFromTestCase(DataStructureTestCase)
+class ISO8601TestCase(unittest.TestCase):
+
+    def test_Parse(self):
+        """ Check timestamps are parsed to seconds since the epoch """
+        for timestamp in ["2010-07-02T10:21:57Z", "1970-01-01T00:00:00Z",
+                          "2000-02-29T23:59:59Z", "2100-03-01T00:00:00Z"]:
+            expected = calendar.timegm(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ"))
+            self.assertEqual(ISO8601.parseTimestamp(timestamp), expected,
+                             "Parse mismatch for %s" % timestamp)
+            self.assertEqual(ISO8601.parseTimestampSeconds(timestamp), expected,
+                             "Integer parse mismatch for %s" % timestamp)
+
+        self.assertAlmostEqual(ISO8601.parseTimestamp("2010-07-02T10:21:57.101496Z"),
+                               1278066117.101496, 6, "Fraction mismatch")
+        self.assertAlmostEqual(ISO8601.parseTimestamp("2010-07-02T12:21:57.5+02:00"),
+                               1278066117.5, 6, "UTC offset mismatch")
+        self.assertEqual(ISO8601.parseTimestampSeconds("2010-07-02T05:21:57.9-0500"),
+                         1278066117, "Integer UTC offset mismatch")
+        self.assertRaises(ValueError, ISO8601.parseTimestamp, "02/07/2010 10:21:57")
+
+    def test_ParseRanges(self):
+        """ Check timestamps with out of range fields are rejected """
+        for timestamp in ["2010-02-31T00:00:00Z", "2010-02-29T00:00:00Z", "2010-04-31T00:00:00Z",
+                          "2010-07-00T00:00:00Z", "2010-13-02T00:00:00Z", "2010-07-02T24:00:00Z",
+                          "2010-07-02T10:60:00Z", "2010-07-02T10:21:60Z", "2010-02-31T25:61:00Z"]:
+            self.assertRaises(ValueError, ISO8601.parseTimestamp, timestamp)
+            self.assertRaises(ValueError, ISO8601.parseTimestampSeconds, timestamp)
+        self.assertEqual(ISO8601.parseTimestampSeconds("2012-02-29T23:59:59Z"), 1330559999,
+                         "Leap day rejected")
+
+    def test_Format(self):
+        """ Check timestamps are formatted and round trip """
+        self.assertEqual(ISO8601.formatTimestamp(1278066117.101496),
+                         "2010-07-02T10:21:57.101496Z", "Format mismatch")
+        self.assertEqual(ISO8601.formatTimestamp(1278066117.9999996),
+                         "2010-07-02T10:21:58.000000Z", "Rounding mismatch")
+        timestamps = ISO8601.now(1000)
+        self.assertEqual(len(set(timestamps)), 1000, "Bulk timestamps not unique")
+        self.assertEqual(ISO8601.formatTimestamps([ISO8601.parseTimestamp(t) for t in timestamps]),
+                         timestamps, "Round trip mismatch")
+
+    def test_TypedAccessors(self):
+        """ Check the typed timestamp accessors """
+        datapoint = txcosm.Datapoint(at="2010-07-02T10:21:57.101496Z", value="1")
+        self.assertAlmostEqual(datapoint.at_seconds, 1278066117.101496, 6, "Datapoint at mismatch")
+        datapoint.at_seconds = 0
+        self.assertEqual(datapoint.at, "1970-01-01T00:00:00.000000Z", "Datapoint at not set")
+
+        datastream = txcosm.Datastream()
+        self.assertEqual(datastream.at_seconds, None, "Unset timestamp not None")
+        datastream.updated_seconds = 1278066117
+        self.assertEqual(datastream.updated, "2010-07-02T10:21:57.000000Z", "Datastream updated not set")
+        environment = txcosm.Environment(updated="2010-07-02T10:21:57Z")
+        self.assertEqual(environment.updated_seconds, 1278066117, "Environment updated mismatch")
+
+
+class JSONBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = JSONBackend.backend
+
+    def test_Selection(self):
+        """ Check the fastest available backend is chosen and can be overridden """
+        available = JSONBackend.availableBackends()
+        self.assertTrue(JSONBackend.STDLIB in available, "json module not available")
+        self.assertEqual(JSONBackend.setBackend(), available[0], "Fastest backend not chosen")
+        self.assertEqual(JSONBackend.setBackend(JSONBackend.STDLIB), JSONBackend.STDLIB,
+                         "Backend not overridden")
+        self.assertRaises(Exception, JSONBackend.setBackend, "yaml")
+
+    def test_IdenticalOutput(self):
+        """ Check every available backend encodes and decodes identically """
+        environment = txcosm.Environment()
+        environment.decode(TEST_FEED_JSON, format=txcosm.DataFormats.JSON)
+        JSONBackend.setBackend(JSONBackend.STDLIB)
+        expected = environment.encode()
+        self.assertEqual(json.loads(expected), environment.toDict(), "Encoded feed mismatch")
+        self.assertFalse('": ' in expected, "Output not compact")
+        for backend in JSONBackend.availableBackends():
+            JSONBackend.setBackend(backend)
+            self.assertEqual(environment.encode(), expected, "%s output mismatch" % backend)
+            decoded = txcosm.Environment()
+            decoded.decode(expected, format=txcosm.DataFormats.JSON)
+            self.assertEqual(decoded.toDict(), environment.toDict(), "%s decode mismatch" % backend)
+
+    def tearDown(self):
+        JSONBackend.setBackend(self.backend)
+
+
+suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(DataStructureTestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(ISO8601TestCase),
+                            unittest.TestLoader().loadTestsFromTestCase(JSONBackendTestCase)])
 
 
 if __name__ == "__main__":
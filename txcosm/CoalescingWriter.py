@@ -0,0 +1,203 @@
+
+'''
+This module implements a writer that coalesces many datastream updates
+into a single update_feed request per feed.
+
+Rather than sending a request for every value, changes are collected in
+an Environment for each feed and sent when the feed's flush interval
+expires or when enough changes have been collected. If a datastream's
+current value is set more than once between flushes only the last value
+is sent.
+'''
+
+import logging
+import txcosm
+from twisted.internet import reactor, defer
+
+
+class CoalescingWriter(object):
+    """
+    Collects datastream changes per feed and sends them to Cosm using one
+    update_feed request per feed per flush.
+
+    Only one update per feed is in flight at a time so updates reach Cosm
+    in the order they were made. Changes made while an update is in flight
+    are sent in the next update.
+    """
+
+    def __init__(self, client, api_key=None, flush_interval=1.0, max_changes=500):
+        """
+        @param client: The client used to send the updates
+        @type client: txcosm.HTTPClient.HTTPClient
+        @param api_key: The api key used to send the updates. If not set
+                        the client's api key is used.
+        @type api_key: string
+        @param flush_interval: The maximum time, in seconds, a change is
+                               held before being sent.
+        @type flush_interval: float
+        @param max_changes: The number of changes to a feed that trigger
+                            an immediate flush of that feed.
+        @type max_changes: int
+        """
+        self.client = client
+        self.api_key = api_key
+        self.flush_interval = flush_interval
+        self.max_changes = max_changes
+        self.clock = reactor
+
+        # each pending feed has a dict holding the environment collecting
+        # the changes, the number of changes, the deferreds waiting for
+        # the update and the delayed call that will flush it.
+        self.pending = dict()
+        self.inFlight = set()
+
+        self.writes = 0
+        self.updates = 0
+        self.failed_updates = 0
+
+    def setCurrentValue(self, feed_id, datastream_id, value):
+        """
+        Set the current value of a datastream.
+
+        @param feed_id: The feed identifier
+        @type feed_id: string
+        @param datastream_id: The datastream identifier
+        @type datastream_id: string
+        @param value: The current value for the datastream
+        @type value: string
+
+        @return: A deferred that returns the success of the update that
+                 carried the change.
+        @rtype: twisted.internet.defer.Deferred
+        """
+        entry = self._getEntry(feed_id)
+        entry['environment'].setCurrentValue(datastream_id, value)
+        return self._changed(feed_id, entry)
+
+    def addDatapoint(self, feed_id, datastream_id, at_time, value):
+        """
+        Add a historical datapoint to a datastream.
+
+        @param feed_id: The feed identifier
+        @type feed_id: string
+        @param datastream_id: The datastream identifier
+        @type datastream_id: string
+        @param at_time: The timestamp for the datapoint, in ISO8601 format
+        @type at_time: string
+        @param value: The value of the datapoint
+        @type value: string
+
+        @return: A deferred that returns the success of the update that
+                 carried the change.
+        @rtype: twisted.internet.defer.Deferred
+        """
+        entry = self._getEntry(feed_id)
+        entry['environment'].addDatapoint(datastream_id, at_time, value)
+        return self._changed(feed_id, entry)
+
+    def _getEntry(self, feed_id):
+        """
+        Return the pending changes for a feed, creating them if necessary
+        """
+        entry = self.pending.get(feed_id)
+        if entry is None:
+            entry = {'environment': txcosm.Environment(version="1.0.0"),
+                     'changes': 0,
+                     'waiting': [],
+                     'timer': self.clock.callLater(self.flush_interval, self._timerExpired, feed_id)}
+            self.pending[feed_id] = entry
+        return entry
+
+    def _changed(self, feed_id, entry):
+        """
+        Count a change to a feed, flushing the feed if enough changes have
+        been collected.
+        """
+        self.writes += 1
+        entry['changes'] += 1
+        d = defer.Deferred()
+        entry['waiting'].append(d)
+        if entry['changes'] >= self.max_changes:
+            self.flush(feed_id)
+        return d
+
+    def _timerExpired(self, feed_id):
+        """
+        Flush a feed whose flush interval has expired
+        """
+        entry = self.pending.get(feed_id)
+        if entry is not None:
+            entry['timer'] = None
+            self.flush(feed_id)
+
+    def flush(self, feed_id=None):
+        """
+        Send the pending changes for a feed, or for every feed, now. A feed
+        that has an update in flight is flushed when that update completes.
+
+        @param feed_id: The feed to flush. If not set all feeds are flushed.
+        @type feed_id: string
+        """
+        if feed_id is None:
+            for feed_id in self.pending.keys():
+                self.flush(feed_id)
+            return
+
+        if feed_id in self.inFlight:
+            # cancel the timer as the flush is retried on completion
+            entry = self.pending.get(feed_id)
+            if entry is not None and entry['timer'] is not None:
+                entry['timer'].cancel()
+                entry['timer'] = None
+            return
+
+        entry = self.pending.pop(feed_id, None)
+        if entry is None:
+            return
+        if entry['timer'] is not None:
+            entry['timer'].cancel()
+
+        logging.debug("Flushing %s changes to feed %s" % (entry['changes'], feed_id))
+        self.inFlight.add(feed_id)
+        self.updates += 1
+        d = self.client.update_feed(api_key=self.api_key,
+                                    feed_id=feed_id,
+                                    data=entry['environment'].encode())
+        d.addErrback(self._updateFailed, feed_id)
+        d.addCallback(self._updateComplete, feed_id, entry['waiting'])
+
+    def _updateFailed(self, failure, feed_id):
+        """
+        Log an update that could not be sent
+        """
+        logging.error("Problem updating feed %s: %s" % (feed_id, failure.getErrorMessage()))
+        return False
+
+    def _updateComplete(self, success, feed_id, waiting):
+        """
+        Pass the result of an update to the waiting deferreds and send any
+        changes made while the update was in flight.
+        """
+        self.inFlight.discard(feed_id)
+        if not success:
+            self.failed_updates += 1
+        for d in waiting:
+            d.callback(success)
+        entry = self.pending.get(feed_id)
+        if entry is not None and entry['timer'] is None:
+            self.flush(feed_id)
+
+    def stats(self):
+        """
+        Return a dict of writer statistics.
+
+        @return: A dict containing the number of changes written, the number
+                 of updates sent and failed and the number of feeds with
+                 changes pending or updates in flight.
+        @rtype: dict
+        """
+        return {'writes': self.writes,
+                'updates': self.updates,
+                'failed_updates': self.failed_updates,
+                'pending_feeds': len(self.pending),
+                'in_flight': len(self.inFlight)}
@@ -5,15 +5,26 @@ This module implements Cosm clients that are able to communicate
 with the Cosm API using HTTP and PAWS.
 '''
 
+import copy
+import datetime
 import logging
 import txcosm
 import urllib
-import uuid
-from StringIO import StringIO
+import itertools
+import urlparse
+import zlib
 from twisted.internet import reactor, defer
 from twisted.internet.protocol import Protocol
-from twisted.web.client import Agent, ResponseDone, FileBodyProducer
+from twisted.python.components import proxyForInterface
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, ResponseDone
+from twisted.web.client import ContentDecoderAgent, HTTPConnectionPool, ResponseFailed
 from twisted.web.http_headers import Headers
+from twisted.web.iweb import IBodyProducer, IResponse
+from txcosm.RequestScheduler import Priority, getSharedScheduler
+from txcosm.StreamingDecoder import DatastreamDecoder, EnvironmentListDecoder
+from txcosm.TimerWheel import getSharedTimerWheel
+from zope.interface import implementer
 
 
 def ignore_cancelled_error(failure):
@@ -21,35 +32,313 @@ def ignore_cancelled_error(failure):
     failure.trap(defer.CancelledError)
 
 
+class ConnectionPool(HTTPConnectionPool):
+    """
+    A pool of persistent (keep-alive) HTTP connections to the Cosm API.
+
+    Reusing a connection avoids paying for a new TCP and TLS handshake on
+    every request. This pool also keeps count of how connections are used
+    so the benefit of connection reuse can be observed.
+    """
+
+    def __init__(self, max_persistent_per_host=10, idle_timeout=240,
+                 persistent=True):
+        """
+        @param max_persistent_per_host: The maximum number of idle persistent
+                                        connections cached for each host.
+        @type max_persistent_per_host: int
+        @param idle_timeout: The number of seconds an idle connection is kept
+                             open before it is closed.
+        @type idle_timeout: float
+        @param persistent: A flag instructing the pool to keep connections
+                           open between requests.
+        @type persistent: boolean
+        """
+        HTTPConnectionPool.__init__(self, reactor, persistent=persistent)
+        self.maxPersistentPerHost = max_persistent_per_host
+        self.cachedConnectionTimeout = idle_timeout
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_returned = 0
+
+    def getConnection(self, key, endpoint):
+        """
+        Return a cached connection for the key if one is available,
+        otherwise create a new one.
+        """
+        self.requests += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        """
+        Create a new connection
+        """
+        self.connections_created += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def _putConnection(self, key, connection):
+        """
+        Return a connection to the pool once its response is complete
+        """
+        self.connections_returned += 1
+        HTTPConnectionPool._putConnection(self, key, connection)
+
+    def stats(self):
+        """
+        Return a dict of connection pool statistics.
+
+        @return: A dict containing the number of requests that asked for a
+                 connection, the number of connections created, the number
+                 of requests that reused an existing connection, the number
+                 of connections returned to the pool and the number of idle
+                 connections currently cached for each host.
+        @rtype: dict
+        """
+        idle = dict()
+        for (scheme, host, port), connections in self._connections.items():
+            if connections:
+                idle["%s://%s:%s" % (scheme, host, port)] = len(connections)
+        return {'requests': self.requests,
+                'connections_created': self.connections_created,
+                'connections_reused': max(0, self.requests - self.connections_created),
+                'connections_returned': self.connections_returned,
+                'idle_connections': idle}
+
+
+# The connection pool shared by all HTTPClient instances that are not
+# given a pool of their own.
+_shared_pool = None
+
+
+def getSharedPool(max_persistent_per_host=None, idle_timeout=None):
+    """
+    Return the connection pool shared by HTTPClient instances, creating it
+    on first use. If settings are supplied they are applied to the shared
+    pool and affect every client using it.
+
+    @param max_persistent_per_host: The maximum number of idle persistent
+                                    connections cached for each host.
+    @type max_persistent_per_host: int
+    @param idle_timeout: The number of seconds an idle connection is kept
+                         open before it is closed.
+    @type idle_timeout: float
+
+    @return: The shared connection pool
+    @rtype: ConnectionPool
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = ConnectionPool()
+    if max_persistent_per_host is not None:
+        _shared_pool.maxPersistentPerHost = max_persistent_per_host
+    if idle_timeout is not None:
+        _shared_pool.cachedConnectionTimeout = idle_timeout
+    return _shared_pool
+
+
+class TransferStats(object):
+    """
+    Keeps count of the bytes transferred by a client so the bandwidth
+    saved by compression can be measured.
+    """
+
+    def __init__(self):
+        self.request_bytes = 0           # request body bytes before compression
+        self.request_bytes_sent = 0      # request body bytes sent on the wire
+        self.response_bytes_received = 0  # response body bytes received on the wire
+        self.response_bytes_decoded = 0  # response body bytes after decompression
+
+    def toDict(self):
+        """
+        Return the statistics as a dict
+        """
+        return {'request_bytes': self.request_bytes,
+                'request_bytes_sent': self.request_bytes_sent,
+                'response_bytes_received': self.response_bytes_received,
+                'response_bytes_decoded': self.response_bytes_decoded}
+
+
+class DecompressingProtocol(Protocol):
+    """
+    This object wraps the protocol receiving a compressed response body,
+    decompressing the data as it is received and counting the bytes
+    received and decoded.
+    """
+
+    def __init__(self, protocol, response, wbits, stats):
+        self.original = protocol
+        self.response = response
+        self.wbits = wbits
+        self.stats = stats
+        self.decompressor = None
+
+    def makeConnection(self, transport):
+        self.original.makeConnection(transport)
+
+    def dataReceived(self, bytes):
+        """
+        Decompress some bytes of the response data and pass them on
+        """
+        if self.decompressor is None:
+            wbits = self.wbits
+            if wbits == zlib.MAX_WBITS and bytes and (ord(bytes[0]) & 0x0f) != zlib.DEFLATED:
+                # Some servers send raw deflate data without the zlib header
+                wbits = -zlib.MAX_WBITS
+            self.decompressor = zlib.decompressobj(wbits)
+        self.stats.response_bytes_received += len(bytes)
+        try:
+            data = self.decompressor.decompress(bytes)
+        except zlib.error:
+            raise ResponseFailed([Failure()], self.response)
+        if data:
+            self.stats.response_bytes_decoded += len(data)
+            self.original.dataReceived(data)
+
+    def connectionLost(self, reason):
+        """
+        Pass on any data remaining in the decompressor then the reason
+        """
+        if self.decompressor is not None:
+            try:
+                data = self.decompressor.flush()
+            except zlib.error:
+                raise ResponseFailed([reason, Failure()], self.response)
+            if data:
+                self.stats.response_bytes_decoded += len(data)
+                self.original.dataReceived(data)
+        self.original.connectionLost(reason)
+
+
+class DecompressingResponse(proxyForInterface(IResponse)):
+    """
+    A response wrapper that delivers the decompressed response body
+    """
+
+    def __init__(self, response, wbits, stats):
+        self.original = response
+        self.wbits = wbits
+        self.stats = stats
+
+    def deliverBody(self, protocol):
+        self.original.deliverBody(DecompressingProtocol(protocol,
+                                                        self.original,
+                                                        self.wbits,
+                                                        self.stats))
+
+
+@implementer(IBodyProducer)
+class StringBodyProducer(object):
+    """
+    A body producer that writes a request body, already held in memory,
+    to the connection in a single write. Unlike a FileBodyProducer it
+    does not copy the body into a file object and read it back in chunks.
+    """
+
+    def __init__(self, body):
+        """
+        @param body: The request body
+        @type body: string
+        """
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.body = body
+        self.length = len(body)
+
+    def startProducing(self, consumer):
+        consumer.write(self.body)
+        return defer.succeed(None)
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+
 class ResponseBodyProtocol(Protocol):
     """
     This object is used to receive the response body data
     after a request to a remote server.
     """
-    def __init__(self, finished, response):
+    def __init__(self, finished, response, stats=None):
         self.finished = finished
         self.response = response
+        self.stats = stats
         self.buffer = []
 
     def dataReceived(self, bytes):
         """
         Receive and store some bytes of the response data
         """
+        if self.stats:
+            self.stats.response_bytes_received += len(bytes)
+            self.stats.response_bytes_decoded += len(bytes)
         self.buffer.append(bytes)
 
     def connectionLost(self, reason):
         """
         Return the response and the response body via the finished deferred.
+        If the body could not be read completely the finished deferred fails.
         """
-        r = reason.trap(ResponseDone)
-        if r == ResponseDone:
+        self.buffer, responseData = [], "".join(self.buffer)
+        if reason.check(ResponseDone):
             logging.debug(reason.getErrorMessage())
-            responseData = "".join(self.buffer)
-            self.buffer = []
             result = (self.response, responseData)
             self.finished.callback(result)
         else:
             logging.error("Problem reading response body: %s" % reason.getErrorMessage())
+            self.finished.errback(reason)
+
+
+class StreamingBodyProtocol(Protocol):
+    """
+    This object is used to receive the response body data after a request
+    to a remote server, passing the data to a streaming decoder as it
+    arrives rather than storing it.
+    """
+    def __init__(self, finished, response, decoder, stats=None):
+        self.finished = finished
+        self.response = response
+        self.decoder = decoder
+        self.stats = stats
+        self.failed = False
+
+    def dataReceived(self, bytes):
+        """
+        Pass some bytes of the response data to the decoder
+        """
+        if self.stats:
+            self.stats.response_bytes_received += len(bytes)
+            self.stats.response_bytes_decoded += len(bytes)
+        if not self.failed:
+            try:
+                self.decoder.feed(bytes)
+            except Exception, ex:
+                logging.error("Problem decoding response body: %s" % ex)
+                self.failed = True
+
+    def connectionLost(self, reason):
+        """
+        Return the response and the decoded response body via the finished
+        deferred. If the body could not be decoded None is returned in place
+        of the decoded body. If the body could not be read completely the
+        finished deferred fails.
+        """
+        if reason.check(ResponseDone):
+            logging.debug(reason.getErrorMessage())
+            result = None
+            if not self.failed:
+                try:
+                    result = self.decoder.close()
+                except Exception, ex:
+                    logging.error("Problem decoding response body: %s" % ex)
+            self.finished.callback((self.response, result))
+        else:
+            logging.error("Problem reading response body: %s" % reason.getErrorMessage())
+            self.finished.errback(reason)
 
 
 class HTTPClient(object):
@@ -60,7 +349,32 @@ class HTTPClient(object):
 
     api_url = "api.cosm.com/v2"
 
-    def __init__(self, api_key=None, feed_id=None, use_http=False, timezone=None):
+    # Request bodies smaller than this are not worth compressing
+    compress_min_size = 512
+
+    # Cosm rejects create_datapoints requests with more datapoints than this
+    max_datapoints_per_request = 500
+
+    # The maximum time range, in seconds, of a single history query for
+    # each of the valid history intervals.
+    history_interval_ranges = [(0, 6 * 3600),
+                               (30, 12 * 3600),
+                               (60, 24 * 3600),
+                               (300, 5 * 86400),
+                               (900, 14 * 86400),
+                               (3600, 31 * 86400),
+                               (10800, 90 * 86400),
+                               (21600, 180 * 86400),
+                               (43200, 365 * 86400),
+                               (86400, 365 * 86400)]
+
+    # The maximum number of datapoints returned per page of history
+    max_history_per_page = 1000
+
+    def __init__(self, api_key=None, feed_id=None, use_http=False, timezone=None,
+                 pool=None, scheduler=None, priority=Priority.Normal,
+                 accept_compressed=False, compress_requests=False, cache=None,
+                 single_flight=False):
         """
         @param api_key: The default api key, with appropriate authorization privileges,
                         to use.
@@ -76,6 +390,36 @@ class HTTPClient(object):
                          the available settings see:
                          http://api.cosm.com/#time-zones
         @type timezone: string (eg. +3.5 or Adelaide)
+        @param pool: The persistent connection pool to send requests through.
+                     By default the pool shared by all HTTPClient instances
+                     is used (see getSharedPool).
+        @type pool: ConnectionPool
+        @param scheduler: The scheduler that bounds the number of requests in
+                          flight. By default the scheduler shared by all
+                          HTTPClient instances is used (see
+                          txcosm.RequestScheduler.getSharedScheduler).
+        @type scheduler: txcosm.RequestScheduler.RequestScheduler
+        @param priority: The priority class of requests made by this client.
+                         Queued requests from an interactive client are sent
+                         ahead of those from a bulk (e.g. backfill) client.
+        @type priority: int (one of txcosm.RequestScheduler.Priority)
+        @param accept_compressed: A flag instructing this object to ask for
+                                  gzip or deflate compressed responses.
+        @type accept_compressed: boolean
+        @param compress_requests: A flag instructing this object to gzip
+                                  the request bodies sent by create_datapoints
+                                  and update_feed.
+        @type compress_requests: boolean
+        @param cache: An optional response cache. If set read_feed,
+                      read_datastream and list_feeds make conditional
+                      requests and return the cached data structure
+                      when Cosm reports it has not been modified.
+        @type cache: txcosm.ResponseCache.ResponseCache
+        @param single_flight: A flag instructing this object to share a
+                              single request, and its decoded result,
+                              between concurrent identical read_feed,
+                              read_datastream and list_feeds calls.
+        @type single_flight: boolean
 
         """
         self.feed_id = feed_id
@@ -91,9 +435,39 @@ class HTTPClient(object):
         if timezone:
             self.timezone = "timezone=%s" % timezone
 
+        if pool is None:
+            pool = getSharedPool()
+        self.pool = pool
+
         # The agent web client is responsible for handling all
-        # requests to and responses from the Cosm site.
-        self.agent = Agent(reactor)
+        # requests to and responses from the Cosm site. Connections
+        # are kept alive in the pool and reused between requests.
+        self.agent = Agent(reactor, pool=self.pool)
+
+        # Count the bytes transferred so the bandwidth saved by
+        # compression can be measured.
+        self.stats = TransferStats()
+        self.compress_requests = compress_requests
+        if accept_compressed:
+            self.agent = ContentDecoderAgent(self.agent,
+                                             [('gzip', self._gzipDecoder),
+                                              ('deflate', self._deflateDecoder)])
+
+        # Requests are passed through the scheduler which queues any
+        # requests that would exceed the in-flight limits.
+        if scheduler is None:
+            scheduler = getSharedScheduler()
+        self.scheduler = scheduler
+        self.priority = priority
+
+        self.cache = cache
+
+        # Identical GET requests in flight when single flight is enabled,
+        # keyed by method, url and api key, each with the list of deferreds
+        # waiting for its result.
+        self.single_flight = single_flight
+        self.inFlightGets = {}
+        self.coalesced_requests = 0
 
         # Common header settings used in every request.
         self.headers = {'User-Agent': 'txcosm Client',
@@ -101,12 +475,45 @@ class HTTPClient(object):
 
         self._request_timeout = 10.0  # default request timeout in seconds
 
-        # this dict holds a unique identifier for each request made
-        # and has values of two deferreds for each request. One deferred
-        # is for the actual request while the other is for the timeout.
+        # Request timeouts are managed by a timer wheel rather than a
+        # reactor delayed call per request.
+        self.timers = getSharedTimerWheel()
+
+        # this dict holds a unique identifier for each request made and
+        # has a value of [request deferred, response deferred, timer handle]
+        # for each request. The request deferred is for the actual request,
+        # the response deferred returns the result to the caller and the
+        # timer handle is for the timeout.
         self.pendingRequests = {}
-        self.pendingResponses = {}
-        self.pendingTimeouts = {}
+        self._request_ids = itertools.count(1)
+
+    @property
+    def pool_stats(self):
+        ''' Return the connection pool statistics '''
+        return self.pool.stats()
+
+    @property
+    def scheduler_stats(self):
+        ''' Return the request scheduler statistics '''
+        return self.scheduler.stats()
+
+    @property
+    def transfer_stats(self):
+        ''' Return the byte counts of request and response bodies '''
+        return self.stats.toDict()
+
+    @property
+    def cache_stats(self):
+        ''' Return the response cache statistics '''
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    @property
+    def single_flight_stats(self):
+        ''' Return the number of requests coalesced and still in flight '''
+        return {'coalesced_requests': self.coalesced_requests,
+                'in_flight': len(self.inFlightGets)}
 
     @property
     def request_timeout(self):
@@ -121,42 +528,69 @@ class HTTPClient(object):
     def _handle_request_timeout(self, request_id, url):
         ''' Handle a request timeout '''
         logging.error("Request timeout: %s" % url)
-        del self.pendingTimeouts[request_id]  # cleanup
+        request_d, response_d, timer = self.pendingRequests.pop(request_id)  # cleanup
 
         # cancel deferred that would have returned request result.
-        request_d = self.pendingRequests[request_id]
         request_d.addErrback(ignore_cancelled_error)
         request_d.cancel()
 
         # pass result back indicating failure
-        self.pendingResponses[request_id].callback(None)
+        response_d.callback(None)
 
     @defer.inlineCallbacks
-    def _handle_response(self, response, request_id, url):
+    def _handle_response(self, response, request_id, url, bodyDecoder=None):
         ''' Handle a response '''
-        del self.pendingRequests[request_id]  # cleanup
+        request_d, response_d, timer = self.pendingRequests.pop(request_id)  # cleanup
 
         # cancel the timeout for this request now we have response
-        self.pendingTimeouts[request_id].cancel()
-
-        response, responseBody = yield self._handleResponseHeader(response, url)
-        result = (response, responseBody)
-        # pass result back indicating failure
-        response_d = self.pendingResponses[request_id]
-        del self.pendingResponses[request_id]  # cleanup
+        self.timers.cancel(timer)
+
+        try:
+            result = yield self._handleResponseHeader(response, url, bodyDecoder)
+        except Exception:
+            # the body could not be read, pass result back indicating failure
+            result = None
+        # pass result back to the caller
         response_d.callback(result)
 
-    def _handleResponseHeader(self, response, url):
+    def _handle_request_failure(self, failure, request_id, url):
+        ''' Handle a request that failed before its response was received '''
+        if failure.check(defer.CancelledError):
+            # the request was cancelled by its timeout
+            return None
+        logging.error("Request failed: %s: %s" % (url, failure.getErrorMessage()))
+        pending = self.pendingRequests.pop(request_id, None)  # cleanup
+        if pending is not None:
+            request_d, response_d, timer = pending
+            self.timers.cancel(timer)
+            # pass result back indicating failure
+            response_d.callback(None)
+
+    def _gzipDecoder(self, response):
+        ''' Wrap a gzip encoded response '''
+        return DecompressingResponse(response, 16 + zlib.MAX_WBITS, self.stats)
+
+    def _deflateDecoder(self, response):
+        ''' Wrap a deflate encoded response '''
+        return DecompressingResponse(response, zlib.MAX_WBITS, self.stats)
+
+    def _handleResponseHeader(self, response, url, bodyDecoder=None):
         """
         Called upon successful receipt of the response headers. The response's
         body is then retrieved. Upon completion of the body retrieval the
         returned deferred is fired returning a tuple containing the response
         and the response body.
 
+        If a body decoder is supplied the body of a successful (200)
+        response is passed to it as it is received and the value returned
+        when the decoder is closed is returned in place of the response body.
+
         @param response: The response object
         @type response: twisted.web.client.Response
         @param url: The url used during the request
         @type url: string
+        @param bodyDecoder: An optional streaming decoder with feed and
+          close methods.
 
         @return:  A deferred that returns a result tuple containing the response,
         and the response body.
@@ -164,18 +598,157 @@ class HTTPClient(object):
         """
         logging.debug("Success communicating with url: %s" % (url))
         finished = defer.Deferred()
-        response.deliverBody(ResponseBodyProtocol(finished, response))
+        stats = self.stats
+        if isinstance(response, DecompressingResponse):
+            # compressed responses are counted as they are decoded
+            stats = None
+        if bodyDecoder is not None and response.code == 200:
+            response.deliverBody(StreamingBodyProtocol(finished, response, bodyDecoder, stats))
+        else:
+            response.deliverBody(ResponseBodyProtocol(finished, response, stats))
         return finished
 
-    def _convertToCosmStructure(self, data, format, kind):
+    def _convertToCosmStructure(self, data, format, kind, lazy=False):
         """
         Convert the data into a DataStructure object
         """
         dataStructureClass = txcosm.getDataStructure(kind)
         dataStructure = dataStructureClass()
-        dataStructure.decode(data, format)
+        if lazy:
+            dataStructure.decode(data, format, lazy=True)
+        else:
+            dataStructure.decode(data, format)
         return dataStructure
 
+    def _getStructure(self, url, headers, format, kind, priority=None, copy=False, lazy=False):
+        """
+        Perform a get at the specified url and convert a successful response
+        into a DataStructure object.
+
+        If single flight is enabled and an identical request is already in
+        flight no request is made. Instead the result of the request in
+        flight is shared.
+
+        @param url: The url used during the request
+        @type url: string
+        @param headers: A dict of header key value pairs to be used in the
+          request
+        @type headers: dict
+        @param format: The format the results were requested in
+        @type format: string
+        @param kind: The kind of data structure to convert the response into
+        @type kind: string
+        @param priority: The priority class of the request
+        @type priority: int
+        @param copy: A flag requesting an independent copy of the data
+          structure rather than the one shared with other callers and the
+          response cache.
+        @type copy: boolean
+        @param lazy: A flag requesting that the nested structures of the
+          data structure are only decoded when first accessed.
+        @type lazy: boolean
+
+        @return: A deferred that returns a tuple containing the response
+          code and the data structure, which is None unless the code is 200.
+          If the request fails None is returned.
+        @rtype: twisted.internet.defer.Deferred
+        """
+        if self.single_flight:
+            key = ("GET", url, headers.get('X-ApiKey'))
+            d = defer.Deferred()
+            waiting = self.inFlightGets.get(key)
+            if waiting is None:
+                # register the caller before the request is made in case
+                # the request completes immediately.
+                self.inFlightGets[key] = [d]
+                fetch_d = self._fetchStructure(url, headers, format, kind, priority, lazy)
+                fetch_d.addBoth(self._singleFlightComplete, key)
+            else:
+                self.coalesced_requests += 1
+                logging.debug("Coalesced request for %s" % url)
+                waiting.append(d)
+        else:
+            d = self._fetchStructure(url, headers, format, kind, priority, lazy)
+        if copy:
+            d.addCallback(self._copyResult)
+        return d
+
+    def _singleFlightComplete(self, result, key):
+        """
+        Pass the result of a request to every caller waiting for it
+        """
+        for d in self.inFlightGets.pop(key):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def _copyResult(self, result):
+        """
+        Replace the data structure in a result with an independent copy
+        """
+        if result and result[1] is not None:
+            code, dataStructure = result
+            result = (code, copy.deepcopy(dataStructure))
+        return result
+
+    @defer.inlineCallbacks
+    def _fetchStructure(self, url, headers, format, kind, priority=None, lazy=False):
+        """
+        Perform a get at the specified url and convert a successful response
+        into a DataStructure object. If the client has a response cache the
+        request is made conditional on the cached validators and, when Cosm
+        responds that the resource is not modified, the cached object is
+        returned without decoding.
+
+        @param url: The url used during the request
+        @type url: string
+        @param headers: A dict of header key value pairs to be used in the
+          request
+        @type headers: dict
+        @param format: The format the results were requested in
+        @type format: string
+        @param kind: The kind of data structure to convert the response into
+        @type kind: string
+        @param priority: The priority class of the request
+        @type priority: int
+        @param lazy: A flag requesting that the nested structures of the
+          data structure are only decoded when first accessed.
+        @type lazy: boolean
+
+        @return: A deferred that returns a tuple containing the response
+          code and the data structure, which is None unless the code is 200.
+          If the request fails None is returned.
+        @rtype: twisted.internet.defer.Deferred
+        """
+        cacheKey = (url, headers.get('X-ApiKey'))
+        cacheEntry = None
+        if self.cache is not None:
+            # keep the entry whose validators are sent in case it is
+            # evicted before the response arrives
+            cacheEntry = self.cache.lookup(cacheKey)
+            headers.update(self.cache.validators(cacheKey, cacheEntry))
+
+        result = yield self._get(url, headers, priority)
+        if not result:
+            defer.returnValue(None)
+
+        response, responseBody = result
+        if response.code == 304 and self.cache is not None:
+            dataStructure = self.cache.revalidated(cacheKey, cacheEntry)
+            if dataStructure is not None:
+                defer.returnValue((200, dataStructure))
+
+        if response.code != 200:
+            defer.returnValue((response.code, None))
+
+        dataStructure = self._convertToCosmStructure(responseBody, format, kind, lazy)
+        if self.cache is not None:
+            etag = response.headers.getRawHeaders('ETag', [None])[0]
+            last_modified = response.headers.getRawHeaders('Last-Modified', [None])[0]
+            self.cache.store(cacheKey, etag, last_modified, dataStructure)
+        defer.returnValue((200, dataStructure))
+
     def _getResponseCodeStatusFromHeader(self, response):
         """
         Most responses need to deliver the response body data. Some need
@@ -216,10 +789,46 @@ class HTTPClient(object):
             logging.error(err_str)
             raise Exception(err_str)
 
-    def _sendRequest(self, method, url, headers, bodyProducer):
+    def _sendRequest(self, method, url, headers, bodyProducer, priority=None,
+                     bodyDecoder=None):
+        """
+        Send a request to the url, where the method argument defines the kind
+        of request. The request is passed through the scheduler and is sent
+        once the in-flight limits for the host and API key allow it.
+        Returns a deferred that returns a tuple containing the response header
+        and the response body.
+
+        @param method: The kind of request to make. [GET|PUT|POST|DELETE]
+        @type method: string
+        @param url: The url used during the request
+        @type url: string
+        @param headers: A dict of header key value pairs to be used in the
+          request
+        @type headers: dict
+        @param bodyProducer: An object implementing IBodyProducer that is
+          capable of being used to send the request body data.
+        @param priority: The priority class of the request. If not set the
+          client's default priority is used.
+        @type priority: int
+        @param bodyDecoder: An optional streaming decoder that the response
+          body is passed to as it is received.
+
+        @return:  A deferred that returns a result tuple containing the
+        response, and the response body.
+        @rtype: twisted.internet.defer.Deferred
+        """
+        if priority is None:
+            priority = self.priority
+        host = urlparse.urlparse(url).netloc
+        api_key = headers.get('X-ApiKey')
+        return self.scheduler.submit(host, api_key, priority,
+                                     lambda: self._dispatchRequest(method, url, headers,
+                                                                   bodyProducer, bodyDecoder))
+
+    def _dispatchRequest(self, method, url, headers, bodyProducer, bodyDecoder=None):
         """
         Send a request to the url, where the method argument defines the kind
-        of request.
+        of request. The request timeout starts when the request is sent.
         Returns a deferred that returns a tuple containing the response header
         and the response body.
 
@@ -232,6 +841,8 @@ class HTTPClient(object):
         @type headers: dict
         @param bodyProducer: An object implementing IBodyProducer that is
           capable of being used to send the request body data.
+        @param bodyDecoder: An optional streaming decoder that the response
+          body is passed to as it is received.
 
         @return:  A deferred that returns a result tuple containing the
         response, and the response body.
@@ -242,30 +853,37 @@ class HTTPClient(object):
                                                                         url,
                                                                         str(headers),
                                                                         bodyProducer.length if bodyProducer else 0))
-        request_id = uuid.uuid4().hex
+        request_id = next(self._request_ids)
 
-        headers = dict([(k, [v]) for k, v in headers.items()])
-        request_d = self.agent.request(method=method,
-                                       uri=url,
-                                       headers=Headers(headers),
-                                       bodyProducer=bodyProducer)
-        request_d.addCallback(self._handle_response, request_id, url)
-        request_d.addErrback(ignore_cancelled_error)
-        self.pendingRequests[request_id] = request_d
+        # register the request before it is sent in case the agent
+        # responds immediately.
+        response_d = defer.Deferred()
+        pending = [None, response_d, None]
+        self.pendingRequests[request_id] = pending
 
         # set up a timer to timeout request if no response is received
         # witihin a specified time interval.
-        timeout = reactor.callLater(self._request_timeout,
-                                    self._handle_request_timeout,
-                                    request_id,
-                                    url)
-        self.pendingTimeouts[request_id] = timeout
+        pending[2] = self.timers.schedule(self._request_timeout,
+                                          self._handle_request_timeout,
+                                          request_id,
+                                          url)
+
+        headers = dict([(k, [v]) for k, v in headers.items()])
+        try:
+            request_d = self.agent.request(method=method,
+                                           uri=url,
+                                           headers=Headers(headers),
+                                           bodyProducer=bodyProducer)
+        except Exception:
+            # handled by _handle_request_failure like any failed request
+            request_d = defer.fail()
+        pending[0] = request_d
+        request_d.addCallback(self._handle_response, request_id, url, bodyDecoder)
+        request_d.addErrback(self._handle_request_failure, request_id, url)
 
-        response_d = defer.Deferred()
-        self.pendingResponses[request_id] = response_d
         return response_d
 
-    def _get(self, url, headers):
+    def _get(self, url, headers, priority=None, bodyDecoder=None):
         """
         Perform a get at the specified url
 
@@ -274,15 +892,46 @@ class HTTPClient(object):
         @param headers: A dict of header key value pairs to be used in the
           request
         @type headers: dict
+        @param priority: The priority class of the request
+        @type priority: int
+        @param bodyDecoder: An optional streaming decoder that the response
+          body is passed to as it is received.
 
         @return:  A deferred that returns a result tuple containing the
           response,
         and the response body.
         @rtype: twisted.internet.defer.Deferred
         """
-        return self._sendRequest("GET", url, headers, None)
+        return self._sendRequest("GET", url, headers, None, priority, bodyDecoder)
+
+    def _bodyProducer(self, headers, data, compress=False):
+        """
+        Return a body producer for the request body data, gzip compressing
+        the data if requested and the data is large enough to benefit.
+
+        @param headers: A dict of header key value pairs to be used in the
+          request. A Content-Encoding header is added if the data is
+          compressed.
+        @type headers: dict
+        @param data: The data that forms the body of the request.
+        @type data: string
+        @param compress: A flag requesting that the data be compressed.
+        @type compress: boolean
+
+        @return: An object implementing IBodyProducer
+        @rtype: StringBodyProducer
+        """
+        if data is None:
+            data = ""
+        self.stats.request_bytes += len(data)
+        if compress and len(data) >= self.compress_min_size:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            data = compressor.compress(data) + compressor.flush()
+            headers['Content-Encoding'] = 'gzip'
+        self.stats.request_bytes_sent += len(data)
+        return StringBodyProducer(data)
 
-    def _put(self, url, headers, data):
+    def _put(self, url, headers, data, priority=None, compress=False):
         """
         Perform a put at the specified url
 
@@ -293,15 +942,20 @@ class HTTPClient(object):
         @type headers: dict
         @param data: The data that forms the body of the request.
         @type data: string
+        @param priority: The priority class of the request
+        @type priority: int
+        @param compress: A flag requesting the body data be gzip compressed
+        @type compress: boolean
 
         @return:  A deferred that returns a result tuple containing the
           response, and the response body.
         @rtype: twisted.internet.defer.Deferred
         """
         return self._sendRequest("PUT", url, headers,
-                                 FileBodyProducer(StringIO(data)))
+                                 self._bodyProducer(headers, data, compress),
+                                 priority)
 
-    def _post(self, url, headers, data):
+    def _post(self, url, headers, data, priority=None, compress=False):
         """
         Perform a post at the specified url
 
@@ -312,6 +966,10 @@ class HTTPClient(object):
         @type headers: dict
         @param data: The data that forms the body of the request.
         @type data: string
+        @param priority: The priority class of the request
+        @type priority: int
+        @param compress: A flag requesting the body data be gzip compressed
+        @type compress: boolean
 
         @return:  A deferred that returns a result tuple containing the
           response,
@@ -319,9 +977,10 @@ class HTTPClient(object):
         @rtype: twisted.internet.defer.Deferred
         """
         return self._sendRequest("POST", url, headers,
-                                 FileBodyProducer(StringIO(data)))
+                                 self._bodyProducer(headers, data, compress),
+                                 priority)
 
-    def _delete(self, url, headers):
+    def _delete(self, url, headers, priority=None):
         """
         Perform a delete at the specified url
 
@@ -330,13 +989,15 @@ class HTTPClient(object):
         @param headers: A dict of header key value pairs to be used in the
           request
         @type headers: dict
+        @param priority: The priority class of the request
+        @type priority: int
 
         @return:  A deferred that returns a result tuple containing the
           response,
         and the response body.
         @rtype: twisted.internet.defer.Deferred
         """
-        return self._sendRequest("DELETE", url, headers, None)
+        return self._sendRequest("DELETE", url, headers, None, priority)
 
     #
     # Environments (Feeds)
@@ -344,7 +1005,7 @@ class HTTPClient(object):
 
     @defer.inlineCallbacks
     def list_feeds(self, api_key=None, format=txcosm.DataFormats.JSON,
-                   parameters=None):
+                   parameters=None, feedHandler=None, copy=False, lazy=False):
         """
         Returns a paged list of Cosm's feeds that are viewable by
         the authenticated account with a default page size of 50 feeds.
@@ -356,6 +1017,21 @@ class HTTPClient(object):
         @type format: string
         @param parameters: Additional parameters to configure the search query.
         @type parameters: dict
+        @param feedHandler: An optional callable. If set the response is
+          decoded as it is received and each feed is passed to the handler
+          as a txcosm.Environment object as soon as it has been decoded.
+          The returned list then holds no feeds. Only the json and xml
+          formats can be streamed.
+        @type feedHandler: callable
+        @param copy: A flag requesting an independent copy of the result
+          rather than one shared with concurrent callers or the response
+          cache.
+        @type copy: boolean
+        @param lazy: A flag requesting that each feed is held undecoded
+          until it is first accessed, and that its datastreams and location
+          are only decoded when they are first accessed. This makes large
+          pages cheap when only a few fields of each feed are used.
+        @type lazy: boolean
 
         @return: A deferred that returns the response body which is a paged
                  list of feeds (default 50 per page) viewable by the api_key
@@ -452,14 +1128,25 @@ class HTTPClient(object):
 
         headers = {'X-ApiKey': api_key}
 
-        result = yield self._get(url, headers)
+        bodyDecoder = None
+        if feedHandler is not None:
+            bodyDecoder = EnvironmentListDecoder(feedHandler, format)
+
+        if bodyDecoder is not None:
+            result = yield self._get(url, headers, bodyDecoder=bodyDecoder)
+            if result:
+                response, responseBody = result
+                # the feeds have already been passed to the handler
+                result = (response.code, responseBody)
+        else:
+            result = yield self._getStructure(url, headers, format, txcosm.List_Feeds_Msg,
+                                              copy=copy, lazy=lazy)
         if result:
-            response, responseBody = result
-            if response.code == 200:
-                dataStructure = self._convertToCosmStructure(responseBody, format, txcosm.List_Feeds_Msg)
+            code, dataStructure = result
+            if code == 200:
                 defer.returnValue(dataStructure)
             else:
-                logging.error('Problem retrieving feed list. Expected response code 200 got %s' % response.code)
+                logging.error('Problem retrieving feed list. Expected response code 200 got %s' % code)
                 defer.returnValue(None)
         else:
             logging.error('Problem retrieving feed list. Request failed')
@@ -512,7 +1199,8 @@ class HTTPClient(object):
 
     @defer.inlineCallbacks
     def read_feed(self, api_key=None, feed_id=None,
-                  format=txcosm.DataFormats.JSON, parameters=None):
+                  format=txcosm.DataFormats.JSON, parameters=None, copy=False,
+                  lazy=False):
         """
         Returns the most recent datastreams for environment [feed_id],
         viewable by the api_key provided
@@ -526,6 +1214,13 @@ class HTTPClient(object):
         @type format: string
         @param parameters: Additional parameters to configure the search query.
         @type parameters: dict
+        @param copy: A flag requesting an independent copy of the result
+          rather than one shared with concurrent callers or the response
+          cache.
+        @type copy: boolean
+        @param lazy: A flag requesting that the feed's datastreams and
+          location are only decoded when they are first accessed.
+        @type lazy: boolean
 
         @return: A deferred that returns a txcosm.Environment object populated
                  from the body of the response or None.
@@ -639,16 +1334,14 @@ class HTTPClient(object):
 
         headers = {'X-ApiKey': api_key}
 
-        result = yield self._get(url, headers)
+        result = yield self._getStructure(url, headers, format, txcosm.View_Feed_Msg,
+                                          copy=copy, lazy=lazy)
         if result:
-            response, responseBody = result
-            if response.code == 200:
-                dataStructure = self._convertToCosmStructure(responseBody,
-                                                             format,
-                                                             txcosm.View_Feed_Msg)
+            code, dataStructure = result
+            if code == 200:
                 defer.returnValue(dataStructure)
             else:
-                logging.error('Problem reading feed. Expected response code 200 got %s' % response.code)
+                logging.error('Problem reading feed. Expected response code 200 got %s' % code)
                 defer.returnValue(None)
         else:
             logging.error('Problem reading feed. Request failed')
@@ -692,7 +1385,7 @@ class HTTPClient(object):
 
         headers = {'X-ApiKey': api_key}
 
-        result = yield self._put(url, headers, data)
+        result = yield self._put(url, headers, data, compress=self.compress_requests)
         if result:
             response, responseBody = result
             defer.returnValue(self._getResponseCodeStatusFromHeader(response))
@@ -700,6 +1393,44 @@ class HTTPClient(object):
             logging.error('Problem updating feed. Request failed')
             defer.returnValue(False)
 
+    @defer.inlineCallbacks
+    def update_feed_changes(self, environment, api_key=None, feed_id=None,
+                            format=txcosm.DataFormats.JSON):
+        """
+        Updates a feed with only the fields and datastreams of an environment
+        that have changed since it was last committed, then commits the
+        state that was sent if the update succeeds. Changes made while the
+        update is in progress remain uncommitted and are sent by the next
+        update. No request is made if nothing has changed.
+
+        @param environment: The environment holding the changes
+        @type environment: txcosm.Environment
+        @param api_key: An api key with authorization settings allowing this
+          action to be performed
+        @type api_key: string
+        @param feed_id: The feed identifier
+        @type feed_id: string
+        @param format: The format to send the changes in [json|xml|csv]
+        @type format: string
+
+        @return: A deferred that returns the success of the update based on
+                 the response header data.
+        @rtype: boolean
+
+        If api_key or feed_id arguments are not set when calling this method
+        then the values set during this object's instantiation
+        (ie. in __init__) are used.
+        """
+        if not environment.changed:
+            defer.returnValue(True)
+        snapshot = environment.snapshot()
+        data = environment.encode(format=format, delta=True)
+        success = yield self.update_feed(api_key=api_key, feed_id=feed_id,
+                                         format=format, data=data)
+        if success:
+            environment.commit(snapshot)
+        defer.returnValue(success)
+
     @defer.inlineCallbacks
     def delete_feed(self, api_key=None, feed_id=None):
         """
@@ -807,7 +1538,8 @@ class HTTPClient(object):
 
     @defer.inlineCallbacks
     def read_datastream(self, api_key=None, feed_id=None, datastream_id=None,
-                        format=txcosm.DataFormats.JSON, parameters=None):
+                        format=txcosm.DataFormats.JSON, parameters=None,
+                        datapointHandler=None, priority=None, copy=False):
         """
         Read the requested datastream.
 
@@ -822,6 +1554,19 @@ class HTTPClient(object):
         @type format: string
         @param parameters: Additional parameters to configure the png output.
         @type parameters: dict
+        @param datapointHandler: An optional callable. If set the response
+          is decoded as it is received and each historical datapoint is
+          passed to the handler as a txcosm.Datapoint object as soon as it
+          has been decoded. The returned datastream then holds no datapoints.
+          Only the json, xml and csv formats can be streamed.
+        @type datapointHandler: callable
+        @param priority: The priority class of the request. If not set the
+          client's default priority is used.
+        @type priority: int
+        @param copy: A flag requesting an independent copy of the result
+          rather than one shared with concurrent callers or the response
+          cache.
+        @type copy: boolean
 
         @return: A deferred that returns a txcosm.Datastream object or PNG
           file content. If a problem occurs None is returned.
@@ -945,24 +1690,172 @@ class HTTPClient(object):
 
         headers = {'X-ApiKey': api_key}
 
-        result = yield self._get(url, headers)
+        bodyDecoder = None
+        if datapointHandler is not None:
+            bodyDecoder = DatastreamDecoder(datapointHandler, format)
+
+        if format == txcosm.DataFormats.PNG or bodyDecoder is not None:
+            result = yield self._get(url, headers, priority=priority, bodyDecoder=bodyDecoder)
+            if result:
+                response, responseBody = result
+                result = (response.code, responseBody)
+        else:
+            result = yield self._getStructure(url, headers, format,
+                                              txcosm.View_Datastream_Msg,
+                                              priority=priority, copy=copy)
         if result:
-            response, responseBody = result
-            if response.code == 200:
-                if format == txcosm.DataFormats.PNG:
-                    defer.returnValue(responseBody)
-                else:
-                    dataStructure = self._convertToCosmStructure(responseBody,
-                                                                 format,
-                                                                 txcosm.View_Datastream_Msg)
-                    defer.returnValue(dataStructure)
+            code, dataStructure = result
+            if code == 200:
+                defer.returnValue(dataStructure)
             else:
-                logging.error('Problem reading datastream. Expected response code 200 got %s' % response.code)
+                logging.error('Problem reading datastream. Expected response code 200 got %s' % code)
                 defer.returnValue(None)
         else:
             logging.error('Problem reading datastream. Request failed')
             defer.returnValue(None)
 
+    @defer.inlineCallbacks
+    def read_datastream_history(self, api_key=None, feed_id=None, datastream_id=None,
+                                start=None, end=None, interval=0, max_parallel=4):
+        """
+        Read the history of a datastream over any time range.
+
+        Cosm limits the time range of a single history query according to
+        the interval requested (6 hours of raw data, 24 hours of 60 second
+        data and so on) and returns at most 1000 datapoints per page. The
+        range requested is split into windows that respect these limits and
+        the windows are read concurrently, at bulk priority, with no more
+        than max_parallel requests in flight at once. Cosm does not report
+        how many pages a window holds, so once a window returns a full page
+        its following pages are read ahead, max_parallel at a time, until a
+        page is returned that is not full. The datapoints are then merged,
+        in time order, into a single datastream.
+
+        @param api_key: An api key with authorization settings allowing this
+          action to be performed
+        @type api_key: string
+        @param feed_id: The feed identifier
+        @type feed_id: string
+        @param datastream_id: A datastream identifier
+        @type datastream_id: string
+        @param start: The start of the time range
+        @type start: datetime.datetime (UTC)
+        @param end: The end of the time range. If not set the current time
+          is used.
+        @type end: datetime.datetime (UTC)
+        @param interval: The interval, in seconds, between datapoints. Zero
+          requests every datapoint stored. Other values are rounded up to
+          the next interval supported by Cosm.
+        @type interval: int
+        @param max_parallel: The maximum number of requests in flight at once.
+        @type max_parallel: int
+
+        @return: A deferred that returns a txcosm.Datastream object holding
+          the datapoints in time order. If a problem occurs None is returned.
+        @rtype: txcosm.Datastream or None
+
+        If api_key or feed_id arguments are not set when calling this method
+        then the values set during this object's instantiation
+        (ie. in __init__) are used.
+        """
+        if start is None:
+            raise Exception("A start time is required to read datastream history")
+        if end is None:
+            end = datetime.datetime.utcnow()
+
+        for valid_interval, max_range in self.history_interval_ranges:
+            if interval <= valid_interval:
+                interval = valid_interval
+                break
+        else:
+            raise Exception("Invalid history interval \'%s\' exceeds %s" % (interval, valid_interval))
+
+        windows = []
+        window_start = start
+        window_length = datetime.timedelta(seconds=max_range)
+        while window_start < end:
+            window_end = min(window_start + window_length, end)
+            windows.append((window_start, window_end))
+            window_start = window_end
+
+        semaphore = defer.DeferredSemaphore(max_parallel)
+        results = yield defer.gatherResults([self._readHistoryWindow(api_key,
+                                                                     feed_id,
+                                                                     datastream_id,
+                                                                     window_start,
+                                                                     window_end,
+                                                                     interval,
+                                                                     semaphore,
+                                                                     max_parallel)
+                                             for window_start, window_end in windows])
+        if None in results:
+            logging.error('Problem reading datastream history. %s of %s windows failed' % (results.count(None),
+                                                                                           len(windows)))
+            defer.returnValue(None)
+
+        # Windows share their boundary timestamps so a datapoint on a
+        # boundary can be returned twice. Datapoints are keyed and ordered
+        # by their time since the epoch as the at strings of the same
+        # instant may differ in precision or UTC offset.
+        # The pages may be shared with the response cache or with other
+        # callers, so the history is returned in a new datastream holding
+        # copies of the fields of the first page.
+        first = None
+        datapoints = dict()
+        for window in results:
+            for page in window:
+                if first is None:
+                    first = page
+                for datapoint in page.datapoints:
+                    datapoints[datapoint.at_seconds] = datapoint
+        datastream = txcosm.Datastream(id=datastream_id)
+        if first is not None:
+            for field in txcosm.Datastream._schema:
+                if field.name != txcosm.DataFields.Datapoints:
+                    setattr(datastream, field.name, copy.deepcopy(getattr(first, field.name)))
+        datastream.datapoints = [datapoints[at] for at in sorted(datapoints)]
+        defer.returnValue(datastream)
+
+    @defer.inlineCallbacks
+    def _readHistoryWindow(self, api_key, feed_id, datastream_id, start, end,
+                           interval, semaphore, read_ahead=1):
+        """
+        Read the pages of datastream history for a time window. The first
+        page is read alone. While the pages read are full the next
+        read_ahead pages are requested together. Pages following the first
+        page that is not full are discarded.
+
+        @return: A deferred that returns a list of txcosm.Datastream objects,
+          one for each page, or None if a page could not be read.
+        @rtype: twisted.internet.defer.Deferred
+        """
+        pages = []
+        page = 1
+        count = 1
+        while True:
+            requests = []
+            for number in range(page, page + count):
+                parameters = {'start': start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                              'end': end.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                              'interval': interval,
+                              'per_page': self.max_history_per_page,
+                              'page': number}
+                requests.append(semaphore.run(self.read_datastream,
+                                              api_key=api_key,
+                                              feed_id=feed_id,
+                                              datastream_id=datastream_id,
+                                              parameters=parameters,
+                                              priority=Priority.Bulk))
+            results = yield defer.gatherResults(requests)
+            for datastream in results:
+                if datastream is None:
+                    defer.returnValue(None)
+                pages.append(datastream)
+                if len(datastream.datapoints) < self.max_history_per_page:
+                    defer.returnValue(pages)
+            page += count
+            count = max(1, read_ahead)
+
     @defer.inlineCallbacks
     def update_datastream(self, api_key=None, feed_id=None, datastream_id=None,
                           format=txcosm.DataFormats.JSON, data=None):
@@ -1060,7 +1953,8 @@ class HTTPClient(object):
 
     @defer.inlineCallbacks
     def create_datapoints(self, api_key=None, feed_id=None, datastream_id=None,
-                          format=txcosm.DataFormats.JSON, data=None):
+                          format=txcosm.DataFormats.JSON, data=None,
+                          priority=None):
         """
         Creates new datapoints for datastream. The body of the request
         should contain a JSON, XML or CSV representation of the datastream to
@@ -1093,6 +1987,9 @@ class HTTPClient(object):
         @param data: A representation of the datastream in the appropriate
           format.
         @type data: string
+        @param priority: The priority class of the request. If not set the
+          client's default priority is used.
+        @type priority: int
 
         @return: A deferred that returns the success status of the create
           action.
@@ -1115,7 +2012,8 @@ class HTTPClient(object):
 
         headers = {'X-ApiKey': api_key}
 
-        result = yield self._post(url, headers, data)
+        result = yield self._post(url, headers, data, priority=priority,
+                                  compress=self.compress_requests)
         if result:
             response, responseBody = result
             defer.returnValue(self._getResponseCodeStatusFromHeader(response))
@@ -1123,6 +2021,159 @@ class HTTPClient(object):
             logging.error('Problem creating datapoints. Request failed')
             defer.returnValue(None)
 
+    @defer.inlineCallbacks
+    def upload_datapoints(self, api_key=None, feed_id=None, datastream_id=None,
+                          datapoints=None, batch_size=None, max_parallel=4,
+                          retries=2, format=txcosm.DataFormats.JSON):
+        """
+        Upload any number of datapoints to a datastream.
+
+        Cosm rejects a create_datapoints request holding more than 500
+        datapoints so the datapoints are split into batches that are
+        uploaded using create_datapoints at bulk priority, with no more
+        than max_parallel batches in flight at once. A batch is only taken
+        from the datapoints when an upload slot becomes free, so a
+        generator of datapoints is never read far ahead. Once every batch has
+        been tried the batches that failed are retried, up to the number of
+        times specified by retries.
+
+        @param api_key: An api key with authorization settings allowing this
+          action to be performed
+        @type api_key: string
+        @param feed_id: The feed identifier
+        @type feed_id: string
+        @param datastream_id: A datastream identifier
+        @type datastream_id: string
+        @param datapoints: The datapoints to upload as txcosm.Datapoint
+          objects or (timestamp, value) tuples.
+        @type datapoints: iterable
+        @param batch_size: The maximum number of datapoints in a batch. If
+          not set the Cosm limit of 500 is used.
+        @type batch_size: int
+        @param max_parallel: The maximum number of batches in flight at once.
+        @type max_parallel: int
+        @param retries: The number of times failed batches are retried.
+        @type retries: int
+        @param format: The format the batches are uploaded in [json|csv].
+          CSV bodies are about half the size of JSON bodies.
+        @type format: string
+
+        @return: A deferred that returns a list holding a summary dict for
+          each batch. Each summary holds the batch index, the number of
+          datapoints, the timestamps of the first and last datapoints, the
+          number of attempts made and whether the upload succeeded.
+        @rtype: list
+
+        If api_key or feed_id arguments are not set when calling this method
+        then the values set during this object's instantiation
+        (ie. in __init__) are used.
+        """
+        if batch_size is None:
+            batch_size = self.max_datapoints_per_request
+        if format not in [txcosm.DataFormats.JSON, txcosm.DataFormats.CSV]:
+            raise Exception("Don't know how to upload datapoints using format %s" % format)
+        if batch_size > self.max_datapoints_per_request:
+            raise Exception("Batch size %s exceeds the Cosm limit of %s datapoints" % (batch_size,
+                                                                                     self.max_datapoints_per_request))
+
+        # Batches are taken from the datapoints as upload slots become
+        # free, so only the batches in flight and those that failed and
+        # are waiting to be retried are held at once.
+        summary = []
+        failed = dict()
+        work = enumerate(self._batchDatapoints(datapoints, batch_size))
+        for attempt in range(1 + retries):
+            if attempt:
+                if not failed:
+                    break
+                logging.warning("Retrying %s of %s datapoint batches" % (len(failed), len(summary)))
+                work = iter(sorted(failed.items()))
+                failed = dict()
+            yield defer.gatherResults([self._uploadBatches(api_key,
+                                                           feed_id,
+                                                           datastream_id,
+                                                           work,
+                                                           summary,
+                                                           failed,
+                                                           format)
+                                       for _ in range(max_parallel)])
+
+        if failed:
+            logging.error("Problem uploading datapoints. %s of %s batches failed" % (len(failed), len(summary)))
+        defer.returnValue(summary)
+
+    def _batchDatapoints(self, datapoints, batch_size):
+        """
+        Generate the batches of an iterable of datapoints, converting any
+        (timestamp, value) tuples to txcosm.Datapoint objects.
+        """
+        source = iter(datapoints or [])
+        while True:
+            batch = list(itertools.islice(source, batch_size))
+            if not batch:
+                return
+            for position, datapoint in enumerate(batch):
+                if not isinstance(datapoint, txcosm.Datapoint):
+                    at_time, value = datapoint
+                    batch[position] = txcosm.Datapoint(at=at_time, value=value)
+            yield batch
+
+    @defer.inlineCallbacks
+    def _uploadBatches(self, api_key, feed_id, datastream_id, work, summary,
+                       failed, format):
+        """
+        Upload batches, one at a time, until the work shared with the other
+        upload slots is exhausted. A summary is added for each new batch
+        and the batches that fail are recorded in failed.
+
+        @param work: The (index, batch) pairs still to be uploaded
+        @type work: iterator
+        """
+        for index, batch in work:
+            if index == len(summary):
+                summary.append({'batch': index,
+                                'datapoints': len(batch),
+                                'first': batch[0].at,
+                                'last': batch[-1].at,
+                                'attempts': 0,
+                                'success': False})
+            success = yield self._uploadBatch(api_key, feed_id, datastream_id,
+                                              batch, summary[index], format)
+            if not success:
+                failed[index] = batch
+
+    def _uploadBatch(self, api_key, feed_id, datastream_id, batch, summary,
+                     format=txcosm.DataFormats.JSON):
+        """
+        Upload a batch of datapoints, recording the outcome in the batch summary
+
+        @return: A deferred that returns the success status of the upload
+        @rtype: twisted.internet.defer.Deferred
+        """
+        summary['attempts'] += 1
+        if format == txcosm.DataFormats.CSV:
+            data = txcosm.datapointsToCsv(batch)
+        else:
+            data = txcosm.datapointsToJson(batch)
+        d = self.create_datapoints(api_key=api_key,
+                                   feed_id=feed_id,
+                                   datastream_id=datastream_id,
+                                   format=format,
+                                   data=data,
+                                   priority=Priority.Bulk)
+
+        def recordResult(success):
+            summary['success'] = bool(success)
+            return summary['success']
+
+        def recordFailure(failure):
+            logging.error("Problem uploading datapoint batch %s: %s" % (summary['batch'],
+                                                                        failure.getErrorMessage()))
+            return False
+
+        d.addCallbacks(recordResult, recordFailure)
+        return d
+
     @defer.inlineCallbacks
     def read_datapoint(self, api_key=None, feed_id=None, datastream_id=None,
                        format=txcosm.DataFormats.JSON, timestamp=None):
@@ -0,0 +1,88 @@
+
+'''
+This module implements a consistent hash ring. It is used to assign
+resources to one of several connections so that, when a connection is
+added or removed, only the resources assigned to that connection move.
+
+Each node is placed on the ring at a number of points, its replicas, to
+spread the keys evenly between the nodes. A key is assigned to the node
+owning the first point at or after the hash of the key.
+'''
+
+import bisect
+import hashlib
+
+
+class HashRing(object):
+    """
+    A consistent hash ring of nodes
+    """
+
+    def __init__(self, nodes=None, replicas=64):
+        """
+        @param nodes: The nodes initially on the ring
+        @type nodes: list
+        @param replicas: The number of points each node has on the ring
+        @type replicas: int
+        """
+        self.replicas = replicas
+        self.points = []  # sorted hashes of the points on the ring
+        self.owners = []  # the node owning each point
+        self.nodes = set()
+        for node in nodes or []:
+            self.add(node)
+
+    def _hash(self, key):
+        """
+        Return the position of a key on the ring
+        """
+        return int(hashlib.md5(str(key)).hexdigest()[:16], 16)
+
+    def add(self, node):
+        """
+        Add a node to the ring. Adding a node already on the ring has no effect.
+
+        @param node: The node to add
+        """
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = self._hash("%s-%s" % (node, replica))
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node):
+        """
+        Remove a node from the ring. Removing a node not on the ring has no effect.
+
+        @param node: The node to remove
+        """
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, owner in kept]
+        self.owners = [owner for point, owner in kept]
+
+    def get(self, key):
+        """
+        Return the node a key is assigned to
+
+        @param key: The key to look up
+
+        @return: The node owning the key, or None if the ring is empty
+        """
+        if not self.points:
+            return None
+        index = bisect.bisect_left(self.points, self._hash(key))
+        if index == len(self.points):
+            index = 0
+        return self.owners[index]
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
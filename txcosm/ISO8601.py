@@ -0,0 +1,206 @@
+
+'''
+This module implements a fast codec for the ISO8601 timestamps used by
+Cosm, eg. 2010-07-02T10:21:57.101496Z.
+
+Timestamps are parsed to seconds since the epoch without using strptime.
+The date and time up to the whole second is the expensive part of a
+timestamp to parse and, in a datastream history, many timestamps share
+it, so the conversions of whole second prefixes are cached. When
+formatting, the prefix of the last whole second formatted is reused.
+'''
+
+import time
+
+
+# The maximum number of prefixes held by the parse cache. The cache is
+# cleared when it becomes full which is cheaper than maintaining an LRU
+# order.
+Max_Cached_Prefixes = 4096
+
+_parseCache = dict()
+
+# The last whole second formatted, and its prefix, as consecutive
+# timestamps usually share it.
+_lastFormatted = [None, None]
+
+# The number of days before the start of each month in a non leap year
+_daysBeforeMonth = [0, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334]
+
+# The number of days in each month in a non leap year
+_daysInMonth = [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+def _isLeapYear(year):
+    """
+    Return True if a year is a leap year
+    """
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def _daysSinceEpoch(year, month, day):
+    """
+    Return the number of days from 1970-01-01 to a date
+    """
+    days = _daysBeforeMonth[month] + day - 1
+    if month > 2 and _isLeapYear(year):
+        days += 1
+    y = year - 1
+    days += 365 * y + y // 4 - y // 100 + y // 400
+    return days - 719162  # days from 0001-01-01 to 1970-01-01
+
+
+def _parsePrefix(prefix):
+    """
+    Return the whole seconds since the epoch of a YYYY-MM-DDTHH:MM:SS prefix
+    """
+    seconds = _parseCache.get(prefix)
+    if seconds is None:
+        if (len(prefix) != 19 or prefix[4] != '-' or prefix[7] != '-' or
+                prefix[10] not in 'T ' or prefix[13] != ':' or prefix[16] != ':'):
+            raise ValueError("Invalid ISO8601 timestamp \'%s\'" % prefix)
+        year = int(prefix[0:4])
+        month = int(prefix[5:7])
+        day = int(prefix[8:10])
+        hour = int(prefix[11:13])
+        minute = int(prefix[14:16])
+        second = int(prefix[17:19])
+        # the same ranges are enforced as by datetime, which rejects leap
+        # seconds.
+        if not 1 <= month <= 12:
+            raise ValueError("Invalid ISO8601 timestamp \'%s\'" % prefix)
+        days = _daysInMonth[month]
+        if month == 2 and _isLeapYear(year):
+            days += 1
+        if (year < 1 or not 1 <= day <= days or hour > 23 or minute > 59 or second > 59 or
+                min(hour, minute, second) < 0):
+            raise ValueError("Invalid ISO8601 timestamp \'%s\'" % prefix)
+        seconds = _daysSinceEpoch(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+        if len(_parseCache) >= Max_Cached_Prefixes:
+            _parseCache.clear()
+        _parseCache[prefix] = seconds
+    return seconds
+
+
+def _parseSuffix(timestamp):
+    """
+    Return the fraction of a second and the UTC offset, in seconds, from
+    the part of a timestamp following the whole seconds.
+    """
+    fraction = 0.0
+    index = 19
+    length = len(timestamp)
+    if index < length and timestamp[index] in '.,':
+        end = index + 1
+        while end < length and timestamp[end].isdigit():
+            end += 1
+        if end > index + 1:
+            fraction = float('0.' + timestamp[index + 1:end])
+        index = end
+
+    offset = 0
+    zone = timestamp[index:]
+    if zone and zone != 'Z':
+        if zone[0] not in '+-' or len(zone) not in (3, 5, 6):
+            raise ValueError("Invalid ISO8601 timestamp \'%s\'" % timestamp)
+        digits = zone[1:].replace(':', '')
+        offset = int(digits[0:2]) * 3600 + int(digits[2:4] or 0) * 60
+        if zone[0] == '-':
+            offset = -offset
+    return fraction, offset
+
+
+def parseTimestamp(timestamp):
+    """
+    Return an ISO8601 timestamp as seconds since the epoch. Timestamps
+    without a UTC offset are taken to be UTC.
+
+    @param timestamp: The timestamp, eg. 2010-07-02T10:21:57.101496Z
+    @type timestamp: string
+
+    @return: The seconds since the epoch
+    @rtype: float
+    """
+    seconds = _parsePrefix(timestamp[:19])
+    if len(timestamp) == 20 and timestamp[19] == 'Z':
+        return float(seconds)
+    fraction, offset = _parseSuffix(timestamp)
+    return seconds - offset + fraction
+
+
+def parseTimestampSeconds(timestamp):
+    """
+    Return an ISO8601 timestamp as whole seconds since the epoch, ignoring
+    any fraction of a second.
+
+    @param timestamp: The timestamp, eg. 2010-07-02T10:21:57.101496Z
+    @type timestamp: string
+
+    @return: The whole seconds since the epoch
+    @rtype: int
+    """
+    seconds = _parsePrefix(timestamp[:19])
+    if len(timestamp) == 20 and timestamp[19] == 'Z':
+        return seconds
+    fraction, offset = _parseSuffix(timestamp)
+    return seconds - offset
+
+
+def formatTimestamp(seconds=None):
+    """
+    Return seconds since the epoch as an ISO8601 UTC timestamp with
+    microsecond resolution.
+
+    @param seconds: The seconds since the epoch. If not set the current
+                    time is used.
+    @type seconds: float
+
+    @return: The timestamp, eg. 2010-07-02T10:21:57.101496Z
+    @rtype: string
+    """
+    if seconds is None:
+        seconds = time.time()
+    return _formatMicroseconds(int(round(seconds * 1000000)))
+
+
+def _formatMicroseconds(microseconds):
+    """
+    Return microseconds since the epoch as an ISO8601 UTC timestamp
+    """
+    whole, micro = divmod(microseconds, 1000000)
+    if whole != _lastFormatted[0]:
+        _lastFormatted[:] = [whole, time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(whole))]
+    return "%s.%06dZ" % (_lastFormatted[1], micro)
+
+
+def formatTimestamps(seconds):
+    """
+    Return a list of ISO8601 UTC timestamps for a sequence of seconds
+    since the epoch.
+
+    @param seconds: The seconds since the epoch
+    @type seconds: sequence of float
+
+    @return: The timestamps
+    @rtype: list
+    """
+    return [formatTimestamp(s) for s in seconds]
+
+
+def now(count=1):
+    """
+    Return timestamps for the current time. When more than one timestamp
+    is requested the clock is read once and the timestamps are spaced one
+    microsecond apart so that each is unique, as Cosm requires of the
+    datapoints in a datastream.
+
+    @param count: The number of timestamps to generate
+    @type count: int
+
+    @return: A timestamp, or a list of timestamps if count is not 1
+    @rtype: string or list
+    """
+    microseconds = int(round(time.time() * 1000000))
+    if count == 1:
+        return _formatMicroseconds(microseconds)
+    return [_formatMicroseconds(microseconds + i) for i in xrange(count)]
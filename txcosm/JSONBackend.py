@@ -0,0 +1,147 @@
+
+'''
+This module selects the JSON library used to encode and decode Cosm
+messages.
+
+The fastest available library is chosen when the module is imported.
+Every library is used so that it produces the same compact JSON as the
+standard library json module, and is only chosen if it encodes and
+decodes a probe document exactly as the json module does. A library can
+be chosen explicitly by setting the TXCOSM_JSON_BACKEND environment
+variable or by calling setBackend.
+
+The encode and decode functions of the chosen library are exposed as
+the dumps and loads functions of this module.
+'''
+
+import json
+import logging
+import os
+
+
+# The supported backends in order of preference
+UJSON = 'ujson'
+SIMPLEJSON = 'simplejson'
+STDLIB = 'json'
+Backends = [UJSON, SIMPLEJSON, STDLIB]
+
+# The environment variable that overrides the automatic choice
+Backend_Environment_Variable = 'TXCOSM_JSON_BACKEND'
+
+# The name of the chosen backend, and its encode and decode functions,
+# which are set by setBackend
+backend = None
+dumps = None
+loads = None
+
+# Separators that produce compact JSON. They avoid sending the spaces
+# the json module inserts by default and are the only separators ujson
+# supports.
+_separators = (',', ':')
+
+# A document holding the kinds of value found in Cosm messages
+_probe = {u"id": 1234,
+          u"title": u"Probe \u00e9 \"quoted\" \\ </tag>\n",
+          u"feed": u"http://api.cosm.com/v2/feeds/1234.json",
+          u"private": False,
+          u"location": {u"lat": 51.5218921, u"lon": -0.1, u"ele": None},
+          u"tags": [u"a", u"b"],
+          u"datastreams": [{u"id": u"0", u"current_value": u"23.5", u"max_value": 40.0}]}
+
+
+def _stdlibCodec():
+    """
+    Return the encode and decode functions of the json module
+    """
+    encoder = json.JSONEncoder(separators=_separators)
+    return encoder.encode, json.loads
+
+
+def _simplejsonCodec():
+    """
+    Return the encode and decode functions of simplejson. The pure Python
+    implementation is slower than the json module so it is only used if
+    its C speedups are available.
+    """
+    import simplejson
+    from simplejson import _speedups
+    encoder = simplejson.JSONEncoder(separators=_separators)
+    return encoder.encode, simplejson.loads
+
+
+def _ujsonCodec():
+    """
+    Return the encode and decode functions of ujson
+    """
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False)
+    return dumps, ujson.loads
+
+
+_codecs = {UJSON: _ujsonCodec,
+           SIMPLEJSON: _simplejsonCodec,
+           STDLIB: _stdlibCodec}
+
+
+def _loadCodec(name):
+    """
+    Return the encode and decode functions of a backend, or None if the
+    backend is not installed or does not match the json module.
+    """
+    try:
+        encode, decode = _codecs[name]()
+        if name != STDLIB:
+            expected = _stdlibCodec()[0](_probe)
+            if encode(_probe) != expected or decode(expected) != _probe:
+                logging.warning("JSON backend %s does not match the json module" % name)
+                return None
+    except Exception:
+        return None
+    return encode, decode
+
+
+def availableBackends():
+    """
+    Return the backends that are installed and match the json module
+
+    @return: The backend names in order of preference
+    @rtype: list
+    """
+    return [name for name in Backends if _loadCodec(name) is not None]
+
+
+def setBackend(name=None):
+    """
+    Choose the JSON backend
+
+    @param name: The backend to use (one of Backends). If not set the
+                 fastest available backend is used.
+    @type name: string
+
+    @return: The name of the chosen backend
+    @rtype: string
+    """
+    global backend, dumps, loads
+    if name is None:
+        names = Backends
+    elif name in Backends:
+        names = [name]
+    else:
+        raise Exception("Invalid JSON backend \'%s\' not in %s" % (name, Backends))
+
+    for candidate in names:
+        codec = _loadCodec(candidate)
+        if codec is not None:
+            dumps, loads = codec
+            backend = candidate
+            return backend
+    raise Exception("JSON backend \'%s\' is not available" % name)
+
+
+try:
+    setBackend(os.environ.get(Backend_Environment_Variable) or None)
+except Exception, ex:
+    logging.error("%s, using the fastest available JSON backend" % ex)
+    setBackend()
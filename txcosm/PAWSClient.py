@@ -5,23 +5,45 @@ This provides a capability communication with the Cosm API over a
 persistent TCP connection.
 '''
 
+import collections
 import json
 import logging
 import txcosm
+from txcosm import JSONBackend
 import uuid
 from twisted.internet import reactor, defer
+from twisted.python import failure
+from twisted.internet.error import ConnectionLost
 from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+from txcosm.HashRing import HashRing
+from txcosm.TimerWheel import getSharedTimerWheel
 
 
 class PAWSProtocol(Protocol):
     """
     A instance of this protocol communications with the Cosm PAWS service
+
+    Messages are delimited by newlines. The parts of a message received so
+    far are held in a list and only newly received data is scanned for the
+    delimiter, so framing takes time linear in the data received however
+    the messages are split into segments.
     """
 
     delimiter = '\n'
 
-    def __init__(self):
-        self.buffer = ""
+    # The default maximum size of a message. Larger messages are discarded.
+    max_message_size = 16 * 1024 * 1024
+
+    def __init__(self, max_message_size=None):
+        """
+        @param max_message_size: The maximum size, in bytes, of a message
+        @type max_message_size: int
+        """
+        if max_message_size is not None:
+            self.max_message_size = max_message_size
+        self.buffer = []     # the parts of the message being received
+        self.buffered = 0    # the number of bytes held in the buffer
+        self.discarding = False  # True while skipping an oversized message
 
     def connectionMade(self):
         # register this protocol with the factory so it can be
@@ -39,14 +61,50 @@ class PAWSProtocol(Protocol):
         message delimiter is encountered then pass any messages
         back to the client through the factory's messageHandler.
         """
-        self.buffer += data
-        if PAWSProtocol.delimiter in self.buffer:
-            msgs = self.buffer.split(PAWSProtocol.delimiter)
-            for msg in msgs[:-1]:
-                self.factory.messageHandler(msg)
-            self.buffer = msgs[-1]
+        delimiter = self.delimiter
+        start = 0
+        end = data.find(delimiter)
+        while end != -1:
+            if self.discarding:
+                # the end of an oversized message
+                self.discarding = False
+            elif self.buffer:
+                self.buffer.append(data[start:end])
+                msg = "".join(self.buffer)
+                self.buffer = []
+                self.buffered = 0
+                self._deliver(msg)
+            else:
+                self._deliver(data[start:end])
+            start = end + 1
+            end = data.find(delimiter, start)
+
+        if start < len(data) and not self.discarding:
+            self.buffered += len(data) - start
+            if self.buffered > self.max_message_size:
+                self._discard()
+            else:
+                self.buffer.append(data[start:])
+
+    def _deliver(self, msg):
+        """
+        Pass a complete message to the client unless it is too large
+        """
+        if len(msg) > self.max_message_size:
+            logging.error("Discarded PAWS message of %s bytes, the maximum is %s" % (len(msg),
+                                                                                   self.max_message_size))
         else:
-            logging.debug("No message delimiter found yet.")
+            self.factory.messageReceived(msg)
+
+    def _discard(self):
+        """
+        Discard the message being received, and the rest of it as it
+        arrives, as it exceeds the maximum message size
+        """
+        logging.error("Discarding PAWS message exceeding the maximum of %s bytes" % self.max_message_size)
+        self.buffer = []
+        self.buffered = 0
+        self.discarding = True
 
     def send(self, data):
         """
@@ -66,10 +124,14 @@ class PAWSProtocolFactory(ReconnectingClientFactory):
     port = 8081
     host = 'api.cosm.com'
 
-    def __init__(self, messageHandler):
+    def __init__(self, messageHandler, max_message_size=None, stateHandler=None):
         self.connection = None
         self.connected = False
         self.messageHandler = messageHandler
+        self.max_message_size = max_message_size
+        # called with the connection state whenever it changes
+        self.stateHandler = stateHandler
+        self.resetStats()
 
         # These attributes are used during the connect/disconnect sequence
         # to inform caller that the sequence has completed and to provide
@@ -83,6 +145,11 @@ class PAWSProtocolFactory(ReconnectingClientFactory):
         waiting on notification of requested connect/disconnect actions.
         """
         self.connected = state
+        if not state:
+            self.connection = None
+
+        if self.stateHandler:
+            self.stateHandler(state)
 
         # call any pending connection state notifiers
         if self._connectDeferred:
@@ -96,6 +163,15 @@ class PAWSProtocolFactory(ReconnectingClientFactory):
             self._disconnectDeferred.callback(disconnectedState)
             self._disconnectDeferred = None
 
+    def resetStats(self):
+        """
+        Reset the counts of the messages, and bytes, sent and received
+        """
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.messages_received = 0
+        self.bytes_received = 0
+
     def connect(self):
         """
         Establish a connection to the Cosm PAWS service if there
@@ -156,7 +232,7 @@ class PAWSProtocolFactory(ReconnectingClientFactory):
         self.continueTrying = True
         # initialise reconnection attempt delay
         self.resetDelay()
-        p = PAWSProtocol()
+        p = PAWSProtocol(self.max_message_size)
         p.factory = self
         return p
 
@@ -170,14 +246,94 @@ class PAWSProtocolFactory(ReconnectingClientFactory):
         self._connectionStateHandler(False)
         ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
 
+    def messageReceived(self, msg):
+        """
+        Called from the protocol with each message received from the PAWS
+        service. The message is counted then passed to the messageHandler.
+        """
+        self.messages_received += 1
+        self.bytes_received += len(msg)
+        self.messageHandler(msg)
+
     def send(self, data):
         """
         Send a string of data to the PAWS service through the single connection.
         This is a convenience wrapper around the protocol.
         """
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
         self.connection.send(data)
 
 
+class Subscription(object):
+    """
+    A subscription to a resource shared by any number of local handlers.
+
+    A single subscription is made to the PAWS service for each resource.
+    Each update it delivers is decoded once and the data structure is
+    passed to every handler, so handlers must not modify it.
+    """
+
+    def __init__(self, resource, token, dataStructureClass):
+        """
+        @param resource: The resource subscribed to
+        @type resource: string
+        @param token: The token of the subscription to the PAWS service
+        @type token: string
+        @param dataStructureClass: The txcosm data structure class used to
+                                   decode the updates
+        """
+        self.resource = resource
+        self.token = token
+        self.dataStructureClass = dataStructureClass
+        # the handlers, keyed by the token returned to each subscriber
+        self.handlers = collections.OrderedDict()
+        # the state of the subscribe request, None until its response arrives
+        self.status = None
+        self.updates = 0
+        self._waiting = []
+
+    def whenSubscribed(self):
+        """
+        @return: A deferred that fires with the state of the subscribe
+                 request once its response has arrived.
+        @rtype: defer.Deferred
+        """
+        if self.status is not None:
+            return defer.succeed(self.status)
+        d = defer.Deferred()
+        self._waiting.append(d)
+        return d
+
+    def subscribed(self, result):
+        """
+        Record the outcome of the subscribe request and pass it on to the
+        subscribers waiting for it.
+
+        @param result: The state of the subscribe request or a Failure
+        """
+        waiting, self._waiting = self._waiting, []
+        if not isinstance(result, failure.Failure):
+            self.status = result
+        for d in waiting:
+            d.callback(result)
+
+    def dispatch(self, body):
+        """
+        Decode an update and pass it to every handler
+
+        @param body: The body of the update message
+        @type body: dict
+        """
+        self.updates += 1
+        dataStructure = self.dataStructureClass(**body)
+        for handler in self.handlers.values():
+            try:
+                handler(dataStructure)
+            except Exception, ex:
+                logging.exception("Subscription handler for %s failed: %s" % (self.resource, ex))
+
+
 class PAWSClient(object):
     """
     A Cosm Advanced Web-scale Socket-server (PAWS) client.
@@ -189,30 +345,70 @@ class PAWSClient(object):
     notifications of updates when they occur.
     """
 
-    def __init__(self, api_key=None, feed_id=None):
+    def __init__(self, api_key=None, feed_id=None, max_message_size=None,
+                 request_timeout=10.0, resubscribe=True, catch_up=False):
         """
         @param api_key: The api key, with appropriate authorization privileges to use.
         @type api_key: string
         @param feed_id: The default feed identifier to use
         @type feed_id: string
+        @param max_message_size: The maximum size, in bytes, of a message
+                                 received from the PAWS service. Larger
+                                 messages are discarded. If not set
+                                 PAWSProtocol.max_message_size is used.
+        @type max_message_size: int
+        @param request_timeout: The number of seconds to wait for the
+                                response to a request before failing it.
+        @type request_timeout: float
+        @param resubscribe: Replay the subscriptions when the connection
+                            is re-established after being lost.
+        @type resubscribe: boolean
+        @param catch_up: Read each resubscribed resource and pass its state
+                         to the subscription handlers, so they see any
+                         change made while the connection was lost.
+        @type catch_up: boolean
         """
         self.api_key = api_key
         self.feed_id = feed_id
 
         # Store the response callback processing chains associated with each request.
         # Responses can be associated to the originating requests through the token.
-        # the token forms the key in this dict.
+        # the token forms the key in this dict. Each value is a list of
+        # [response deferred, timer handle, time sent, connection factory].
         self.pendingResponses = dict()
 
+        # Request timeouts are managed by a timer wheel rather than a
+        # reactor delayed call per request.
+        self.request_timeout = request_timeout
+        self.timers = getSharedTimerWheel()
+
         # Subscriptions use the same token approach to map the message data to the
-        # originating request. The values of each dict item is a tuple of the
-        # callback handler function to pass the response data to and a txcosm
-        # data structure class that is used to decode the data upon its receipt.
+        # originating request. The values of each dict item is the Subscription
+        # that decodes the message data and passes it to its handlers.
         self.subscriptionHandlers = dict()
 
+        # The Subscription to each resource, shared by all of its subscribers.
+        self.subscriptions = dict()
+
+        # Subscriptions are replayed when a lost connection is re-established
+        self.resubscribe = resubscribe
+        self.catch_up = catch_up
+        self.disconnected_at = None
+        self.reconnect_stats = {'reconnects': 0,
+                                'last_gap': 0.0,
+                                'longest_gap': 0.0,
+                                'resubscribed': 0}
+
         self.headers = {'X-ApiKey': self.api_key}
 
-        self.factory = PAWSProtocolFactory(self._messageHandler)
+        self._makeFactories(max_message_size)
+
+    def _makeFactories(self, max_message_size):
+        """
+        Create the factory of the connection to the PAWS service
+        """
+        self.factory = PAWSProtocolFactory(self._messageHandler, max_message_size,
+                                           self._connectionStateHandler)
 
     def connect(self):
         """
@@ -244,6 +440,152 @@ class PAWSClient(object):
         """
         return self.factory.connected
 
+    @property
+    def pending_stats(self):
+        """
+        Return the number of requests waiting for a response and the age,
+        in seconds, of the oldest and the average age.
+
+        @rtype: dict
+        """
+        now = self.timers.clock.seconds()
+        ages = [now - sent for response_d, timer, sent, factory in self.pendingResponses.itervalues()]
+        return {'pending_requests': len(ages),
+                'oldest_age': max(ages) if ages else 0.0,
+                'average_age': sum(ages) / len(ages) if ages else 0.0}
+
+    def _connectionStateHandler(self, connected):
+        """
+        Fail every request waiting for a response when the connection is
+        lost, as their responses will never arrive, and replay the
+        subscriptions when the connection is re-established.
+        """
+        now = self.timers.clock.seconds()
+        if not connected:
+            self._failPendingResponses(self.factory)
+            if self.disconnected_at is None:
+                self.disconnected_at = now
+
+        elif self.disconnected_at is not None:
+            gap = now - self.disconnected_at
+            self.disconnected_at = None
+            self._recordReconnect(gap)
+            logging.warning("PAWS connection re-established after a gap of %.1f seconds" % gap)
+            if self.resubscribe:
+                self._resubscribe()
+
+    def _recordReconnect(self, gap):
+        """
+        Record the length of the gap before a connection was re-established
+
+        @param gap: The number of seconds the connection was lost for
+        @type gap: float
+        """
+        stats = self.reconnect_stats
+        stats['reconnects'] += 1
+        stats['last_gap'] = gap
+        stats['longest_gap'] = max(gap, stats['longest_gap'])
+
+    def _resubscribe(self):
+        """
+        Replay every established subscription on a new connection.
+
+        The subscribe requests, each followed by the catch-up read of its
+        resource if enabled, are sent back to back without waiting for
+        their responses so the transport writes them in one burst. The
+        read follows the subscribe so no update can fall between them.
+
+        @return: A deferred that fires when every subscription has been
+                 replayed.
+        @rtype: defer.Deferred
+        """
+        subscriptions = [s for s in self.subscriptions.values() if s.status is not None]
+        if subscriptions:
+            logging.info("Resubscribing to %s resources" % len(subscriptions))
+        return defer.DeferredList([self._replaySubscription(s) for s in subscriptions])
+
+    def _replaySubscription(self, subscription):
+        """
+        Replay a subscription, and read its resource if catch_up is enabled
+
+        @return: A deferred that fires with the state of the subscription
+        @rtype: defer.Deferred
+        """
+        # subscribers and unsubscribers wait until the subscribe request,
+        # which uses the subscription token, has been answered.
+        subscription.status = None
+
+        def subscribed(response):
+            self.reconnect_stats['resubscribed'] += 1
+            return self._getResponseCodeStatusFromHeader(response[1])
+
+        def failed(failure):
+            logging.error("Failed to resubscribe to %s: %s" % (subscription.resource, failure.getErrorMessage()))
+            return False
+
+        d = self._subscribe(subscription.resource, subscription.token)
+        d.addCallbacks(subscribed, failed)
+        d.addCallback(self._subscriptionReplayed, subscription)
+
+        if self.catch_up:
+            self._catchUp(subscription)
+        return d
+
+    def _catchUp(self, subscription):
+        """
+        Read the resource of a subscription and pass its state to the
+        handlers of the subscription
+
+        @return: A deferred that fires when the state has been passed on
+        @rtype: defer.Deferred
+        """
+        def readFailed(failure):
+            logging.error("Failed to catch up with %s: %s" % (subscription.resource, failure.getErrorMessage()))
+
+        d = self._get(subscription.resource)
+        d.addCallback(self._caughtUp, subscription)
+        d.addErrback(readFailed)
+        return d
+
+    def _subscriptionReplayed(self, status, subscription):
+        """
+        Record the outcome of a replayed subscription
+        """
+        subscription.subscribed(status)
+        return status
+
+    def _caughtUp(self, response, subscription):
+        """
+        Pass the state of a resource read after a reconnect to the handlers
+        of its subscription
+        """
+        if self._getResponseCodeStatusFromHeader(response) and subscription.handlers:
+            subscription.dispatch(self._getResponseBody(response))
+
+    def _failPendingResponses(self, factory):
+        """
+        Fail the requests waiting for a response that were sent through
+        a connection factory whose connection has been lost.
+
+        @param factory: The factory whose connection was lost
+        @type factory: PAWSProtocolFactory
+        """
+        lost = [token for token, pending in self.pendingResponses.iteritems() if pending[3] is factory]
+        if lost:
+            logging.error("PAWS connection lost with %s requests pending" % len(lost))
+            for token in lost:
+                response_d, timer, sent, factory = self.pendingResponses.pop(token)
+                self.timers.cancel(timer)
+                response_d.errback(ConnectionLost("PAWS connection lost before a response was received"))
+
+    def _handleRequestTimeout(self, token, resource):
+        """
+        Fail a request that has not received a response in time
+        """
+        logging.error("PAWS request timeout: %s" % resource)
+        response_d, timer, sent, factory = self.pendingResponses.pop(token)
+        response_d.errback(defer.TimeoutError("No response to PAWS request for %s" % resource))
+
     def _messageHandler(self, msg):
         """
         Receive a message from the PAWS service. Use the token found in the response
@@ -251,18 +593,17 @@ class PAWSClient(object):
         chain can process the message and return it to the caller.
         """
         logging.debug("PAWSClient has received a message:\n%s\n" % msg)
-        data = json.loads(msg)
+        data = JSONBackend.loads(msg)
         token = data['token']
 
         if token in self.pendingResponses:
-            self.pendingResponses[token].callback(data)
-            del self.pendingResponses[token]
+            response_d, timer, sent, factory = self.pendingResponses.pop(token)
+            self.timers.cancel(timer)
+            response_d.callback(data)
 
         elif token in self.subscriptionHandlers:
             body = self._getResponseBody(data)
-            handler, dataStructureClass = self.subscriptionHandlers[token]
-            dataStructure = dataStructureClass(**body)
-            handler(dataStructure)
+            self.subscriptionHandlers[token].dispatch(body)
 
         else:
             logging.error("Unrecognised message with token %s not in pendingResponses or subscriptionHandlers" % token)
@@ -270,6 +611,19 @@ class PAWSClient(object):
             logging.error("subscriptionHandlers tokens = %s" % str(self.subscriptionHandlers.keys()))
             logging.error("No handler to process:\n%s\n" % json.dumps(data, sort_keys=True, indent=2))
 
+    def _factoryFor(self, resource):
+        """
+        Return the connection factory that requests for a resource are
+        sent through.
+
+        @param resource: The resource of the request
+        @type resource: string
+
+        @return: The factory, or None if there is no connection to use
+        @rtype: PAWSProtocolFactory
+        """
+        return self.factory
+
     def _generateToken(self):
         """
         Make a unique token that can be used to match requests with the response.
@@ -329,7 +683,8 @@ class PAWSClient(object):
             logging.error(err_str)
             raise Exception(err_str)
 
-    def _sendRequest(self, method, resource, parameters=None, body=None, token=None):
+    def _sendRequest(self, method, resource, parameters=None, body=None, token=None,
+                     timeout=None, factory=None):
         """
         Send a request to the url, where the method argument defines the kind of request.
         Returns a deferred that returns a tuple containing the response header and the
@@ -342,8 +697,16 @@ class PAWSClient(object):
         @param headers: A dict of header key value pairs to be used in the request
         @type headers: dict
         @param body: THe content used for the request body data.
-
-        @return:  A deferred that returns a the response.
+        @param timeout: The number of seconds to wait for the response. If
+                        not set the request_timeout is used.
+        @type timeout: float
+        @param factory: The connection factory to send the request through.
+                        If not set the factory for the resource is used.
+        @type factory: PAWSProtocolFactory
+
+        @return:  A deferred that returns a the response. It fails with a
+                  defer.TimeoutError if no response arrives in time and
+                  with a ConnectionLost error if the connection is lost.
         @rtype: twisted.internet.defer.Deferred
         """
 
@@ -361,12 +724,21 @@ class PAWSClient(object):
 
         logging.debug("About to send:\n%s\n" % json.dumps(message, sort_keys=True, indent=2))
 
-        if self.connected:
-            self.factory.send(json.dumps(message))
-            self.pendingResponses[token] = defer.Deferred()
-            return self.pendingResponses[token]
+        if factory is None:
+            factory = self._factoryFor(resource)
+        if factory is not None and factory.connected:
+            # register the request before it is sent in case the response
+            # is handled immediately.
+            response_d = defer.Deferred()
+            if timeout is None:
+                timeout = self.request_timeout
+            timer = self.timers.schedule(timeout, self._handleRequestTimeout, token, resource)
+            self.pendingResponses[token] = [response_d, timer, self.timers.clock.seconds(), factory]
+            factory.send(JSONBackend.dumps(message))
+            return response_d
         else:
             logging.error("Send failed, no connection exists")
+            return defer.fail(ConnectionLost("No connection to the PAWS service"))
 
     def _get(self, resource, parameters=None):
         """
@@ -421,19 +793,23 @@ class PAWSClient(object):
         return self._sendRequest("delete", resource)
 
     @defer.inlineCallbacks
-    def _subscribe(self, resource):
+    def _subscribe(self, resource, token=None):
         """
         Perform a subscribe at the specified url
 
         @param resource: The resource used during the request
         @type resource: string
+        @param token: The token to subscribe with. If not set a new token
+                      is generated.
+        @type token: string
 
         @return: A tuple containing the token used for subscription and
                  the result of the subscribe response. The token is needed
                  later to unsubscribe.
         @rtype: tuple
         """
-        token = self._generateToken()
+        if token is None:
+            token = self._generateToken()
         response = yield self._sendRequest("subscribe", resource, token=token)
         # _sendRequest returns a deferred allowing the caller to chain
         # up processing actions to be called when the resposne arrives.
@@ -921,10 +1297,16 @@ class PAWSClient(object):
         """
         Subscribe to the resource for updates of changes.
 
+        Subscribers to the same resource share a single subscription to
+        the PAWS service. Only the first subscriber sends a subscribe
+        request, the others wait for its response.
+
         @param resource: The resource to access
         @type resource: string
         @param subscriptionHandler: A callable that will receive the data structure
                                    returned periodically as a result of the subscription.
+                                   The data structure is shared with the other
+                                   subscribers to the resource and must not be modified.
         @type subscriptionHandler: callable
 
         @return: A tuple containing the token used for subscription and a deferred
@@ -932,16 +1314,41 @@ class PAWSClient(object):
                 needed to unsubscribe later.
         @rtype: string
         """
-        # determine the expected response object kind based on
-        # the resource being subscribed to.
-        if 'datastreams' in resource:
-            dataStructureClass = txcosm.Datastream
+        token = self._generateToken()
+        subscription = self.subscriptions.get(resource)
+        if subscription is None:
+            # determine the expected response object kind based on
+            # the resource being subscribed to.
+            if 'datastreams' in resource:
+                dataStructureClass = txcosm.Datastream
+            else:
+                dataStructureClass = txcosm.Environment
+
+            subscription = Subscription(resource, self._generateToken(), dataStructureClass)
+            self.subscriptions[resource] = subscription
+            subscription.handlers[token] = subscriptionHandler
+            try:
+                (upstream_token, response) = yield self._subscribe(resource, subscription.token)
+            except Exception:
+                if self.subscriptions.get(resource) is subscription:
+                    del self.subscriptions[resource]
+                subscription.subscribed(failure.Failure())
+                raise
+            response_code = self._getResponseCodeStatusFromHeader(response)
+            if response_code:
+                self.subscriptionHandlers[subscription.token] = subscription
+            elif self.subscriptions.get(resource) is subscription:
+                # the service refused the subscription so it is not kept,
+                # or replayed, and a later subscriber tries again.
+                del self.subscriptions[resource]
+            subscription.subscribed(response_code)
         else:
-            dataStructureClass = txcosm.Environment
-
-        (token, response) = yield self._subscribe(resource)
-        response_code = self._getResponseCodeStatusFromHeader(response)
-        self.subscriptionHandlers[token] = (subscriptionHandler, dataStructureClass)
+            subscription.handlers[token] = subscriptionHandler
+            try:
+                response_code = yield subscription.whenSubscribed()
+            except Exception:
+                subscription.handlers.pop(token, None)
+                raise
         result = (token, response_code)
         defer.returnValue(result)
 
@@ -950,6 +1357,9 @@ class PAWSClient(object):
         """
         Unsubscribe from receiving update from the specified resource.
 
+        The subscription to the PAWS service is only removed when its last
+        subscriber unsubscribes.
+
         @param resource: The resource to access
         @type resource: string
         @param token: : The token generated from the initial subscription.
@@ -958,9 +1368,365 @@ class PAWSClient(object):
         @return: A deferred that returns the state of the unsubscription request
         @rtype: boolean
         """
-        if token in self.subscriptionHandlers:
-            del self.subscriptionHandlers[token]
-
-        response = yield self._unsubscribe(resource, token)
+        subscription = self.subscriptions.get(resource)
+        if subscription is None or token not in subscription.handlers:
+            logging.error("No subscription to %s with token %s" % (resource, token))
+            defer.returnValue(None)
+
+        del subscription.handlers[token]
+        if subscription.handlers:
+            defer.returnValue(True)
+
+        del self.subscriptions[resource]
+        if subscription.status is None:
+            # the subscribe request shares the token so its response
+            # must arrive before the unsubscribe request is sent.
+            subscribed = yield subscription.whenSubscribed().addErrback(lambda f: None)
+            if subscribed is None:
+                defer.returnValue(None)
+        self.subscriptionHandlers.pop(subscription.token, None)
+        response = yield self._unsubscribe(resource, subscription.token)
         status_code = self._getResponseCodeStatusFromHeader(response)
         defer.returnValue(status_code)
+
+
+class ShardedPAWSClient(PAWSClient):
+    """
+    A PAWS client that spreads its requests and subscriptions over several
+    connections to the PAWS service.
+
+    A single connection carries every subscription update and response
+    in one stream, so one large message or one slow consumer delays all
+    the others. This client opens a number of connections, its shards,
+    and assigns each resource to a shard by consistent hashing of its
+    feed id. Every resource of a feed therefore uses the same connection.
+
+    Only connected shards are on the hash ring. When a shard's connection
+    is lost its subscriptions are moved to the remaining shards and, when
+    it reconnects, the subscriptions assigned to it are moved back.
+    Consistent hashing means no other subscriptions move. A subscription
+    that fails to move is retried after the request timeout.
+    """
+
+    def __init__(self, api_key=None, feed_id=None, shards=4, max_message_size=None,
+                 request_timeout=10.0, replicas=64, resubscribe=True, catch_up=False):
+        """
+        @param api_key: The api key, with appropriate authorization privileges to use.
+        @type api_key: string
+        @param feed_id: The default feed identifier to use
+        @type feed_id: string
+        @param shards: The number of connections to open
+        @type shards: int
+        @param max_message_size: The maximum size, in bytes, of a message
+                                 received from the PAWS service.
+        @type max_message_size: int
+        @param request_timeout: The number of seconds to wait for the
+                                response to a request before failing it.
+        @type request_timeout: float
+        @param replicas: The number of points each shard has on the hash ring
+        @type replicas: int
+        @param resubscribe: Move the subscriptions of a shard whose
+                            connection is lost to the connected shards.
+        @type resubscribe: boolean
+        @param catch_up: Read each moved resource and pass its state to the
+                         subscription handlers, so they see any change
+                         made while the subscription was being moved.
+        @type catch_up: boolean
+        """
+        if shards < 1:
+            raise Exception("Invalid number of shards \'%s\', at least one is required" % shards)
+        self._shardCount = shards
+        PAWSClient.__init__(self, api_key, feed_id, max_message_size, request_timeout,
+                            resubscribe, catch_up)
+
+        # The ring holds the indexes of the connected shards
+        self.ring = HashRing(replicas=replicas)
+
+        # The resource and the shard of each subscription, keyed by the
+        # subscription token. The shard is None while the subscription is
+        # not on any shard.
+        self.subscriptionShards = dict()
+
+        # The time each shard's connection was lost, used to report the
+        # gap in reconnect_stats when it is re-established.
+        self.shardDisconnectedAt = [None] * shards
+        self._rebalanceTimer = None
+
+        # The tokens of the subscriptions whose move waits for the response
+        # to a pending request.
+        self._deferredMoves = set()
+
+        self.resetShardStats()
+
+    def _makeFactories(self, max_message_size):
+        """
+        Create a connection factory per shard in place of the single
+        factory of the PAWSClient.
+        """
+        self.factory = None
+        self.factories = []
+        for shard in range(self._shardCount):
+            factory = PAWSProtocolFactory(self._messageHandler, max_message_size,
+                                          lambda state, shard=shard: self._shardStateHandler(shard, state))
+            self.factories.append(factory)
+
+    def connect(self):
+        """
+        Establish the connections to the Cosm PAWS service.
+
+        @return: Returns a deferred that fires with True when every
+                 connection is completed.
+        @rtype: defer.Deferred
+        """
+        d = defer.gatherResults([factory.connect() for factory in self.factories])
+        d.addCallback(all)
+        return d
+
+    def disconnect(self):
+        """
+        Break the connections to the Cosm PAWS service
+
+        @return: Returns a deferred that fires with True when every
+                 disconnection is completed.
+        @rtype: defer.Deferred
+        """
+        d = defer.gatherResults([factory.disconnect() for factory in self.factories])
+        d.addCallback(all)
+        return d
+
+    @property
+    def connected(self):
+        """
+        A convenience property to check the connection state.
+
+        @return: True if any shard is connected
+        @rtype: boolean
+        """
+        return len(self.ring) > 0
+
+    @property
+    def shard_stats(self):
+        """
+        Return the traffic of each shard since the stats were last reset.
+
+        @return: A dict per shard holding its connection state, its number
+                 of subscriptions and pending requests, the messages and
+                 bytes sent and received, and the rate at which messages
+                 and bytes were received.
+        @rtype: list
+        """
+        elapsed = self.timers.clock.seconds() - self.statsReset
+        subscriptions = [0] * len(self.factories)
+        for resource, shard in self.subscriptionShards.itervalues():
+            if shard is not None:
+                subscriptions[shard] += 1
+
+        stats = []
+        for shard, factory in enumerate(self.factories):
+            pending = len([p for p in self.pendingResponses.itervalues() if p[3] is factory])
+            stats.append({'shard': shard,
+                          'connected': factory.connected,
+                          'subscriptions': subscriptions[shard],
+                          'pending_requests': pending,
+                          'messages_sent': factory.messages_sent,
+                          'bytes_sent': factory.bytes_sent,
+                          'messages_received': factory.messages_received,
+                          'bytes_received': factory.bytes_received,
+                          'messages_per_second': factory.messages_received / elapsed if elapsed else 0.0,
+                          'bytes_per_second': factory.bytes_received / elapsed if elapsed else 0.0})
+        return stats
+
+    def resetShardStats(self):
+        """
+        Reset the traffic counts of every shard
+        """
+        for factory in self.factories:
+            factory.resetStats()
+        self.statsReset = self.timers.clock.seconds()
+
+    def shardFor(self, resource):
+        """
+        Return the shard that requests for a resource are sent through
+
+        @param resource: The resource to access
+        @type resource: string
+
+        @return: The index of the shard, or None if no shard is connected
+        @rtype: int
+        """
+        return self.ring.get(self._shardKey(resource))
+
+    def _shardKey(self, resource):
+        """
+        Return the key used to assign a resource to a shard. This is the
+        feed id for feed resources and the resource itself otherwise.
+        """
+        parts = resource.strip('/').split('/')
+        if len(parts) > 1 and parts[0] == 'feeds':
+            return parts[1].split('.')[0]
+        return resource
+
+    def _factoryFor(self, resource):
+        """
+        Return the connection factory of the shard a resource is assigned to
+        """
+        shard = self.shardFor(resource)
+        if shard is None:
+            return None
+        return self.factories[shard]
+
+    def _shardStateHandler(self, shard, connected):
+        """
+        Add a shard to the ring when it connects, or fail its pending
+        requests and remove it from the ring when its connection is lost,
+        then move the subscriptions whose shard has changed.
+        """
+        now = self.timers.clock.seconds()
+        if connected:
+            disconnected_at = self.shardDisconnectedAt[shard]
+            if disconnected_at is None:
+                logging.info("PAWS shard %s connected" % shard)
+            else:
+                gap = now - disconnected_at
+                self.shardDisconnectedAt[shard] = None
+                self._recordReconnect(gap)
+                logging.warning("PAWS shard %s re-established after a gap of %.1f seconds" % (shard, gap))
+            self.ring.add(shard)
+        else:
+            logging.warning("PAWS shard %s disconnected" % shard)
+            if self.shardDisconnectedAt[shard] is None:
+                self.shardDisconnectedAt[shard] = now
+            self._failPendingResponses(self.factories[shard])
+            self.ring.remove(shard)
+        if self.resubscribe:
+            self._rebalance()
+
+    def _rebalance(self):
+        """
+        Move each subscription that is not on the shard it is assigned to
+        """
+        for token, entry in self.subscriptionShards.items():
+            resource, shard = entry
+            owner = self.shardFor(resource)
+            if owner == shard:
+                continue
+            if token in self.pendingResponses:
+                # the response to the pending request must arrive before
+                # the subscription can be moved.
+                if token not in self._deferredMoves:
+                    self._deferredMoves.add(token)
+                    self.pendingResponses[token][0].addBoth(self._pendingSettled, token)
+                continue
+            entry[1] = owner
+            if owner is None:
+                logging.warning("No PAWS shard connected for subscription to %s" % resource)
+            else:
+                logging.debug("Moving subscription to %s from shard %s to shard %s" % (resource, shard, owner))
+                self._moveSubscription(resource, token, shard, owner)
+
+    def _pendingSettled(self, result, token):
+        """
+        Move the subscription whose move waited for a pending request
+        once the response to that request has arrived or failed.
+        """
+        self._deferredMoves.discard(token)
+        self._rebalance()
+        return result
+
+    def _scheduleRebalance(self):
+        """
+        Retry the subscriptions that failed to move after the request timeout
+        """
+        if self._rebalanceTimer is None:
+            self._rebalanceTimer = self.timers.schedule(self.request_timeout, self._retryRebalance)
+
+    def _retryRebalance(self):
+        """
+        Move the subscriptions that are not on the shard they are assigned to
+        """
+        self._rebalanceTimer = None
+        self._rebalance()
+
+    def _moveSubscription(self, resource, token, shard, owner):
+        """
+        Move a subscription from one shard to another. The subscription is
+        removed from its shard, if that shard is still connected, before
+        it is made on the new shard so that the requests, which share the
+        subscription token, do not overlap.
+
+        If the subscription can not be made on the new shard it is recorded
+        as not being on any shard and the move is retried later.
+
+        @return: A deferred that fires when the subscription is moved
+        @rtype: defer.Deferred
+        """
+        subscription = self.subscriptions.get(resource)
+        if subscription is not None and subscription.token != token:
+            subscription = None
+        if subscription is not None:
+            # subscribers and unsubscribers wait until the move, which
+            # uses the subscription token, has completed.
+            subscription.status = None
+
+        def resubscribe(result):
+            return self._sendRequest("subscribe", resource, token=token,
+                                     factory=self.factories[owner])
+
+        def moved(response):
+            if not self._getResponseCodeStatusFromHeader(response):
+                raise Exception("subscribe response status %s" % response['status'])
+            self.reconnect_stats['resubscribed'] += 1
+            if subscription is not None:
+                subscription.subscribed(True)
+                if self.catch_up:
+                    self._catchUp(subscription)
+
+        def failed(failure):
+            logging.error("Failed to move subscription to %s: %s" % (resource, failure.getErrorMessage()))
+            entry = self.subscriptionShards.get(token)
+            if entry is not None and entry[1] == owner:
+                entry[1] = None
+                self._scheduleRebalance()
+            if subscription is not None:
+                subscription.subscribed(False)
+
+        if shard is not None and self.factories[shard].connected:
+            d = self._sendRequest("unsubscribe", resource, token=token,
+                                  factory=self.factories[shard])
+            d.addBoth(resubscribe)
+        else:
+            d = resubscribe(None)
+        d.addCallbacks(moved, failed)
+        return d
+
+    def _subscribe(self, resource, token=None):
+        """
+        Perform a subscribe at the specified url and record the shard
+        it is made on.
+        """
+        if token is None:
+            token = self._generateToken()
+        self.subscriptionShards[token] = [resource, self.shardFor(resource)]
+
+        def subscribed(result):
+            if not self._getResponseCodeStatusFromHeader(result[1]):
+                self.subscriptionShards.pop(token, None)
+            return result
+
+        def failed(failure):
+            self.subscriptionShards.pop(token, None)
+            return failure
+
+        d = PAWSClient._subscribe(self, resource, token)
+        d.addCallbacks(subscribed, failed)
+        return d
+
+    def _unsubscribe(self, resource, token):
+        """
+        Perform an unsubscribe on the shard the subscription is on
+        """
+        resource, shard = self.subscriptionShards.pop(token, (resource, None))
+        factory = None
+        if shard is not None:
+            factory = self.factories[shard]
+        return self._sendRequest("unsubscribe", resource, token=token, factory=factory)
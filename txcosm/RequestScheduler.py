@@ -0,0 +1,217 @@
+
+'''
+This module implements a scheduler that bounds the number of requests
+in flight to the Cosm API. Requests beyond the bounds are queued and
+dispatched in priority order as earlier requests complete.
+'''
+
+import collections
+import logging
+from twisted.internet import reactor, defer
+
+
+class Priority(object):
+    """
+    Define the priority classes a request can be scheduled with. Queued
+    requests with a lower value are dispatched first.
+    """
+    Interactive = 0
+    Normal = 1
+    Bulk = 2
+    Valid_Priorities = [Interactive, Normal, Bulk]
+
+
+class RequestScheduler(object):
+    """
+    Caps the number of in-flight requests per host and per API key.
+
+    Requests that would exceed either cap are queued by priority class.
+    Within a priority class requests are dispatched in the order they were
+    submitted, except that a request for a host or key that is at its cap
+    does not hold up requests for other hosts or keys.
+    """
+
+    def __init__(self, max_per_host=10, max_per_key=10):
+        """
+        @param max_per_host: The maximum number of requests in flight to a
+                             single host.
+        @type max_per_host: int
+        @param max_per_key: The maximum number of requests in flight using
+                            a single API key.
+        @type max_per_key: int
+        """
+        self.max_per_host = max_per_host
+        self.max_per_key = max_per_key
+        self.clock = reactor
+
+        # Each priority class holds an ordered dict of (host, api_key)
+        # groups, each group holding a queue of waiting requests. This
+        # keeps dispatch cheap when many requests wait on a busy host.
+        self.queues = dict()
+        for priority in Priority.Valid_Priorities:
+            self.queues[priority] = collections.OrderedDict()
+        self.queued = 0
+        self._dispatching = False
+        self._redispatch = False
+
+        self.inFlightPerHost = dict()
+        self.inFlightPerKey = dict()
+        self.inFlight = 0
+
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, host, api_key, priority, requestFactory):
+        """
+        Schedule a request.
+
+        @param host: The host the request will be sent to
+        @type host: string
+        @param api_key: The API key the request will use
+        @type api_key: string
+        @param priority: The priority class of the request
+        @type priority: int (one of Priority.Valid_Priorities)
+        @param requestFactory: A callable that sends the request and
+                               returns a deferred that fires when the
+                               request is complete.
+        @type requestFactory: callable
+
+        @return: A deferred that returns the result of the deferred
+                 returned by requestFactory.
+        @rtype: twisted.internet.defer.Deferred
+        """
+        if priority not in self.queues:
+            raise Exception("Invalid priority \'%s\' not in %s" % (priority,
+                                                                  Priority.Valid_Priorities))
+        d = defer.Deferred()
+        group = self.queues[priority].setdefault((host, api_key), collections.deque())
+        group.append((requestFactory, d, self.clock.seconds()))
+        self.queued += 1
+        self._dispatch()
+        return d
+
+    def _hasCapacity(self, host, api_key):
+        """
+        Return True if another request may be sent to the host using the key
+        """
+        return (self.inFlightPerHost.get(host, 0) < self.max_per_host and
+                self.inFlightPerKey.get(api_key, 0) < self.max_per_key)
+
+    def _dispatch(self):
+        """
+        Send as many queued requests as the caps allow, highest priority first.
+        """
+        # A request that completes immediately releases its slot from
+        # within this loop. Rather than re-entering, note that another
+        # pass is needed once the current one is finished.
+        if self._dispatching:
+            self._redispatch = True
+            return
+
+        self._dispatching = True
+        try:
+            self._redispatch = True
+            while self._redispatch:
+                self._redispatch = False
+                for priority in Priority.Valid_Priorities:
+                    groups = self.queues[priority]
+                    for groupKey in groups.keys():
+                        host, api_key = groupKey
+                        group = groups[groupKey]
+                        while group and self._hasCapacity(host, api_key):
+                            requestFactory, d, submitted = group.popleft()
+                            self.queued -= 1
+                            self._send(host, api_key, requestFactory, d, submitted)
+                        if not group:
+                            del groups[groupKey]
+        finally:
+            self._dispatching = False
+
+    def _send(self, host, api_key, requestFactory, d, submitted):
+        """
+        Send a request and arrange for its slot to be released when it completes
+        """
+        wait = self.clock.seconds() - submitted
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        self.inFlight += 1
+        self.inFlightPerHost[host] = self.inFlightPerHost.get(host, 0) + 1
+        self.inFlightPerKey[api_key] = self.inFlightPerKey.get(api_key, 0) + 1
+
+        request_d = defer.maybeDeferred(requestFactory)
+        request_d.addBoth(self._release, host, api_key)
+        request_d.chainDeferred(d)
+
+    def _release(self, result, host, api_key):
+        """
+        Release the slot held by a completed request and dispatch any
+        queued requests that can now be sent.
+        """
+        self.inFlight -= 1
+        self.inFlightPerHost[host] -= 1
+        if not self.inFlightPerHost[host]:
+            del self.inFlightPerHost[host]
+        self.inFlightPerKey[api_key] -= 1
+        if not self.inFlightPerKey[api_key]:
+            del self.inFlightPerKey[api_key]
+        if self.queued:
+            logging.debug("Dispatching queued requests, %s waiting" % self.queued)
+            self._dispatch()
+        return result
+
+    def stats(self):
+        """
+        Return a dict of scheduler statistics.
+
+        @return: A dict containing the queue depth (in total and for each
+                 priority class), the number of requests in flight, the
+                 number of requests dispatched and the average and maximum
+                 time, in seconds, requests waited in the queue.
+        @rtype: dict
+        """
+        queued_by_priority = dict()
+        for priority, groups in self.queues.items():
+            queued_by_priority[priority] = sum([len(group) for group in groups.values()])
+        average_wait = 0.0
+        if self.dispatched:
+            average_wait = self.total_wait / self.dispatched
+        return {'queued': self.queued,
+                'queued_by_priority': queued_by_priority,
+                'in_flight': self.inFlight,
+                'dispatched': self.dispatched,
+                'average_wait': average_wait,
+                'max_wait': self.max_wait}
+
+
+# The scheduler shared by all HTTPClient instances that are not
+# given a scheduler of their own.
+_shared_scheduler = None
+
+
+def getSharedScheduler(max_per_host=None, max_per_key=None):
+    """
+    Return the request scheduler shared by HTTPClient instances, creating
+    it on first use. If limits are supplied they are applied to the shared
+    scheduler and affect every client using it.
+
+    @param max_per_host: The maximum number of requests in flight to a
+                         single host.
+    @type max_per_host: int
+    @param max_per_key: The maximum number of requests in flight using
+                        a single API key.
+    @type max_per_key: int
+
+    @return: The shared request scheduler
+    @rtype: RequestScheduler
+    """
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        _shared_scheduler = RequestScheduler()
+    if max_per_host is not None:
+        _shared_scheduler.max_per_host = max_per_host
+    if max_per_key is not None:
+        _shared_scheduler.max_per_key = max_per_key
+    return _shared_scheduler
@@ -0,0 +1,141 @@
+
+'''
+This module implements a cache of decoded responses used to make
+conditional GET requests to Cosm.
+
+The cache stores the ETag and Last-Modified validators of a response
+along with the data structure decoded from it. Later requests for the
+same resource send the validators and, if Cosm reports the resource has
+not been modified, the cached data structure is returned without the
+body being downloaded or decoded again.
+'''
+
+import collections
+
+
+class ResponseCache(object):
+    """
+    A bounded cache of decoded responses with least recently used eviction.
+
+    Entries are keyed by the request url and api key so that responses
+    are never shared between keys with different access rights.
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        @param max_entries: The maximum number of responses held
+        @type max_entries: int
+        """
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """
+        Return the cache entry of a resource. A request holds on to the
+        entry whose validators it sent, as the entry may be evicted before
+        the response arrives.
+
+        @param key: The cache key of the resource
+        @type key: tuple
+
+        @return: A tuple of the ETag, the Last-Modified date and the data
+                 structure, or None if the resource is not cached.
+        @rtype: tuple
+        """
+        return self.entries.get(key)
+
+    def validators(self, key, entry=None):
+        """
+        Return the conditional request headers for a cached resource.
+
+        @param key: The cache key of the resource
+        @type key: tuple
+        @param entry: The cache entry of the resource, if it has already
+                      been looked up.
+        @type entry: tuple
+
+        @return: A dict of If-None-Match and If-Modified-Since headers. The
+                 dict is empty if the resource is not cached.
+        @rtype: dict
+        """
+        headers = dict()
+        if entry is None:
+            entry = self.entries.get(key)
+        if entry is not None:
+            etag, last_modified, dataStructure = entry
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def store(self, key, etag, last_modified, dataStructure):
+        """
+        Store a decoded response. Responses without validators can not be
+        revalidated so they are not stored.
+
+        @param key: The cache key of the resource
+        @type key: tuple
+        @param etag: The ETag header of the response
+        @type etag: string
+        @param last_modified: The Last-Modified header of the response
+        @type last_modified: string
+        @param dataStructure: The data structure decoded from the response
+        @type dataStructure: txcosm.DataStructure
+        """
+        self.misses += 1
+        if not (etag or last_modified):
+            self.entries.pop(key, None)
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = (etag, last_modified, dataStructure)
+        self._evict()
+
+    def _evict(self):
+        """
+        Evict the least recently used entries beyond the maximum
+        """
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def revalidated(self, key, entry=None):
+        """
+        Return the cached data structure of a resource that Cosm reported
+        as not modified.
+
+        @param key: The cache key of the resource
+        @type key: tuple
+        @param entry: The cache entry whose validators were sent. It is
+                      used, and stored again, if the resource has been
+                      evicted since the request was sent.
+        @type entry: tuple
+
+        @return: The cached data structure or None if it is not cached
+        @rtype: txcosm.DataStructure
+        """
+        entry = self.entries.pop(key, entry)
+        if entry is None:
+            return None
+        # move the entry to the most recently used position
+        self.entries[key] = entry
+        self._evict()
+        self.hits += 1
+        return entry[2]
+
+    def stats(self):
+        """
+        Return a dict of cache statistics.
+
+        @return: A dict containing the number of entries, the number of
+                 responses served from the cache (hits), the number of
+                 responses decoded (misses) and the number of entries evicted.
+        @rtype: dict
+        """
+        return {'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
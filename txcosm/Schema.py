@@ -0,0 +1,398 @@
+
+'''
+This module implements the declarative schemas used by the txcosm data
+structures.
+
+A data structure class lists its fields in a _schema attribute. When the
+class is created the schema is compiled into __init__, toDict and
+fromDict methods that access each attribute directly, rather than walking
+a list of attribute names with getattr and setattr and branching on the
+field being handled.
+
+The schema is also compiled into a toJson method that formats the compact
+JSON of the structure directly, without building the dict that toDict
+returns.
+'''
+
+from json.encoder import encode_basestring_ascii
+from txcosm import JSONBackend
+
+
+class Field(object):
+    """
+    Describes how a data structure attribute is converted to and from the
+    dict used for JSON serialization.
+    """
+
+    # Field kinds
+    Text = 'text'                     # encoded as unicode
+    Raw = 'raw'                       # encoded as is
+    Structure = 'structure'           # a nested data structure
+    Structure_List = 'structure_list'  # a list of nested data structures
+    Structure_Map = 'structure_map'   # a dict of nested data structures keyed by id
+    Valid_Kinds = [Text, Raw, Structure, Structure_List, Structure_Map]
+
+    # Tests deciding if an attribute value is present
+    Skip_False = 'false'     # values that are false are skipped
+    Skip_Missing = 'missing'  # only None and empty lists are skipped
+
+    __slots__ = ['name', 'kind', 'structure', 'valid', 'label', 'skip', 'default', 'extend']
+
+    def __init__(self, name, kind=Text, structure=None, valid=None, label=None,
+                 skip=Skip_False, default=None, extend=False):
+        """
+        @param name: The field name, which is also the attribute name
+        @type name: string
+        @param kind: How the field is encoded (one of Field.Valid_Kinds)
+        @type kind: string
+        @param structure: The data structure class of nested structures
+        @type structure: class
+        @param valid: The values the field may take when decoded
+        @type valid: list
+        @param label: The description of the field used in error messages
+        @type label: string
+        @param skip: The test deciding if a value is present
+        @type skip: string
+        @param default: The initial value of the attribute. Lists and dicts
+                        of nested structures always start empty.
+        @type default: immutable object
+        @param extend: A flag requesting that decoding into an existing
+                       structure adds to a list of nested structures
+                       rather than replacing it.
+        @type extend: boolean
+        """
+        if kind not in Field.Valid_Kinds:
+            raise Exception("Invalid field kind \'%s\' not in %s" % (kind, Field.Valid_Kinds))
+        if kind in [Field.Structure, Field.Structure_List, Field.Structure_Map] and structure is None:
+            raise Exception("Field \'%s\' of kind \'%s\' requires a structure class" % (name, kind))
+        self.name = name
+        self.kind = kind
+        self.structure = structure
+        self.valid = valid
+        self.label = label or name
+        self.skip = skip
+        self.default = default
+        self.extend = extend
+
+
+def _presentTest(field):
+    """
+    Return the source of the test that the value held in v is present
+    """
+    if field.skip == Field.Skip_Missing:
+        # the comparison with an empty list is slow for values of other
+        # types so it is only made for values that are false
+        return "v is not None and (v or v != [])"
+    return "v"
+
+
+def compileToDict(schema, namespace):
+    """
+    Return the source of a toDict method for a schema
+    """
+    lines = ["def toDict(self):",
+             "    d = {}"]
+    for index, field in enumerate(schema):
+        key = "k%d" % index
+        namespace[key] = field.name
+        lines.append("    v = self.%s" % field.name)
+        lines.append("    if %s:" % _presentTest(field))
+        if field.kind == Field.Text:
+            lines.append("        d[%s] = v if v.__class__ is unicode else unicode(v)" % key)
+        elif field.kind == Field.Raw:
+            lines.append("        d[%s] = v" % key)
+        elif field.kind == Field.Structure:
+            lines.append("        d[%s] = v.toDict()" % key)
+        elif field.kind == Field.Structure_List:
+            lines.append("        d[%s] = [item.toDict() for item in v]" % key)
+        elif field.kind == Field.Structure_Map:
+            lines.append("        d[%s] = [item.toDict() for item in v.itervalues()]" % key)
+    lines.append("    return d")
+    return "\n".join(lines)
+
+
+def compileToJson(schema, namespace):
+    """
+    Return the source of a toJson method for a schema. Its output holds
+    the same fields and values as the toDict output encoded by
+    txcosm.JSONBackend.
+    """
+    namespace['quote'] = encode_basestring_ascii
+    namespace['JSONBackend'] = JSONBackend
+    lines = ["def toJson(self):",
+             "    parts = []"]
+    for index, field in enumerate(schema):
+        key = "j%d" % index
+        namespace[key] = encode_basestring_ascii(field.name) + ':'
+        if field.structure is not None:
+            namespace["S%d" % index] = field.structure
+        lines.append("    v = self.%s" % field.name)
+        lines.append("    if %s:" % _presentTest(field))
+        if field.kind == Field.Text:
+            lines.append("        parts.append(%s + quote(v if v.__class__ is unicode else unicode(v)))" % key)
+        elif field.kind == Field.Raw:
+            lines.append("        parts.append(%s + JSONBackend.dumps(v))" % key)
+        elif field.kind == Field.Structure:
+            lines.append("        parts.append(%s + v.toJson())" % key)
+        elif field.kind == Field.Structure_List:
+            lines.append("        parts.append(%s + S%d.listToJson(v))" % (key, index))
+        elif field.kind == Field.Structure_Map:
+            lines.append("        parts.append(%s + S%d.listToJson(v.values()))" % (key, index))
+    lines.append("    return '{%s}' % ','.join(parts)")
+    return "\n".join(lines)
+
+
+def _decodeLines(field, index, namespace, initialise):
+    """
+    Return the source lines that decode the value held in v into a field.
+    When initialising, nested structure lists and dicts are created
+    rather than added to. Otherwise nested structure lists are replaced
+    unless the field extends them.
+    """
+    lines = []
+    if field.valid is not None:
+        valid = "valid%d" % index
+        namespace[valid] = field.valid
+        lines.append("if v not in %s:" % valid)
+        lines.append("    raise Exception(\"Invalid %s \\'%%s\\' not in %%s\" %% (v, %s))" % (field.label,
+                                                                                           valid))
+    if field.structure is not None:
+        # nested structures with a compiled _create are built without
+        # copying their dict into keyword arguments
+        structure = "S%d" % index
+        create = getattr(field.structure, '_create', None)
+        if create is not None:
+            namespace[structure] = create
+            structure = structure + "(%s)"
+        else:
+            namespace[structure] = field.structure
+            structure = structure + "(**%s)"
+
+    if field.kind in [Field.Text, Field.Raw]:
+        lines.append("self.%s = v" % field.name)
+    elif field.kind == Field.Structure:
+        lines.append("self.%s = %s" % (field.name, structure % "v"))
+    elif field.kind == Field.Structure_List:
+        if initialise or not field.extend:
+            lines.append("self.%s = [%s for kwargs in v]" % (field.name, structure % "kwargs"))
+        else:
+            # items are added to the container already held by the
+            # attribute, which may be a list or a store providing
+            # extendDicts, such as txcosm.DatapointColumns
+            lines.append("items = self.%s" % field.name)
+            lines.append("if items.__class__ is list:")
+            lines.append("    items.extend([%s for kwargs in v])" % (structure % "kwargs"))
+            lines.append("else:")
+            lines.append("    items.extendDicts(v)")
+    elif field.kind == Field.Structure_Map:
+        if initialise:
+            lines.append("items = self.%s = {}" % field.name)
+        else:
+            lines.append("items = self.%s" % field.name)
+        lines.append("for kwargs in v:")
+        lines.append("    item = %s" % (structure % "kwargs"))
+        lines.append("    items[item.id] = item")
+    return lines
+
+
+def _defaultLine(field, index, namespace):
+    """
+    Return the source line that sets a field to its initial value
+    """
+    if field.kind == Field.Structure_List:
+        return "self.%s = []" % field.name
+    if field.kind == Field.Structure_Map:
+        return "self.%s = {}" % field.name
+    default = "default%d" % index
+    namespace[default] = field.default
+    return "self.%s = %s" % (field.name, default)
+
+
+def compileFromDict(schema, namespace):
+    """
+    Return the source of a fromDict method for a schema
+    """
+    lines = ["def fromDict(self, inDict):",
+             "    get = inDict.get"]
+    for index, field in enumerate(schema):
+        key = "k%d" % index
+        namespace[key] = field.name
+        lines.append("    v = get(%s)" % key)
+        lines.append("    if %s:" % _presentTest(field))
+        lines.extend(["        " + line for line in _decodeLines(field, index, namespace, False)])
+    return "\n".join(lines)
+
+
+def _initialiseLines(schema, namespace):
+    """
+    Return the source lines that set each field from the dict get, or to
+    its initial value.
+    """
+    lines = []
+    for index, field in enumerate(schema):
+        key = "k%d" % index
+        namespace[key] = field.name
+        lines.append("v = get(%s)" % key)
+        lines.append("if %s:" % _presentTest(field))
+        lines.extend(["    " + line for line in _decodeLines(field, index, namespace, True)])
+        lines.append("else:")
+        lines.append("    " + _defaultLine(field, index, namespace))
+    return lines
+
+
+def compileInit(schema, namespace):
+    """
+    Return the source of an __init__ method for a schema that sets each
+    field from a keyword argument, or to its initial value.
+    """
+    lines = ["def __init__(self, **kwargs):",
+             "    get = kwargs.get"]
+    lines.extend(["    " + line for line in _initialiseLines(schema, namespace)])
+    return "\n".join(lines)
+
+
+def compileCreate(schema, namespace):
+    """
+    Return the source of a _create function for a schema that returns a
+    new instance of the class initialised from a dict. It is equivalent
+    to cls(**inDict) but the dict is not copied into keyword arguments.
+    """
+    lines = ["def _create(inDict):",
+             "    self = new(cls)",
+             "    get = inDict.get"]
+    lines.extend(["    " + line for line in _initialiseLines(schema, namespace)])
+    lines.append("    return self")
+    return "\n".join(lines)
+
+
+_Structure_Kinds = [Field.Structure, Field.Structure_List, Field.Structure_Map]
+
+
+def compileFromDictLazy(schema, namespace):
+    """
+    Return the source of a fromDictLazy method for a schema. Nested
+    structures are not decoded. Their dicts are kept in the _lazy dict,
+    and their attributes left unset, until they are first accessed.
+    """
+    lines = ["def fromDictLazy(self, inDict):",
+             "    get = inDict.get",
+             "    try:",
+             "        lazy = self._lazy",
+             "    except AttributeError:",
+             "        lazy = self._lazy = {}"]
+    for index, field in enumerate(schema):
+        key = "k%d" % index
+        namespace[key] = field.name
+        lines.append("    v = get(%s)" % key)
+        lines.append("    if %s:" % _presentTest(field))
+        if field.kind in _Structure_Kinds:
+            lines.append("        lazy[%s] = v" % key)
+            lines.append("        try:")
+            lines.append("            del self.%s" % field.name)
+            lines.append("        except AttributeError:")
+            lines.append("            pass")
+        else:
+            lines.extend(["        " + line for line in _decodeLines(field, index, namespace, False)])
+    return "\n".join(lines)
+
+
+def compileMaterializers(schema, namespace):
+    """
+    Return the source of the functions that decode each nested structure
+    field of a lazily decoded structure, and of a dict of the functions
+    keyed by field name.
+    """
+    lines = []
+    names = []
+    for index, field in enumerate(schema):
+        if field.kind in _Structure_Kinds:
+            lines.append("def m%d(self, v):" % index)
+            lines.extend(["    " + line for line in _decodeLines(field, index, namespace, True)])
+            names.append("%r: m%d" % (field.name, index))
+    lines.append("_materializers = {%s}" % ", ".join(names))
+    return "\n".join(lines)
+
+
+def lazyAttribute(self, name):
+    """
+    Decode a nested structure of a lazily decoded structure when it is
+    first accessed. This is the __getattr__ method of structures that
+    support lazy decoding, so it is only called for attributes that are
+    not set.
+    """
+    if name != '_lazy':
+        materialize = self._materializers.get(name)
+        if materialize is not None:
+            try:
+                lazy = self._lazy
+            except AttributeError:
+                lazy = None
+            if lazy and name in lazy:
+                # the raw value is kept until it is decoded so a decode
+                # error is raised again on the next access
+                materialize(self, lazy[name])
+                del lazy[name]
+                return getattr(self, name)
+    raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
+
+class SchemaCompiler(type):
+    """
+    A metaclass that compiles the _schema of a data structure class into
+    its __init__, toDict, toJson and fromDict methods and sets its _attributes to
+    the names of the schema fields. Methods defined by the class itself
+    are not replaced.
+
+    Classes that declare a _lazy slot also get a fromDictLazy method, that
+    defers the decoding of nested structures until they are accessed.
+
+    Classes that declare a _committed slot, and so track their changes,
+    also get a _fieldsToDict method that returns the dict of the fields
+    other than lists and dicts of nested structures.
+    """
+
+    def __init__(cls, name, bases, attributes):
+        super(SchemaCompiler, cls).__init__(name, bases, attributes)
+        schema = attributes.get('_schema')
+        if schema is None:
+            return
+
+        cls._attributes = [field.name for field in schema]
+        for compiler, method_name in [(compileInit, '__init__'),
+                                      (compileToDict, 'toDict'),
+                                      (compileToJson, 'toJson'),
+                                      (compileFromDict, 'fromDict')]:
+            if method_name in attributes:
+                continue
+            method = _compile(compiler, schema, cls, method_name)
+            if method_name != '__init__':
+                method.__doc__ = getattr(bases[0], method_name).__doc__
+            setattr(cls, method_name, method)
+
+        # classes initialised by a method of their own can not be created
+        # by the compiled _create function
+        if '__init__' not in attributes:
+            cls._create = staticmethod(_compile(compileCreate, schema, cls, '_create'))
+
+        if '_lazy' in attributes.get('__slots__', ()):
+            method = _compile(compileFromDictLazy, schema, cls, 'fromDictLazy')
+            method.__doc__ = getattr(bases[0], 'fromDictLazy').__doc__
+            cls.fromDictLazy = method
+            cls._materializers = _compile(compileMaterializers, schema, cls, '_materializers')
+            cls.__getattr__ = lazyAttribute
+
+        if '_committed' in attributes.get('__slots__', ()):
+            fields = [field for field in schema
+                      if field.kind not in [Field.Structure_List, Field.Structure_Map]]
+            cls._fieldsToDict = _compile(compileToDict, fields, cls, 'toDict')
+
+
+def _compile(compiler, schema, cls, function_name):
+    """
+    Return the function, or other object, generated by a compiler for a
+    class
+    """
+    namespace = dict(cls=cls, new=object.__new__)
+    source = compiler(schema, namespace)
+    exec compile(source, "<%s.%s schema>" % (cls.__name__, function_name), "exec") in namespace
+    return namespace[function_name]
@@ -0,0 +1,634 @@
+
+'''
+This module implements incremental decoders for Cosm response bodies.
+Rather than waiting for the complete body and parsing it in one go, a
+decoder is fed the body as it arrives and passes each item of a large
+collection (the datapoints of a datastream history or the feeds of a
+feed list) to a handler as soon as the item is complete. Only the item
+currently being received is held in memory.
+
+Each decoder also keeps the small remainder of the document that is not
+part of the collection, such as a datastream's id and current value or
+a feed list's total results, and returns it when the decoder is closed.
+
+XML documents that are read from a file, rather than received in chunks,
+can be decoded with the iterparse based functions which yield each item
+as it is parsed and discard its elements once it has been consumed.
+'''
+
+try:
+    from lxml import etree
+except ImportError:
+    try:
+        from xml.etree import cElementTree as etree
+    except ImportError:
+        import xml.etree.ElementTree as etree
+import re
+import txcosm
+from txcosm import JSONBackend
+
+
+# Characters that change the structure of a JSON document
+_structural = re.compile(r'["{}\[\],:]')
+
+# Characters that end, or escape characters within, a JSON string
+_stringSpecial = re.compile(r'["\\]')
+
+
+class JSONArrayDecoder(object):
+    """
+    Incrementally decodes a JSON object, passing each item of the array
+    held by one of its top level members to a handler as soon as the item
+    is complete.
+
+    The decoder only tracks enough of the JSON structure to find the
+    boundaries of the array items. Each item is decoded on its own so a
+    malformed item raises a ValueError when it completes.
+    """
+
+    def __init__(self, member, itemHandler):
+        """
+        @param member: The name of the top level member holding the array
+        @type member: string
+        @param itemHandler: A callable that is passed each decoded array item
+        @type itemHandler: callable
+        """
+        self.member = member
+        self.itemHandler = itemHandler
+        self.items = 0
+        self._skeleton = []      # document text excluding the array items
+        self._item = []          # text of the array item being received
+        self._inArray = False
+        self._depth = 0
+        self._inString = False
+        self._escape = False
+        self._key = None         # text of the top level string being received
+        self._lastKey = None
+        self._memberNext = False
+
+    def feed(self, data):
+        """
+        Decode the next chunk of the document
+
+        @param data: The next chunk of the document
+        @type data: string
+        """
+        pos = 0
+        segment = 0
+        end = len(data)
+        while pos < end:
+            if self._escape:
+                self._escape = False
+                pos += 1
+                continue
+
+            if self._inString:
+                m = _stringSpecial.search(data, pos)
+                if m is None:
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    self._escape = True
+                else:
+                    self._inString = False
+                    if self._key is not None:
+                        self._key.append(data[segment:pos - 1])
+                        self._lastKey = "".join(self._key)
+                        self._skeleton.append(self._lastKey)
+                        self._key = None
+                        segment = pos - 1
+                continue
+
+            m = _structural.search(data, pos)
+            if m is None:
+                break
+            pos = m.start()
+            c = m.group()
+
+            if c == '"':
+                self._inString = True
+                if self._depth == 1 and not self._inArray:
+                    # capture top level strings as they may be member names
+                    self._skeleton.append(data[segment:pos + 1])
+                    segment = pos + 1
+                    self._key = []
+
+            elif c == ':':
+                if self._depth == 1:
+                    self._memberNext = self._lastKey == self.member
+
+            elif c in '{[':
+                self._depth += 1
+                if c == '[' and self._depth == 2 and self._memberNext:
+                    self._memberNext = False
+                    self._skeleton.append(data[segment:pos + 1])
+                    segment = pos + 1
+                    self._inArray = True
+
+            elif c == ',':
+                if self._depth == 1:
+                    self._memberNext = False
+                elif self._inArray and self._depth == 2:
+                    self._item.append(data[segment:pos])
+                    segment = pos + 1
+                    self._emitItem()
+
+            else:  # '}' or ']'
+                if self._inArray and self._depth == 2:
+                    self._item.append(data[segment:pos])
+                    segment = pos
+                    self._emitItem()
+                    self._inArray = False
+                self._depth -= 1
+
+            pos += 1
+
+        # keep the remainder of the chunk for the next call
+        remainder = data[segment:]
+        if self._inArray:
+            self._item.append(remainder)
+        elif self._key is not None:
+            self._key.append(remainder)
+        else:
+            self._skeleton.append(remainder)
+
+    def _emitItem(self):
+        """
+        Decode the item that has just been received and pass it on
+        """
+        text = "".join(self._item).strip()
+        self._item = []
+        if text:
+            self.items += 1
+            self.itemHandler(JSONBackend.loads(text))
+
+    def close(self):
+        """
+        Finish decoding the document.
+
+        @return: The document with the array items removed
+        @rtype: dict
+        """
+        if self._depth or self._inString:
+            raise ValueError("Incomplete JSON document")
+        return JSONBackend.loads("".join(self._skeleton))
+
+
+class CSVRowDecoder(object):
+    """
+    Incrementally decodes a CSV document, passing the fields of each row
+    to a handler as soon as the row is complete.
+
+    Cosm CSV documents hold no quoted fields, so a row is split on its
+    first maxsplit commas and any further commas are kept in the last
+    field.
+    """
+
+    def __init__(self, itemHandler, maxsplit=1):
+        """
+        @param itemHandler: A callable that is passed the list of fields
+                            of each row
+        @type itemHandler: callable
+        @param maxsplit: The maximum number of commas a row is split on
+        @type maxsplit: int
+        """
+        self.itemHandler = itemHandler
+        self.maxsplit = maxsplit
+        self.items = 0
+        self.last = None
+        self._partial = ""   # text of the row being received
+
+    def feed(self, data):
+        """
+        Decode the next chunk of the document
+
+        @param data: The next chunk of the document
+        @type data: string
+        """
+        rows = (self._partial + data).split('\n')
+        self._partial = rows.pop()
+        for row in rows:
+            self._emitRow(row)
+
+    def _emitRow(self, row):
+        """
+        Split a complete row into fields and pass them on
+        """
+        row = row.strip()
+        if row:
+            fields = row.split(',', self.maxsplit)
+            self.items += 1
+            self.last = fields
+            self.itemHandler(fields)
+
+    def close(self):
+        """
+        Finish decoding the document.
+
+        @return: The fields of the last row or None if there were no rows
+        @rtype: list
+        """
+        self._emitRow(self._partial)
+        self._partial = ""
+        return self.last
+
+
+def _localName(tag):
+    """
+    Return an element or attribute name without its namespace
+    """
+    if tag[0] == '{':
+        return tag.split('}', 1)[1]
+    return tag
+
+
+class XMLElementDecoder(object):
+    """
+    Incrementally decodes an XML document, passing each element with a
+    particular tag to a handler as soon as the element is complete.
+
+    Namespaces are stripped from the tags and attribute names of the
+    elements passed to the handler. Elements outside the elements of
+    interest are not kept. Instead their attributes and text are recorded
+    by name and returned when the decoder is closed.
+    """
+
+    def __init__(self, tag, itemHandler):
+        """
+        @param tag: The tag, without namespace, of the elements to decode
+        @type tag: string
+        @param itemHandler: A callable that is passed each decoded element
+        @type itemHandler: callable
+        """
+        self.tag = tag
+        self.itemHandler = itemHandler
+        self.items = 0
+        self.fields = dict()
+        self._builder = None
+        self._depth = 0
+        self._text = []
+        self.parser = etree.XMLParser(target=_ParserTarget(self))
+
+    def feed(self, data):
+        """
+        Decode the next chunk of the document
+
+        @param data: The next chunk of the document
+        @type data: string
+        """
+        self.parser.feed(data)
+
+    def close(self):
+        """
+        Finish decoding the document.
+
+        @return: The attributes and text of the elements outside the
+                 elements of interest, keyed by name.
+        @rtype: dict
+        """
+        self.parser.close()
+        return self.fields
+
+    def start(self, tag, attrib):
+        """
+        Handle the start of an element
+        """
+        tag = _localName(tag)
+        attrib = dict([(_localName(k), v) for k, v in attrib.items()])
+        if self._builder is None and tag == self.tag:
+            self._builder = etree.TreeBuilder()
+        if self._builder is not None:
+            self._builder.start(tag, attrib)
+            self._depth += 1
+        else:
+            self.fields.update(attrib)
+            self._text = []
+
+    def end(self, tag):
+        """
+        Handle the end of an element
+        """
+        tag = _localName(tag)
+        if self._builder is not None:
+            self._builder.end(tag)
+            self._depth -= 1
+            if not self._depth:
+                element = self._builder.close()
+                self._builder = None
+                self.items += 1
+                self.itemHandler(element)
+        else:
+            text = "".join(self._text).strip()
+            if text:
+                self.fields[tag] = text
+            self._text = []
+
+    def data(self, data):
+        """
+        Handle the text content of an element
+        """
+        if self._builder is not None:
+            self._builder.data(data)
+        else:
+            self._text.append(data)
+
+
+class _ParserTarget(object):
+    """
+    Passes the events generated by an XML parser on to a decoder
+    """
+
+    def __init__(self, decoder):
+        self.start = decoder.start
+        self.end = decoder.end
+        self.data = decoder.data
+
+    def close(self):
+        pass
+
+
+class DatastreamDecoder(object):
+    """
+    Incrementally decodes a datastream history, passing each historical
+    datapoint to a handler as a txcosm.Datapoint as soon as it is received.
+    """
+
+    def __init__(self, datapointHandler, format=txcosm.DataFormats.JSON):
+        """
+        @param datapointHandler: A callable that is passed each Datapoint
+        @type datapointHandler: callable
+        @param format: The format of the document [json|xml]
+        @type format: string
+        """
+        self.datapointHandler = datapointHandler
+        self.format = format
+        if format == txcosm.DataFormats.JSON:
+            self.decoder = JSONArrayDecoder(txcosm.DataFields.Datapoints,
+                                            self._fromDict)
+        elif format == txcosm.DataFormats.XML:
+            self.decoder = XMLElementDecoder(txcosm.DataFields.Value,
+                                             self._fromElement)
+        elif format == txcosm.DataFormats.CSV:
+            self.decoder = CSVRowDecoder(self._fromRow)
+        else:
+            raise Exception("Don't know how to stream decode datapoints using format %s" % format)
+
+    def _fromDict(self, inDict):
+        self.datapointHandler(txcosm.Datapoint(**inDict))
+
+    def _fromRow(self, fields):
+        if len(fields) == 2:
+            self.datapointHandler(txcosm.Datapoint(at=fields[0], value=fields[1]))
+
+    def _fromElement(self, element):
+        self.datapointHandler(_datapointFromElement(element))
+
+    def feed(self, data):
+        """
+        Decode the next chunk of the document
+
+        @param data: The next chunk of the document
+        @type data: string
+        """
+        self.decoder.feed(data)
+
+    def close(self):
+        """
+        Finish decoding the document.
+
+        @return: The datastream, without its datapoints
+        @rtype: txcosm.Datastream
+        """
+        fields = self.decoder.close()
+        if self.format == txcosm.DataFormats.XML:
+            fields = _datastreamFields(fields)
+        elif self.format == txcosm.DataFormats.CSV:
+            # the last row holds the current value
+            if fields is None:
+                fields = dict()
+            elif len(fields) == 2:
+                fields = {txcosm.DataFields.At: fields[0], txcosm.DataFields.Current_Value: fields[1]}
+            else:
+                fields = {txcosm.DataFields.Current_Value: fields[0]}
+        return txcosm.Datastream(**fields)
+
+
+class EnvironmentListDecoder(object):
+    """
+    Incrementally decodes a feed list, passing each feed to a handler as
+    a txcosm.Environment as soon as it is received.
+    """
+
+    def __init__(self, environmentHandler, format=txcosm.DataFormats.JSON):
+        """
+        @param environmentHandler: A callable that is passed each Environment
+        @type environmentHandler: callable
+        @param format: The format of the document [json|xml]
+        @type format: string
+        """
+        self.environmentHandler = environmentHandler
+        self.format = format
+        if format == txcosm.DataFormats.JSON:
+            self.decoder = JSONArrayDecoder(txcosm.DataFields.Results,
+                                            self._fromDict)
+        elif format == txcosm.DataFormats.XML:
+            self.decoder = XMLElementDecoder(txcosm.DataFields.Environment,
+                                             self._fromElement)
+        else:
+            raise Exception("Don't know how to stream decode feeds using format %s" % format)
+
+    def _fromDict(self, inDict):
+        self.environmentHandler(txcosm.Environment(**inDict))
+
+    def _fromElement(self, element):
+        self.environmentHandler(_environmentFromElement(element))
+
+    def feed(self, data):
+        """
+        Decode the next chunk of the document
+
+        @param data: The next chunk of the document
+        @type data: string
+        """
+        self.decoder.feed(data)
+
+    def close(self):
+        """
+        Finish decoding the document.
+
+        @return: The feed list, without its feeds
+        @rtype: txcosm.EnvironmentList
+        """
+        fields = self.decoder.close()
+        environmentList = txcosm.EnvironmentList()
+        environmentList.total_results = fields.get(txcosm.DataFields.Total_Results, None)
+        return environmentList
+
+
+def _datapointFromElement(element):
+    """
+    Return the Datapoint held by a namespace stripped value element
+    """
+    return txcosm.Datapoint(at=element.get(txcosm.DataFields.At), value=element.text)
+
+
+def _environmentFromElement(element):
+    """
+    Return the Environment held by a namespace stripped environment element
+    """
+    # Environment.fromXml expects the parent of the environment element
+    parent = etree.Element('eeml')
+    parent.append(element)
+    environment = txcosm.Environment()
+    environment.fromXml(parent)
+    return environment
+
+
+def _datastreamFields(fields):
+    """
+    Return the datastream fields found outside the datapoints of an XML
+    datastream history.
+    """
+    return dict([(k, v) for k, v in fields.items() if k in [txcosm.DataFields.At,
+                                                             txcosm.DataFields.Current_Value,
+                                                             txcosm.DataFields.Id,
+                                                             txcosm.DataFields.Maximum_Value,
+                                                             txcosm.DataFields.Minimum_Value]])
+
+
+def iterparse(source, tag, fields=None):
+    """
+    Parse an XML document, yielding each element with a particular tag as
+    soon as it is complete.
+
+    Namespaces are stripped from the tags and attribute names of the
+    yielded elements. Once the caller has processed an element it is
+    cleared and removed from its parent, so the memory used stays flat
+    however large the document is. The attributes and text of the
+    elements outside the elements of interest are recorded by name.
+
+    @param source: The document
+    @type source: file name or file like object
+    @param tag: The tag, without namespace, of the elements to yield
+    @type tag: string
+    @param fields: A dict that the attributes and text of the other
+                   elements are added to.
+    @type fields: dict
+    """
+    if fields is None:
+        fields = dict()
+    stack = []
+    depth = 0  # depth within an element of interest
+    for event, element in etree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            if depth or _localName(element.tag) == tag:
+                depth += 1
+            else:
+                # attributes are recorded as elements start so that those
+                # of inner elements replace those of outer elements
+                fields.update([(_localName(k), v) for k, v in element.attrib.items()])
+            continue
+
+        stack.pop()
+        if depth:
+            depth -= 1
+            if depth:
+                continue
+            for child in element.iter():
+                child.tag = _localName(child.tag)
+                for name in child.attrib.keys():
+                    local = _localName(name)
+                    if local != name:
+                        child.attrib[local] = child.attrib.pop(name)
+            yield element
+        else:
+            text = (element.text or "").strip()
+            if text:
+                fields[_localName(element.tag)] = text
+
+        element.clear()
+        if stack:
+            stack[-1].remove(element)
+
+
+def iterDatapoints(source, fields=None):
+    """
+    Parse an XML datastream history, yielding each historical datapoint
+    as a txcosm.Datapoint as soon as it is parsed.
+
+    @param source: The document
+    @type source: file name or file like object
+    @param fields: A dict that the datastream fields are added to
+    @type fields: dict
+    """
+    for element in iterparse(source, txcosm.DataFields.Value, fields):
+        yield _datapointFromElement(element)
+
+
+def iterEnvironments(source, fields=None):
+    """
+    Parse an XML feed list, yielding each feed as a txcosm.Environment as
+    soon as it is parsed.
+
+    @param source: The document
+    @type source: file name or file like object
+    @param fields: A dict that the feed list fields are added to
+    @type fields: dict
+    """
+    for element in iterparse(source, txcosm.DataFields.Environment, fields):
+        yield _environmentFromElement(element)
+
+
+def decodeDatastream(source, datapointHandler=None, columnar=False):
+    """
+    Decode an XML datastream history using iterparse.
+
+    @param source: The document
+    @type source: file name or file like object
+    @param datapointHandler: An optional callable. If set each Datapoint is
+                             passed to it as soon as it is parsed and the
+                             returned datastream holds no datapoints.
+    @type datapointHandler: callable
+    @param columnar: A flag requesting that the datapoints be held in a
+                     DatapointColumns store rather than a list.
+    @type columnar: boolean
+
+    @return: The datastream
+    @rtype: txcosm.Datastream
+    """
+    fields = dict()
+    datapoints = txcosm.Datastream(columnar=columnar).datapoints
+    for datapoint in iterDatapoints(source, fields):
+        if datapointHandler is not None:
+            datapointHandler(datapoint)
+        else:
+            datapoints.append(datapoint)
+    datastream = txcosm.Datastream(columnar=columnar, **_datastreamFields(fields))
+    datastream.datapoints = datapoints
+    return datastream
+
+
+def decodeEnvironmentList(source, environmentHandler=None):
+    """
+    Decode an XML feed list using iterparse.
+
+    @param source: The document
+    @type source: file name or file like object
+    @param environmentHandler: An optional callable. If set each Environment
+                               is passed to it as soon as it is parsed and
+                               the returned list holds no feeds.
+    @type environmentHandler: callable
+
+    @return: The feed list
+    @rtype: txcosm.EnvironmentList
+    """
+    fields = dict()
+    environmentList = txcosm.EnvironmentList()
+    for environment in iterEnvironments(source, fields):
+        if environmentHandler is not None:
+            environmentHandler(environment)
+        else:
+            environmentList.feeds.append(environment)
+    environmentList.total_results = fields.get(txcosm.DataFields.Total_Results, None)
+    return environmentList
@@ -0,0 +1,153 @@
+
+'''
+This module implements a hashed timing wheel. It is used to manage large
+numbers of request timeouts which, in the common case, are cancelled
+before they expire.
+
+Starting and cancelling a timer costs O(1) and, however many timers are
+pending, the wheel only ever holds a single delayed call in the reactor.
+The price is resolution: a timer fires up to one tick after it is due.
+'''
+
+import itertools
+import logging
+import math
+from twisted.internet import reactor
+
+
+class TimerWheel(object):
+    """
+    A hashed timing wheel.
+
+    Time is divided into ticks. The wheel has a fixed number of slots and
+    a timer is stored in the slot its expiry tick hashes to, along with the
+    number of whole revolutions of the wheel that must pass before it is
+    due. The wheel only ticks while timers are pending.
+    """
+
+    def __init__(self, tick=0.1, size=512):
+        """
+        @param tick: The resolution of the wheel in seconds
+        @type tick: float
+        @param size: The number of slots in the wheel
+        @type size: int
+        """
+        self.tick = tick
+        self.size = size
+        self.clock = reactor
+        self.slots = [dict() for i in range(size)]
+        self.cursor = 0
+        self.pending = 0
+        self._ids = itertools.count(1)
+        self._tickCall = None
+        self._lastTick = None  # the time of the tick the cursor points at
+        self._advancing = False
+
+    def schedule(self, delay, callback, *args):
+        """
+        Schedule a callback to be called after a delay.
+
+        @param delay: The number of seconds to wait before calling callback
+        @type delay: float
+        @param callback: The callable to call when the timer expires
+        @type callback: callable
+
+        @return: A handle that can be used to cancel the timer
+        @rtype: tuple
+        """
+        now = self.clock.seconds()
+        if self._tickCall is None and not self._advancing:
+            self._lastTick = now
+            self._tickCall = self.clock.callLater(self.tick, self._advance)
+
+        # The cursor points at the slot of the last tick so the part of a
+        # tick that has passed since then is added to the delay, otherwise
+        # the timer could fire early.
+        ticks = max(1, int(math.ceil((now - self._lastTick + delay) / self.tick - 1e-6)))
+        slot = (self.cursor + ticks) % self.size
+        rounds = (ticks - 1) // self.size
+        timer_id = next(self._ids)
+        self.slots[slot][timer_id] = (rounds, callback, args)
+        self.pending += 1
+        return (slot, timer_id)
+
+    def cancel(self, handle):
+        """
+        Cancel a pending timer. Cancelling a timer that has already expired
+        or been cancelled has no effect.
+
+        @param handle: The handle returned when the timer was scheduled
+        @type handle: tuple
+        """
+        slot, timer_id = handle
+        if self.slots[slot].pop(timer_id, None) is not None:
+            self.pending -= 1
+            if not self.pending and self._tickCall is not None:
+                self._tickCall.cancel()
+                self._tickCall = None
+
+    def _advance(self):
+        """
+        Move the wheel on by however many ticks have elapsed since it was
+        last moved, calling any timers that have expired.
+        """
+        self._tickCall = None
+        now = self.clock.seconds()
+        # allow for a small amount of floating point error in the clock
+        elapsed = max(1, int((now - self._lastTick) / self.tick + 1e-6))
+
+        # Each elapsed tick visits the next slot, so a slot is visited once
+        # for every revolution that has passed. The time of the last tick
+        # moves with the cursor, so timers scheduled by the callbacks are
+        # placed relative to the slot being expired, and the wheel is only
+        # rescheduled once the elapsed ticks have all been visited.
+        self._advancing = True
+        try:
+            for i in range(elapsed):
+                self.cursor = (self.cursor + 1) % self.size
+                self._lastTick += self.tick
+                self._expire(self.slots[self.cursor])
+                if not self.pending:
+                    break
+        finally:
+            self._advancing = False
+
+        if self.pending:
+            delay = max(0, self._lastTick + self.tick - self.clock.seconds())
+            self._tickCall = self.clock.callLater(delay, self._advance)
+
+    def _expire(self, slot):
+        """
+        Call the timers in a slot that are due and count down the rest.
+        """
+        for timer_id, (rounds, callback, args) in slot.items():
+            if timer_id not in slot:
+                # cancelled by a callback called earlier in this slot
+                continue
+            if rounds:
+                slot[timer_id] = (rounds - 1, callback, args)
+            else:
+                del slot[timer_id]
+                self.pending -= 1
+                try:
+                    callback(*args)
+                except Exception, ex:
+                    logging.exception(ex)
+
+
+# The timer wheel shared by clients that are not given one of their own.
+_shared_wheel = None
+
+
+def getSharedTimerWheel():
+    """
+    Return the timer wheel shared by the txcosm clients, creating it on
+    first use.
+
+    @return: The shared timer wheel
+    @rtype: TimerWheel
+    """
+    global _shared_wheel
+    if _shared_wheel is None:
+        _shared_wheel = TimerWheel()
+    return _shared_wheel
@@ -31,8 +31,13 @@ except ImportError:
         from xml.etree import cElementTree as etree
     except ImportError:
         import xml.etree.ElementTree as etree
+import array
+import itertools
 import json
 import logging
+from txcosm import JSONBackend
+from txcosm.ISO8601 import parseTimestamp, formatTimestamp
+from txcosm.Schema import Field, SchemaCompiler
 
 
 version = (0, 1, 0)
@@ -165,8 +170,20 @@ class DataStructure(object):
     Serialized versions of objects deriving from this class are passed between
     the Cosm API and the txcosm client. These structures are designed in
     such a way that they can be used for JSON or XML (EEML).
+
+    The structures that are created in large numbers declare __slots__,
+    and a class level list of the fields they serialize in _attributes,
+    so that instances carry no per instance dict.
+
+    A structure may instead declare its fields in a _schema list of
+    txcosm.Schema.Field. The schema is compiled into the structure's
+    toDict, toJson and fromDict methods, and its _attributes, when the
+    class is created.
     """
 
+    __metaclass__ = SchemaCompiler
+    __slots__ = ()
+
     def toDict(self):
         """
         Return the data structure object as a dict. This method is used as
@@ -174,6 +191,28 @@ class DataStructure(object):
         """
         raise NotImplementedError
 
+    def toJson(self):
+        """
+        Return the object as a compact JSON document
+
+        @return: JSON representation of the object
+        @rtype: string
+        """
+        return JSONBackend.dumps(self.toDict())
+
+    @classmethod
+    def listToJson(cls, items):
+        """
+        Return a list of objects of this class as a compact JSON array
+
+        @param items: The objects
+        @type items: list
+
+        @return: JSON representation of the objects
+        @rtype: string
+        """
+        return "[%s]" % ",".join([item.toJson() for item in items])
+
     def toXml(self):
         """
         Return the object as an xml ElementTree
@@ -198,12 +237,71 @@ class DataStructure(object):
         """
         raise NotImplementedError
 
-    def encode(self, format=DataFormats.JSON):
+    def toCsv(self):
+        """
+        Return the object as CSV rows
+
+        @return: CSV representation of the object
+        @rtype: string
+        """
+        raise Exception("Don't know how to encode %s using format %s" % (self.__class__.__name__,
+                                                                         DataFormats.CSV))
+
+    def fromCsv(self, data):
+        """
+        Populate attributes from CSV rows
+
+        @param data: The CSV rows
+        @type data: string
+        """
+        raise Exception("Don't know how to decode %s using format %s" % (self.__class__.__name__,
+                                                                         DataFormats.CSV))
+
+    def fromDictLazy(self, inDict):
+        """
+        Populate attributes from a dict, deferring the decoding of nested
+        structures until they are first accessed. Structures that do not
+        support lazy decoding are decoded in full.
+        """
+        self.fromDict(inDict)
+
+    def fromXmlLazy(self, element):
+        """
+        Populate attributes from a XML etree, deferring the decoding of
+        nested structures until they are first accessed. Structures that
+        do not support lazy decoding are decoded in full.
+
+        @param xml: an xml element tree
+        @type xml: etree.Element
+        """
+        self.fromXml(element)
+
+    def changesToDict(self):
+        """
+        Return the fields changed since the object was last committed as a
+        dict. Objects that do not track their changes return all of their
+        fields.
+        """
+        return self.toDict()
+
+    def encode(self, format=DataFormats.JSON, delta=False):
         """
         Return a string representation of the object encoded in the specified format
+
+        @param format: The format to encode the object in [json|xml|csv]
+        @type format: string
+        @param delta: A flag requesting that only the fields changed since
+                      the object was last committed are encoded.
+        @type delta: boolean
         """
+        if delta:
+            changes = self.changesToDict()
+            if format == DataFormats.JSON:
+                return JSONBackend.dumps(changes)
+            return self.__class__(**changes).encode(format)
+
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return self.toJson()
 
         elif format == DataFormats.XML:
             eeml = etree.Element('eeml')
@@ -214,17 +312,27 @@ class DataStructure(object):
             eeml.append(self.toXml())
             return etree.tostring(eeml)
 
+        elif format == DataFormats.CSV:
+            return self.toCsv()
+
         else:
             raise Exception("Don't know how to encode %s using format %s" % (self.__class__.__name__,
                                                                              format))
 
-    def decode(self, data, format=DataFormats.JSON):
+    def decode(self, data, format=DataFormats.JSON, lazy=False):
         """
         Decode data, in the specified format, into local attributes
+
+        @param lazy: A flag requesting that nested structures are only
+                     decoded when they are first accessed.
+        @type lazy: boolean
         """
         if format == DataFormats.JSON:
-            inDict = json.loads(data)
-            self.fromDict(inDict)
+            inDict = JSONBackend.loads(data)
+            if lazy:
+                self.fromDictLazy(inDict)
+            else:
+                self.fromDict(inDict)
 
         elif format == DataFormats.XML:
             # parse xml string, rip off the eeml wrapper and process
@@ -234,7 +342,13 @@ class DataStructure(object):
             element = etree.fromstring(data)
             environment = element.find("{%s}%s" % (namespace_map[EEML_NAMESPACE], DataFields.Environment))
             if environment is not None:
-                self.fromXml(environment)
+                if lazy:
+                    self.fromXmlLazy(environment)
+                else:
+                    self.fromXml(environment)
+
+        elif format == DataFormats.CSV:
+            self.fromCsv(data)
 
         else:
             raise Exception("Don't know how to decode %s using format %s" % (self.__class__.__name__,
@@ -264,41 +378,10 @@ class Unit(DataStructure):
                         Derived_Units,
                         Context_Dependent_Units]
 
-    def __init__(self, **kwargs):
-        self._attributes = [DataFields.Label,
-                            DataFields.Type,
-                            DataFields.Symbol]
-        self.label = None
-        self.type = None
-        self.symbol = None
-
-        # initialise Unit attributes to specified values or None.
-        self.fromDict(kwargs)
-
-    def toDict(self):
-        """
-        Return the data structure object as a dict. This method is used as
-        a helper function for JSON serialization/deserialization.
-        """
-        unitDict = dict()
-        for attribute in self._attributes:
-            attribute_value = getattr(self, attribute, None)
-            if attribute_value:
-                unitDict[attribute] = unicode(attribute_value)
-        return unitDict
-
-    def fromDict(self, inDict):
-        """
-        Populate attributes from a dict
-        """
-        for attribute in self._attributes:
-            attribute_value = inDict.get(attribute, None)
-            if attribute_value:
-                if attribute == DataFields.Type:
-                    if attribute_value not in Unit.Valid_Unit_Types:
-                        raise Exception("Invalid unit type \'%s\' not in %s" % (attribute_value,
-                                                                                Unit.Valid_Unit_Types))
-                setattr(self, attribute, attribute_value)
+    _schema = [Field(DataFields.Label),
+               Field(DataFields.Type, valid=Valid_Unit_Types, label='unit type'),
+               Field(DataFields.Symbol)]
+    __slots__ = ['label', 'type', 'symbol']
 
     def toXml(self, parent=None):
         """
@@ -434,35 +517,50 @@ class Waypoint(DataStructure):
 class Datapoint(DataStructure):
     """ Models a Datapoint item within a datastream """
 
-    def __init__(self, **kwargs):
-        self._attributes = [DataFields.At,
-                            DataFields.Value]
-        self.at = None
-        self.value = None
-
-        # initialise Datapoint attributes to specified values or None.
-        self.fromDict(kwargs)
+    _schema = [Field(DataFields.At),
+               Field(DataFields.Value)]
+    __slots__ = ['at', 'value']
 
-    def toDict(self):
+    @property
+    def at_seconds(self):
         """
-        Return the data structure object as a dict. This method is used as
-        a helper function for JSON serialization/deserialization.
+        The at timestamp as seconds since the epoch, or None if it is
+        not set.
         """
-        datapointDict = dict()
-        for attribute in self._attributes:
-            attribute_value = getattr(self, attribute, None)
-            if attribute_value:
-                datapointDict[attribute] = unicode(attribute_value)
-        return datapointDict
+        if self.at is None:
+            return None
+        return parseTimestamp(self.at)
 
-    def fromDict(self, inDict):
+    @at_seconds.setter
+    def at_seconds(self, seconds):
+        if seconds is None:
+            self.at = None
+        else:
+            self.at = formatTimestamp(seconds)
+
+    @classmethod
+    def listToJson(cls, datapoints):
         """
-        Populate attributes from a dict
+        Return a list of datapoints as a compact JSON array. Datapoints
+        holding string timestamps and values, which is the common case,
+        are formatted in a single pass without calling their toJson method.
+        Columnar datapoints are formatted straight from their arrays.
+
+        @param datapoints: The datapoints
+        @type datapoints: list of Datapoint or DatapointColumns
+
+        @return: JSON representation of the datapoints
+        @rtype: string
         """
-        for attribute in self._attributes:
-            attribute_value = inDict.get(attribute, None)
-            if attribute_value:
-                setattr(self, attribute, attribute_value)
+        if isinstance(datapoints, DatapointColumns):
+            return datapoints.toJson()
+        try:
+            return "[%s]" % ",".join([_Datapoint_Json % (_quote(datapoint.at), _quote(datapoint.value))
+                                      if datapoint.at and datapoint.value else datapoint.toJson()
+                                      for datapoint in datapoints])
+        except TypeError:
+            # a timestamp or value that is not a string
+            return "[%s]" % ",".join([datapoint.toJson() for datapoint in datapoints])
 
     def toXml(self, parent=None):
         """
@@ -495,6 +593,234 @@ class Datapoint(DataStructure):
             if value:
                 self.value = value
 
+    def toCsv(self):
+        """
+        Return the object as a timestamp,value CSV row
+
+        @return: CSV representation of the object
+        @rtype: string
+        """
+        return "%s,%s" % (self.at, self.value)
+
+    def fromCsv(self, data):
+        """
+        Populate attributes from a timestamp,value CSV row
+
+        @param data: The CSV row
+        @type data: string
+        """
+        at_time, value = data.strip().split(',', 1)
+        self.at = at_time or None
+        self.value = value or None
+
+
+# The compact JSON of a datapoint with a timestamp and value
+_Datapoint_Json = '{"%s":%%s,"%s":%%s}' % (DataFields.At, DataFields.Value)
+
+_quote = json.encoder.encode_basestring_ascii
+
+
+def _newDatapoint(at_time, value):
+    """
+    Return a Datapoint without building a dict of keyword arguments
+    """
+    datapoint = Datapoint.__new__(Datapoint)
+    datapoint.at = at_time or None
+    datapoint.value = value or None
+    return datapoint
+
+
+def _isTimestamp(text):
+    """
+    Return True if a CSV field holds an ISO8601 timestamp
+    """
+    return len(text) >= 19 and text[4] == '-' and text[10] in 'T '
+
+
+def datapointsToJson(datapoints):
+    """
+    Return datapoints as the compact JSON document accepted by Cosm when
+    creating datapoints, formatted directly from the datapoints.
+
+    @param datapoints: The datapoints
+    @type datapoints: list of Datapoint or DatapointColumns
+
+    @return: The JSON document
+    @rtype: string
+    """
+    return '{"%s":%s}' % (DataFields.Datapoints, Datapoint.listToJson(datapoints))
+
+
+def datapointsToCsv(datapoints):
+    """
+    Return datapoints as timestamp,value CSV rows, the format accepted by
+    Cosm when creating datapoints.
+
+    @param datapoints: The datapoints
+    @type datapoints: list of Datapoint or DatapointColumns
+
+    @return: The CSV rows
+    @rtype: string
+    """
+    if isinstance(datapoints, DatapointColumns):
+        return datapoints.toCsv()
+    return "\n".join(["%s,%s" % (datapoint.at, datapoint.value) for datapoint in datapoints])
+
+
+def _formatValue(value):
+    """
+    Return a numeric datapoint value as the shortest string that
+    represents it exactly.
+    """
+    text = repr(value)
+    if text.endswith('.0'):
+        text = text[:-2]
+    return text
+
+
+class DatapointColumns(object):
+    """
+    A columnar store for the datapoints of a datastream history.
+
+    The timestamps, as seconds since the epoch, and the values are held
+    in two parallel arrays of doubles rather than as a list of Datapoint
+    objects. The store behaves like the list of datapoints it replaces,
+    creating Datapoint objects only as they are accessed. It can only
+    hold numeric values.
+    """
+
+    __slots__ = ['timestamps', 'values']
+
+    def __init__(self, datapoints=None):
+        """
+        @param datapoints: Datapoints to initialise the store with
+        @type datapoints: iterable of Datapoint
+        """
+        self.timestamps = array.array('d')
+        self.values = array.array('d')
+        if datapoints:
+            self.extend(datapoints)
+
+    def add(self, timestamp, value):
+        """
+        Add a datapoint without creating a Datapoint object.
+
+        @param timestamp: An timestamp in ISO8601 format
+        @type timestamp: string
+        @param value: The value of the datapoint
+        @type value: string or number
+        """
+        self.timestamps.append(parseTimestamp(timestamp))
+        self.values.append(float(value))
+
+    def append(self, datapoint):
+        """
+        Add a Datapoint
+        """
+        self.add(datapoint.at, datapoint.value)
+
+    def extend(self, datapoints):
+        """
+        Add a sequence of Datapoints
+        """
+        for datapoint in datapoints:
+            self.add(datapoint.at, datapoint.value)
+
+    def extendDicts(self, datapoints):
+        """
+        Add a sequence of datapoints, as the dicts they are serialized as,
+        without creating Datapoint objects.
+        """
+        add = self.add
+        for datapoint in datapoints:
+            add(datapoint[DataFields.At], datapoint[DataFields.Value])
+
+    def appendArrays(self, timestamps, values):
+        """
+        Add datapoints in bulk from parallel sequences of timestamps, as
+        seconds since the epoch, and values. Arrays of doubles, including
+        numpy float64 arrays, are copied in a single operation.
+
+        @param timestamps: The timestamps of the datapoints
+        @type timestamps: sequence of float
+        @param values: The values of the datapoints
+        @type values: sequence of float
+        """
+        if len(timestamps) != len(values):
+            raise Exception("Timestamp and value counts differ: %s != %s" % (len(timestamps),
+                                                                             len(values)))
+        for column, data in [(self.timestamps, timestamps), (self.values, values)]:
+            if getattr(data, 'dtype', None) == 'float64':
+                column.fromstring(data.tostring())
+            elif isinstance(data, array.array) and data.typecode == 'd':
+                column.extend(data)
+            else:
+                column.extend([float(item) for item in data])
+
+    def toJson(self):
+        """
+        Return the datapoints as a compact JSON array without creating
+        Datapoint objects.
+        """
+        row = _Datapoint_Json % ('"%s"', '"%s"')
+        return "[%s]" % ",".join([row % (formatTimestamp(timestamp), _formatValue(value))
+                                  for timestamp, value in itertools.izip(self.timestamps, self.values)])
+
+    def toCsv(self):
+        """
+        Return the datapoints as timestamp,value CSV rows without creating
+        Datapoint objects.
+        """
+        return "\n".join(["%s,%s" % (formatTimestamp(timestamp), _formatValue(value))
+                          for timestamp, value in itertools.izip(self.timestamps, self.values)])
+
+    def toNumpy(self):
+        """
+        Return copies of the timestamps and values as numpy arrays. The
+        arrays can not share memory with the store, as adding datapoints
+        may reallocate it, so each is copied in a single memory copy.
+
+        @return: A tuple of timestamps and values numpy float64 arrays
+        @rtype: tuple
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise Exception("numpy is required to export datapoints as numpy arrays")
+        return (numpy.frombuffer(self.timestamps, dtype=numpy.float64).copy(),
+                numpy.frombuffer(self.values, dtype=numpy.float64).copy())
+
+    def _datapoint(self, index):
+        """
+        Return a Datapoint view of the datapoint at an index
+        """
+        return Datapoint(at=formatTimestamp(self.timestamps[index]),
+                         value=_formatValue(self.values[index]))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self):
+        for index in xrange(len(self.timestamps)):
+            yield self._datapoint(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._datapoint(i) for i in xrange(*index.indices(len(self)))]
+        return self._datapoint(index)
+
+    def __delitem__(self, index):
+        del self.timestamps[index]
+        del self.values[index]
+
+    def __eq__(self, other):
+        if isinstance(other, DatapointColumns):
+            return self.timestamps == other.timestamps and self.values == other.values
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
 
 class Permission(DataStructure):
     """ Models a Permission item within a API key """
@@ -591,73 +917,17 @@ class Location(DataStructure):
     Mobile = 'mobile'
     Valid_Disposition_Kinds = [Fixed, Mobile]
 
-    def __init__(self, **kwargs):
-        self._attributes = [DataFields.Disposition,
-                            DataFields.Domain,
-                            DataFields.Elevation,
-                            DataFields.Exposure,
-                            DataFields.Latitude,
-                            DataFields.Longitude,
-                            DataFields.Name,
-                            DataFields.Waypoints]
-        self.disposition = None
-        self.domain = None
-        self.ele = None
-        self.exposure = None
-        self.lat = None
-        self.lon = None
-        self.name = None
-        self.waypoints = []
-
-        # initialise attributes to specified values.
-        self.fromDict(kwargs)
-
-    def toDict(self):
-        """
-        Return the data structure object as a dict. This method is used as
-        a helper function for JSON serialization/deserialization.
-        """
-        locationDict = dict()
-        for attribute in self._attributes:
-            attribute_value = getattr(self, attribute, None)
-            if attribute_value:
-                if attribute == DataFields.Waypoints:
-                    waypoints = attribute_value
-                    locationDict[attribute] = list()
-                    for waypoint in waypoints:
-                        locationDict[attribute].append(waypoint.toDict())
-                else:
-                    locationDict[attribute] = attribute_value
-        return locationDict
-
-    def fromDict(self, inDict):
-        """
-        Populate attributes from a dict
-        """
-        for attribute in self._attributes:
-            attribute_value = inDict.get(attribute, None)
-            if attribute_value:
-                if attribute == DataFields.Disposition:
-                    if attribute_value not in Location.Valid_Disposition_Kinds:
-                        raise Exception("Invalid disposition \'%s\' not in %s" % (attribute_value,
-                                                                                  Location.Valid_Disposition_Kinds))
-                if attribute == DataFields.Domain:
-                    if attribute_value not in Location.Valid_Domain_Kinds:
-                        raise Exception("Invalid domain \'%s\' not in %s" % (attribute_value,
-                                                                             Location.Valid_Domain_Kinds))
-
-                if attribute == DataFields.Exposure:
-                    if attribute_value not in Location.Valid_Exposure_Kinds:
-                        raise Exception("Invalid exposure \'%s\' not in %s" % (attribute_value,
-                                                                               Location.Valid_Exposure_Kinds))
-                if attribute == DataFields.Waypoints:
-                    waypoints = getattr(self, DataFields.Waypoints)
-                    waypoints = []
-                    for waypointKwargs in attribute_value:
-                        waypoints.append(Waypoint(**waypointKwargs))
-                    setattr(self, attribute, waypoints)
-                else:
-                    setattr(self, attribute, attribute_value)
+    _schema = [Field(DataFields.Disposition, Field.Raw, valid=Valid_Disposition_Kinds,
+                     label='disposition'),
+               Field(DataFields.Domain, Field.Raw, valid=Valid_Domain_Kinds, label='domain'),
+               Field(DataFields.Elevation, Field.Raw),
+               Field(DataFields.Exposure, Field.Raw, valid=Valid_Exposure_Kinds, label='exposure'),
+               Field(DataFields.Latitude, Field.Raw),
+               Field(DataFields.Longitude, Field.Raw),
+               Field(DataFields.Name, Field.Raw),
+               Field(DataFields.Waypoints, Field.Structure_List, Waypoint)]
+    __slots__ = ['disposition', 'domain', 'ele', 'exposure', 'lat', 'lon',
+                 'name', 'waypoints']
 
     def toXml(self, parent=None):
         """
@@ -736,72 +1006,76 @@ class Location(DataStructure):
 class Datastream(DataStructure):
     """ Models a datastream structure within an environment """
 
-    def __init__(self, **kwargs):
-        self._attributes = [DataFields.At,
-                            DataFields.Current_Value,
-                            DataFields.Datapoints,
-                            DataFields.Id,
-                            DataFields.Maximum_Value,
-                            DataFields.Minimum_Value,
-                            DataFields.Tags,
-                            DataFields.Unit,
-                            DataFields.Updated]
+    _schema = [Field(DataFields.At, skip=Field.Skip_Missing),
+               Field(DataFields.Current_Value, skip=Field.Skip_Missing),
+               Field(DataFields.Datapoints, Field.Structure_List, Datapoint, skip=Field.Skip_Missing,
+                     extend=True),
+               Field(DataFields.Id, skip=Field.Skip_Missing),
+               Field(DataFields.Maximum_Value, skip=Field.Skip_Missing),
+               Field(DataFields.Minimum_Value, skip=Field.Skip_Missing),
+               Field(DataFields.Tags, skip=Field.Skip_Missing),
+               Field(DataFields.Unit, Field.Structure, Unit, skip=Field.Skip_Missing),
+               Field(DataFields.Updated, skip=Field.Skip_Missing)]
+    # the _committed slot holds the state last committed by commit
+    __slots__ = ['id', 'at', 'current_value', 'max_value', 'min_value',
+                 'updated', 'datapoints', 'tags', 'unit', '_committed']
+
+    def __init__(self, columnar=False, **kwargs):
+        """
+        @param columnar: A flag requesting that the datapoints be held in a
+                         DatapointColumns store rather than a list. Only
+                         numeric datapoint values can be held.
+        @type columnar: boolean
+        """
         self.id = None
         self.at = None
         self.current_value = None
         self.max_value = None
         self.min_value = None
         self.updated = None
-        self.datapoints = []
+        if columnar:
+            self.datapoints = DatapointColumns()
+        else:
+            self.datapoints = []
         self.tags = []
         self.unit = None
 
         # initialise attributes to specified values.
         self.fromDict(kwargs)
 
-    def toDict(self):
+    @property
+    def at_seconds(self):
         """
-        Return the data structure object as a dict. This method is used as
-        a helper function for JSON serialization/deserialization.
+        The at timestamp as seconds since the epoch, or None if it is
+        not set.
         """
-        datastreamDict = dict()
-        for attribute in self._attributes:
-            attribute_value = getattr(self, attribute, None)
-            if (attribute_value is not None) and (attribute_value != []):
-                if attribute == DataFields.Datapoints:
-                    datapoints = attribute_value
-                    datastreamDict[attribute] = list()
-                    for datapoint in datapoints:
-                        datastreamDict[attribute].append(datapoint.toDict())
-
-                elif attribute == DataFields.Unit:
-                    unit = attribute_value
-                    datastreamDict[attribute] = unit.toDict()
-                else:
-                    datastreamDict[attribute] = unicode(attribute_value)
-        return datastreamDict
+        if self.at is None:
+            return None
+        return parseTimestamp(self.at)
 
-    def fromDict(self, inDict):
+    @at_seconds.setter
+    def at_seconds(self, seconds):
+        if seconds is None:
+            self.at = None
+        else:
+            self.at = formatTimestamp(seconds)
+
+    @property
+    def updated_seconds(self):
         """
-        Populate attributes from a dict
+        The updated timestamp as seconds since the epoch, or None if it is
+        not set.
         """
-        for attribute in self._attributes:
-            attribute_value = inDict.get(attribute, None)
-            if (attribute_value is not None) and (attribute_value != []):
-                if attribute == DataFields.Datapoints:
-                    if not hasattr(self, DataFields.Datapoints):
-                        setattr(self, attribute, list())
-                    datapoints = getattr(self, DataFields.Datapoints)
-                    datapoints_list = attribute_value
-                    for datapointsKwargs in datapoints_list:
-                        datapoints.append(Datapoint(**datapointsKwargs))
-                    setattr(self, attribute, datapoints)
-
-                elif attribute == DataFields.Unit:
-                    unitKwargs = attribute_value
-                    setattr(self, attribute, Unit(**unitKwargs))
-                else:
-                    setattr(self, attribute, attribute_value)
+        if self.updated is None:
+            return None
+        return parseTimestamp(self.updated)
+
+    @updated_seconds.setter
+    def updated_seconds(self, seconds):
+        if seconds is None:
+            self.updated = None
+        else:
+            self.updated = formatTimestamp(seconds)
 
     def toXml(self, parent=None):
         """
@@ -891,12 +1165,55 @@ class Datastream(DataStructure):
 
             datapoints = data.find(DataFields.Datapoints)
             if datapoints is not None:
-                self.datapoints = []
+                del self.datapoints[:]
                 for value in datapoints.findall(DataFields.Value):
                     d = Datapoint()
                     d.fromXml(value)
                     self.datapoints.append(d)
 
+    def toCsv(self):
+        """
+        Return the object as CSV rows. A datastream holding datapoints is
+        encoded as a timestamp,value row per datapoint. Otherwise its
+        current value is encoded, preceded by its timestamp if it has one.
+
+        @return: CSV representation of the object
+        @rtype: string
+        """
+        if len(self.datapoints):
+            return datapointsToCsv(self.datapoints)
+        if self.at is None:
+            return "%s" % self.current_value
+        return "%s,%s" % (self.at, self.current_value)
+
+    def fromCsv(self, data):
+        """
+        Populate attributes from timestamp,value CSV rows. Each row is added
+        as a datapoint and the last row also sets the current value. A row
+        holding only a value sets the current value.
+
+        @param data: The CSV rows
+        @type data: string
+        """
+        datapoints = self.datapoints
+        columnar = isinstance(datapoints, DatapointColumns)
+        last = None
+        for row in data.splitlines():
+            row = row.strip()
+            if not row:
+                continue
+            fields = row.split(',', 1)
+            if len(fields) == 1:
+                self.current_value = row
+                continue
+            if columnar:
+                datapoints.add(fields[0], fields[1])
+            else:
+                datapoints.append(_newDatapoint(fields[0], fields[1]))
+            last = fields
+        if last is not None:
+            self.at, self.current_value = last
+
     def setCurrentValue(self, value):
         """
         Set the current value of the datastream.
@@ -915,6 +1232,9 @@ class Datastream(DataStructure):
         @param value: the current value for the datastream
         @type value: string
         """
+        if isinstance(self.datapoints, DatapointColumns):
+            self.datapoints.add(timestamp, value)
+            return
         inDict = {DataFields.At: timestamp, DataFields.Value: value}
         self.datapoints.append(Datapoint(**inDict))
 
@@ -927,91 +1247,126 @@ class Datastream(DataStructure):
         """
         self.current_value = None
         del self.datapoints[:]
+        committed = getattr(self, '_committed', None)
+        if committed is not None:
+            self._committed = (committed[0], 0)
 
+    def snapshot(self):
+        """
+        Return the current state of the datastream, to be passed to commit
+        once the update sent from that state has succeeded.
 
-class Environment(DataStructure):
-    """ Models a Cosm Environment (feed) object """
+        @return: An opaque snapshot of the datastream
+        @rtype: tuple
+        """
+        return (self._fieldsToDict(), len(self.datapoints))
 
-    def __init__(self, **kwargs):
-        self._attributes = [DataFields.Creator,
-                            DataFields.Datastreams,
-                            DataFields.Description,
-                            DataFields.Feed,
-                            DataFields.Icon,
-                            DataFields.Id,
-                            DataFields.Location,
-                            DataFields.Private,
-                            DataFields.Status,
-                            DataFields.Tags,
-                            DataFields.Title,
-                            DataFields.Updated,
-                            DataFields.Version,
-                            DataFields.Website]
-        self.creator = None
-        self.datastreams = {}
-        self.description = None
-        self.feed = None
-        self.icon = None
-        self.id = None
-        self.location = None
-        self.private = None
-        self.status = None
-        self.tags = None
-        self.title = None
-        self.updated = None
-        self.version = version
-        self.website = None
+    def commit(self, snapshot=None):
+        """
+        Record the state of the datastream as the state held by Cosm, so
+        that only later changes are encoded by changesToDict. Datapoints
+        are tracked by count, as they are only ever added, so the
+        datapoints committed are those held when the snapshot was taken.
 
-        # initialise attributes to specified values.
-        self.fromDict(kwargs)
+        @param snapshot: The snapshot to commit, taken when the update was
+                         encoded. If not set the current state is committed.
+        @type snapshot: tuple
+        """
+        self._committed = snapshot or self.snapshot()
 
-    def toDict(self):
+    def reset(self):
         """
-        Return the data structure object as a dict. This method is used as
-        a helper function for JSON serialization/deserialization.
+        Forget the committed state so that all fields and datapoints are
+        treated as changed.
         """
-        environmentDict = dict()
-        for attribute in self._attributes:
-            attribute_value = getattr(self, attribute, None)
-            if attribute_value:
-                if attribute == DataFields.Id:
-                    environmentDict[attribute] = attribute_value
+        self._committed = None
 
-                elif attribute == DataFields.Location:
-                    environmentDict[attribute] = self.location.toDict()
+    def _changes(self):
+        """
+        Return the dict of the fields changed since the last commit, or
+        None if nothing has changed.
+        """
+        committed = getattr(self, '_committed', None)
+        if committed is None:
+            return self.toDict()
+        fields, count = committed
+        changes = dict()
+        for key, value in self._fieldsToDict().iteritems():
+            if fields.get(key) != value:
+                changes[key] = value
+        if len(self.datapoints) != count:
+            if len(self.datapoints) < count:
+                # the datapoints have been replaced
+                count = 0
+            changes[DataFields.Datapoints] = [datapoint.toDict() for datapoint in
+                                              itertools.islice(self.datapoints, count, None)]
+        if not changes:
+            return None
+        if self.id is not None:
+            changes[DataFields.Id] = unicode(self.id)
+        return changes
 
-                elif attribute == DataFields.Datastreams:
-                    datastreams = []
-                    for datastream_id, datastream in self.datastreams.items():
-                        datastreams.append(datastream.toDict())
-                        environmentDict[DataFields.Datastreams] = datastreams
-                else:
-                    environmentDict[attribute] = attribute_value
-        return environmentDict
+    @property
+    def changed(self):
+        """
+        True if the datastream has changed since it was last committed
+        """
+        return self._changes() is not None
 
-    def fromDict(self, inDict):
+    def changesToDict(self):
         """
-        Populate attributes from a dict
+        Return the fields and datapoints changed since the datastream was
+        last committed, and its id, as a dict. The fields of a datastream
+        that has not been committed are all returned.
         """
-        for attribute in self._attributes:
-            attribute_value = inDict.get(attribute, None)
-            if attribute_value:
+        changes = self._changes()
+        if changes is None:
+            changes = dict()
+            if self.id is not None:
+                changes[DataFields.Id] = unicode(self.id)
+        return changes
 
-                if attribute == DataFields.Location:
-                    locationKwargs = attribute_value
-                    setattr(self, attribute, Location(**locationKwargs))
 
-                elif attribute == DataFields.Datastreams:
-                    if not hasattr(self, DataFields.Datastreams):
-                        setattr(self, attribute, dict())
-                    datastreams = getattr(self, DataFields.Datastreams)
-                    datastreamsKwargs = attribute_value
-                    for datastreamKwargs in datastreamsKwargs:
-                        datastream = Datastream(**datastreamKwargs)
-                        datastreams[datastream.id] = datastream
+class Environment(DataStructure):
+    """ Models a Cosm Environment (feed) object """
 
-                else:
-                    setattr(self, attribute, attribute_value)
+    _schema = [Field(DataFields.Creator, Field.Raw),
+               Field(DataFields.Datastreams, Field.Structure_Map, Datastream),
+               Field(DataFields.Description, Field.Raw),
+               Field(DataFields.Feed, Field.Raw),
+               Field(DataFields.Icon, Field.Raw),
+               Field(DataFields.Id, Field.Raw),
+               Field(DataFields.Location, Field.Structure, Location),
+               Field(DataFields.Private, Field.Raw),
+               Field(DataFields.Status, Field.Raw),
+               Field(DataFields.Tags, Field.Raw),
+               Field(DataFields.Title, Field.Raw),
+               Field(DataFields.Updated, Field.Raw),
+               Field(DataFields.Version, Field.Raw, default=version),
+               Field(DataFields.Website, Field.Raw)]
+    # the _lazy slot holds the nested structures of a lazily decoded
+    # environment that have not been accessed yet, and the _committed slot
+    # the state last committed by commit
+    __slots__ = ['creator', 'datastreams', 'description', 'feed', 'icon', 'id',
+                 'location', 'private', 'status', 'tags', 'title', 'updated',
+                 'version', 'website', '_lazy', '_committed']
+
+    @property
+    def updated_seconds(self):
+        """
+        The updated timestamp as seconds since the epoch, or None if it is
+        not set.
+        """
+        if self.updated is None:
+            return None
+        return parseTimestamp(self.updated)
+
+    @updated_seconds.setter
+    def updated_seconds(self, seconds):
+        if seconds is None:
+            self.updated = None
+        else:
+            self.updated = formatTimestamp(seconds)
 
     def toXml(self):
         """
@@ -1123,11 +1478,49 @@ class Environment(DataStructure):
 
             data_element = environment.find(DataFields.Data)
             if data_element is not None:
-                self.datastreams = []
+                self.datastreams = {}
                 for datastream in environment.findall(DataFields.Data):
                     ds = Datastream()
                     ds.fromXml(datastream)
-                    self.datastreams.append(ds)
+                    self.datastreams[ds.id] = ds
+
+    def toCsv(self):
+        """
+        Return the current values of the datastreams as id,value CSV rows,
+        the format accepted by Cosm when updating a feed.
+
+        @return: CSV representation of the object
+        @rtype: string
+        """
+        return "\n".join(["%s,%s" % (datastream.id, datastream.current_value)
+                          for datastream in self.datastreams.itervalues()
+                          if datastream.current_value is not None])
+
+    def fromCsv(self, data):
+        """
+        Populate the current values of the datastreams from id,timestamp,value
+        CSV rows, as returned by Cosm, or id,value rows.
+
+        @param data: The CSV rows
+        @type data: string
+        """
+        datastreams = self.datastreams
+        for row in data.splitlines():
+            row = row.strip()
+            if not row:
+                continue
+            fields = row.split(',', 2)
+            if len(fields) == 3 and _isTimestamp(fields[1]):
+                datastream_id, at_time, value = fields
+            else:
+                datastream_id, value = row.split(',', 1)
+                at_time = None
+            datastream = datastreams.get(datastream_id)
+            if datastream is None:
+                datastream = datastreams[datastream_id] = Datastream(id=datastream_id)
+            if at_time:
+                datastream.at = at_time
+            datastream.current_value = value
 
     def setCurrentValue(self, datastream_id, value):
         """
@@ -1161,6 +1554,90 @@ class Environment(DataStructure):
         datastream = self.datastreams[datastream_id]
         datastream.addDatapoint(at_time, value)
 
+    def snapshot(self):
+        """
+        Return the current state of the environment and its datastreams, to
+        be passed to commit once the update sent from that state has
+        succeeded.
+
+        @return: An opaque snapshot of the environment
+        @rtype: tuple
+        """
+        return (self._fieldsToDict(),
+                dict([(datastream_id, datastream.snapshot())
+                      for datastream_id, datastream in self.datastreams.iteritems()]))
+
+    def commit(self, snapshot=None):
+        """
+        Record the state of the environment and its datastreams as the
+        state held by Cosm, typically once an update_feed has succeeded, so
+        that only later changes are encoded by changesToDict.
+
+        @param snapshot: The snapshot to commit, taken when the update was
+                         encoded. If not set the current state is committed.
+        @type snapshot: tuple
+        """
+        fields, datastreams = snapshot or self.snapshot()
+        self._committed = fields
+        for datastream_id, datastream_snapshot in datastreams.iteritems():
+            datastream = self.datastreams.get(datastream_id)
+            if datastream is not None:
+                datastream.commit(datastream_snapshot)
+
+    def reset(self):
+        """
+        Forget the committed state so that the whole environment is treated
+        as changed.
+        """
+        self._committed = None
+        for datastream in self.datastreams.itervalues():
+            datastream.reset()
+
+    def _changes(self):
+        """
+        Return the dict of the fields and datastreams changed since the
+        last commit, or None if nothing has changed.
+        """
+        fields = self._fieldsToDict()
+        committed = getattr(self, '_committed', None)
+        if committed is None:
+            changes = fields
+        else:
+            changes = dict()
+            for key, value in fields.iteritems():
+                if committed.get(key) != value:
+                    changes[key] = value
+        datastreams = [datastream._changes() for datastream in self.datastreams.itervalues()]
+        datastreams = [datastream for datastream in datastreams if datastream is not None]
+        if datastreams:
+            changes[DataFields.Datastreams] = datastreams
+        if not changes:
+            return None
+        if self.version:
+            changes[DataFields.Version] = self.version
+        return changes
+
+    @property
+    def changed(self):
+        """
+        True if the environment or any of its datastreams has changed since
+        it was last committed
+        """
+        return self._changes() is not None
+
+    def changesToDict(self):
+        """
+        Return the fields and datastreams changed since the environment was
+        last committed, and its version, as a dict. Each changed datastream
+        holds only its changed fields and its id.
+        """
+        changes = self._changes()
+        if changes is None:
+            changes = dict()
+            if self.version:
+                changes[DataFields.Version] = self.version
+        return changes
+
     def setLocation(self, name=None, exposure=None, domain=None, disposition=None,
                     latitude=None, longitude=None, elevation=None):
         """
@@ -1206,6 +1683,95 @@ class Environment(DataStructure):
         self.location = Location(**locationKwargs)
 
 
+class LazyList(object):
+    """
+    A list of data structures that are held in their raw form, as decoded
+    dicts or XML elements, until they are first accessed.
+    """
+
+    __slots__ = ['items', 'factory']
+
+    def __init__(self, items, factory):
+        """
+        @param items: The raw items
+        @type items: list
+        @param factory: A callable that returns the data structure for a
+                        raw item
+        @type factory: callable
+        """
+        self.items = list(items)
+        self.factory = factory
+
+    def _item(self, index):
+        """
+        Return the data structure at an index, creating it if necessary
+        """
+        item = self.items[index]
+        if not isinstance(item, DataStructure):
+            item = self.items[index] = self.factory(item)
+        return item
+
+    def decoded(self):
+        """
+        Return the number of items that have been decoded
+        """
+        return len([item for item in self.items if isinstance(item, DataStructure)])
+
+    def append(self, item):
+        """
+        Add a data structure or raw item
+        """
+        self.items.append(item)
+
+    def extend(self, items):
+        """
+        Add a sequence of data structures or raw items
+        """
+        self.items.extend(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        for index in xrange(len(self.items)):
+            yield self._item(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in xrange(*index.indices(len(self.items)))]
+        return self._item(index)
+
+    def __setitem__(self, index, item):
+        self.items[index] = item
+
+    def __delitem__(self, index):
+        del self.items[index]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _lazyEnvironment(inDict):
+    """
+    Return an Environment lazily decoded from a dict
+    """
+    environment = Environment()
+    environment.fromDictLazy(inDict)
+    return environment
+
+
+def _xmlEnvironment(element):
+    """
+    Return an Environment decoded from a XML element
+    """
+    environment = Environment()
+    environment.fromXml(element)
+    return environment
+
+
 class EnvironmentList(DataStructure):
     """
     Models a Cosm Environment (feed) list object - this object is returned
@@ -1248,6 +1814,19 @@ class EnvironmentList(DataStructure):
             for result in results:
                 self.feeds.append(Environment(**result))
 
+    def fromDictLazy(self, inDict):
+        """
+        Populate attributes from a dict. Each feed is held as a dict until
+        it is first accessed, when it is lazily decoded into an Environment.
+        """
+        total_results = inDict.get(DataFields.Total_Results, None)
+        if total_results:
+            self.total_results = total_results
+
+        results = inDict.get(DataFields.Results, None)
+        if results:
+            self.feeds = LazyList(results, _lazyEnvironment)
+
     # The txcosm implementation never sends this structure to Cosm.
     # It only ever receives environment lists from Cosm.
     # Therefore toXml and encode methods are not really required.
@@ -1279,6 +1858,22 @@ class EnvironmentList(DataStructure):
                 env.fromXml(environment)
                 self.feeds.append(env)
 
+    def fromXmlLazy(self, element):
+        """
+        Populate attributes from a XML etree. Each feed is held as an
+        element until it is first accessed.
+
+        @param xml: an xml element tree
+        @type xml: etree.Element
+        """
+        total_results = element.find('{%s}%s' % (namespace_map[OPENSEARCH_NAMESPACE], DataFields.Total_Results))
+        if total_results is not None:
+            self.total_results = total_results.text
+
+        environments = element.findall(DataFields.Environment)
+        if environments:
+            self.feeds = LazyList(environments, _xmlEnvironment)
+
     def encode(self, format=DataFormats.JSON):
         """
         Return a string representation of the object encoded in the specified format.
@@ -1292,7 +1887,7 @@ class EnvironmentList(DataStructure):
         Return a string representation of the object encoded in the specified format
         """
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return JSONBackend.dumps(self.toDict())
 
         elif format == DataFormats.XML:
             eeml = etree.Element('eeml')
@@ -1315,17 +1910,24 @@ class EnvironmentList(DataStructure):
             raise Exception("Don't know how to encode %s using format %s" % (self.__class__.__name__,
                                                                              format))
 
-    def decode(self, data, format=DataFormats.JSON):
+    def decode(self, data, format=DataFormats.JSON, lazy=False):
         """
         Decode data, in the specified format, into local attributes
+
+        @param lazy: A flag requesting that each feed is only decoded when
+                     it is first accessed.
+        @type lazy: boolean
         """
         # The EnvironmentList object must specialise the decode method because it
         # needs to obtain data from the eeml header which is stripped off in the
         # inherited implementation.
         #
         if format == DataFormats.JSON:
-            inDict = json.loads(data)
-            self.fromDict(inDict)
+            inDict = JSONBackend.loads(data)
+            if lazy:
+                self.fromDictLazy(inDict)
+            else:
+                self.fromDict(inDict)
 
         elif format == DataFormats.XML:
             # parse xml string, rip off the eeml wrapper and process
@@ -1333,7 +1935,10 @@ class EnvironmentList(DataStructure):
             # viewable (feed, datastream, datapoint) XML items come
             # wrapped in the eeml, environment
             element = etree.fromstring(data)
-            self.fromXml(element)
+            if lazy:
+                self.fromXmlLazy(element)
+            else:
+                self.fromXml(element)
 
         else:
             raise Exception("Don't know how to decode %s using format %s" % (self.__class__.__name__,
@@ -1473,7 +2078,7 @@ class Trigger(DataStructure):
         Return a string representation of the object encoded in the specified format
         """
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return JSONBackend.dumps(self.toDict())
 
         elif format == DataFormats.XML:
             # This XML structure is not wrapped in EEML headers
@@ -1488,7 +2093,7 @@ class Trigger(DataStructure):
         Decode data, in the specified format, into local attributes
         """
         if format == DataFormats.JSON:
-            inDict = json.loads(data)
+            inDict = JSONBackend.loads(data)
             self.fromDict(inDict)
 
         elif format == DataFormats.XML:
@@ -1585,7 +2190,7 @@ class TriggerList(DataStructure):
         Return a string representation of the object encoded in the specified format
         """
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return JSONBackend.dumps(self.toDict())
 
         elif format == DataFormats.XML:
             # This XML structure is not wrapped in EEML headers
@@ -1602,7 +2207,7 @@ class TriggerList(DataStructure):
         if format == DataFormats.JSON:
             # The json structure of this object is actually a list.
             # wrap it in a dict for a consistent input to fromDict
-            inDict = {DataFields.Datastream_Trigger: json.loads(data)}
+            inDict = {DataFields.Datastream_Trigger: JSONBackend.loads(data)}
             self.fromDict(inDict)
 
         elif format == DataFormats.XML:
@@ -1791,7 +2396,7 @@ class Key(DataStructure):
         Return a string representation of the object encoded in the specified format
         """
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return JSONBackend.dumps(self.toDict())
 
         elif format == DataFormats.XML:
             # This XML structure is not wrapped in EEML headers
@@ -1806,7 +2411,7 @@ class Key(DataStructure):
         Decode data, in the specified format, into local attributes
         """
         if format == DataFormats.JSON:
-            inDict = json.loads(data)
+            inDict = JSONBackend.loads(data)
             self.fromDict(inDict)
 
         elif format == DataFormats.XML:
@@ -1890,7 +2495,7 @@ class KeyList(DataStructure):
         Return a string representation of the object encoded in the specified format
         """
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return JSONBackend.dumps(self.toDict())
 
         elif format == DataFormats.XML:
             # This XML structure is not wrapped in EEML headers
@@ -1905,7 +2510,7 @@ class KeyList(DataStructure):
         Decode data, in the specified format, into local attributes
         """
         if format == DataFormats.JSON:
-            inDict = json.loads(data)
+            inDict = JSONBackend.loads(data)
             self.fromDict(inDict)
 
         elif format == DataFormats.XML:
@@ -2157,7 +2762,7 @@ class User(DataStructure):
         Return a string representation of the object encoded in the specified format
         """
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return JSONBackend.dumps(self.toDict())
 
         elif format == DataFormats.XML:
             # This XML structure is not wrapped in EEML headers
@@ -2172,7 +2777,7 @@ class User(DataStructure):
         Decode data, in the specified format, into local attributes
         """
         if format == DataFormats.JSON:
-            inDict = json.loads(data)
+            inDict = JSONBackend.loads(data)
             self.fromDict(inDict)
 
         elif format == DataFormats.XML:
@@ -2264,7 +2869,7 @@ class UserList(DataStructure):
         Return a string representation of the object encoded in the specified format
         """
         if format == DataFormats.JSON:
-            return json.dumps(self.toDict())
+            return JSONBackend.dumps(self.toDict())
 
         elif format == DataFormats.XML:
             # This XML structure is not wrapped in EEML headers
@@ -2281,7 +2886,7 @@ class UserList(DataStructure):
         if format == DataFormats.JSON:
             # The json structure of this object is actually a list.
             # wrap it in a dict for a consistent input to fromDict
-            inDict = {DataFields.Users: json.loads(data)}
+            inDict = {DataFields.Users: JSONBackend.loads(data)}
             self.fromDict(inDict)
 
         elif format == DataFormats.XML: